@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageFilter
+
+
+def timeit(function, repeat):
+    """ Return the best time of the function call in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_page(width, height, seed=0):
+    """ Return noisy RGB page, so the blur has some work to do """
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+
+
+def random_boxes(count, width, height, seed=0):
+    """ Return list of random boxes (x, y, x1, y1) which look like text fields of the document """
+    rng = random.Random(seed)
+    boxes = []
+    for _ in range(count):
+        w, h = rng.randint(60, 600), rng.randint(15, 60)
+        x, y = rng.randint(0, width - w), rng.randint(0, height - h)
+        boxes.append((x, y, x + w, y + h))
+    return boxes
+
+
+def bench_redact(args):
+    """ Compare per-label PIL blur, PIL blur of the merged regions and the batched NumPy redaction """
+    from make_template import blur_region
+    from redact import merge_regions, redact
+    page = random_page(args.width, args.height)
+    boxes = random_boxes(args.boxes, args.width, args.height)
+
+    def per_label():
+        image = page.copy()
+        for box in boxes:
+            blur_region(image, box)
+
+    per_label_time = timeit(per_label, args.repeat)
+    array = np.asarray(page)  # the generator keeps decoded templates as arrays
+
+    def merged_pil():
+        result = array.copy()
+        for (x, y, x1, y1), _ in merge_regions(boxes):
+            region = Image.fromarray(result[y:y1, x:x1]).filter(ImageFilter.BLUR).filter(ImageFilter.BLUR)
+            result[y:y1, x:x1] = np.asarray(region)
+        return Image.fromarray(result)
+
+    merged_time = timeit(merged_pil, args.repeat)
+    batched_time = timeit(lambda: Image.fromarray(redact(array.copy(), boxes)), args.repeat)
+    print(f"Page {args.width}x{args.height}, {args.boxes} redact boxes, best of {args.repeat}")
+    print(f"per-label PIL blur:  {1000 * per_label_time:8.1f} ms")
+    print(f"merged PIL blur:     {1000 * merged_time:8.1f} ms ({per_label_time / merged_time:.1f}x)")
+    print(f"batched redact:      {1000 * batched_time:8.1f} ms ({per_label_time / batched_time:.1f}x)")
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """ Return percentiles and the maximum of the values """
+    values = np.asarray(values, dtype=np.float64)
+    return [float(np.percentile(values, p)) for p in points] + [float(values.max())]
+
+
+def synthetic_image(path, width, height, band=1024):
+    """ Write gradient RGB image into the PPM file band by band, so the huge image never is in RAM """
+    header = 'P6\n{0} {1}\n255\n'.format(width, height).encode()
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(len(header) + width * height * 3)
+    pixels = np.memmap(path, dtype=np.uint8, mode='r+', offset=len(header), shape=(height, width, 3))
+    x = np.arange(width, dtype=np.uint32)
+    for top in range(0, height, band):
+        y = np.arange(top, min(top + band, height), dtype=np.uint32)[:, None]
+        pixels[top:top + len(y), :, 0] = x * 255 // max(width - 1, 1)
+        pixels[top:top + len(y), :, 1] = y * 255 // max(height - 1, 1)
+        pixels[top:top + len(y), :, 2] = ((x // 64 + y // 64) % 2) * 255  # checkerboard shows the tiles
+    pixels.flush()
+    del pixels
+
+
+def default_events(view_width, view_height):
+    """ Return sequence of the wheel and drag events: zoom in, pan around, zoom out """
+    x, y = view_width // 2, view_height // 2
+    events = [{"type": "wheel", "x": x, "y": y, "delta": 120} for _ in range(12)]
+    for dx, dy in ((-40, 0), (0, -40), (40, 0), (0, 40)):
+        events += [{"type": "drag", "dx": dx, "dy": dy} for _ in range(15)]
+    events += [{"type": "wheel", "x": x, "y": y, "delta": -120} for _ in range(16)]
+    return events
+
+
+def replay_viewer(path, events, view_width, view_height, cache_budget):
+    """ Open the image like the viewer does and replay the events over it. Run in a child process.
+        The preview time is until the first frame could be shown, the build time is until the pyramid
+        is refined completely in the background. The events are replayed over the complete pyramid """
+    from prefetch import ImageCache
+    from pyramid import HUGE_SIZE, open_pyramid
+    from rawimage import RawImage
+    from viewport import Viewport
+    huge_size = HUGE_SIZE
+    Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for the big image
+    start = time.perf_counter()
+    image = Image.open(path)
+    width, height = image.size
+    raw = RawImage.from_image(image) if width * height > huge_size * huge_size else None
+    with ThreadPoolExecutor(max_workers=1) as refiner:
+        pyramid = open_pyramid(path, raw, huge_size, executor=refiner)
+        preview_time = time.perf_counter() - start
+        pyramid.refine()
+        list(pyramid)  # wait for the levels which are built in the background
+        build_time = time.perf_counter() - start
+    viewport = Viewport(width, height, pyramid, raw, huge_size)
+    view = (0.0, 0.0, float(view_width), float(view_height))  # visible area of the canvas
+    box_image = [0.0, 0.0, float(width), float(height)]  # the image is shown at 1:1 scale first
+    cache = ImageCache(cache_budget)  # stands in for the PhotoImage cache of the tiles
+    frames, rendered = [], 0
+    for event in [None] + list(events):  # the first frame shows the opened image
+        start = time.perf_counter()
+        if event is not None and event["type"] == "wheel":
+            factor = viewport.zoom(1 if event["delta"] > 0 else -1, view_width, view_height)
+            if factor is None:
+                continue
+            x, y = event["x"], event["y"]
+            box_image = [x + (box_image[0] - x) * factor, y + (box_image[1] - y) * factor,
+                         x + (box_image[2] - x) * factor, y + (box_image[3] - y) * factor]
+        elif event is not None and event["type"] == "drag":
+            box_image = [box_image[0] + event["dx"], box_image[1] + event["dy"],
+                         box_image[2] + event["dx"], box_image[3] + event["dy"]]
+        # Keep the image in the scroll region like the canvas does
+        for a, b, size in ((0, 2, view_width), (1, 3, view_height)):
+            length = box_image[b] - box_image[a]
+            low, high = sorted((0.0, size - length))
+            shift = min(max(box_image[a], low), high) - box_image[a]
+            box_image[a] += shift
+            box_image[b] += shift
+        zoom = viewport.zoom_key
+        for tile, box in viewport.tiles(box_image, view):
+            key = (zoom,) + tile
+            if key not in cache:  # only the newly exposed tiles are rendered
+                tile_image = viewport.render_tile(*box)
+                tile_image.load()
+                cache.put(key, tile_image, 4 * tile_image.width * tile_image.height)
+                rendered += 1
+        frames.append(time.perf_counter() - start)
+    pyramid.close()
+    if raw is not None:
+        raw.close()
+    image.close()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # kilobytes on Linux
+    return width, height, raw is not None, preview_time, build_time, frames, rendered, peak
+
+
+def bench_viewer(args):
+    """ Replay wheel and drag events over synthetic images of different sizes """
+    if args.events:
+        with open(args.events, 'r') as f:
+            events = json.load(f)
+    else:
+        events = default_events(args.view_width, args.view_height)
+    print(f"View {args.view_width}x{args.view_height}, {len(events)} events")
+    print(f"{'image':>13} {'huge':>5} {'preview s':>9} {'build s':>8} {'frames':>6} {'tiles':>6} "
+          f"{'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7} {'max ms':>7} {'peak MB':>8}")
+    for size in args.sizes:
+        width, height = size, size * 9 // 16
+        path = os.path.join(args.tmp, f'viewer_{width}x{height}.ppm')
+        if not os.path.exists(path):
+            synthetic_image(path, width, height)
+        try:
+            # Every image is opened in a fresh process, so peak memory is measured per image
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                result = executor.submit(replay_viewer, path, events, args.view_width, args.view_height,
+                                         args.cache << 20).result()
+        finally:
+            if not args.keep:
+                os.remove(path)
+        width, height, huge, preview_time, build_time, frames, rendered, peak = result
+        p50, p90, p99, worst = (1000 * value for value in percentiles(frames))
+        print(f"{f'{width}x{height}':>13} {'yes' if huge else 'no':>5} {preview_time:9.2f} {build_time:8.2f} {len(frames):6d} "
+              f"{rendered:6d} {p50:7.1f} {p90:7.1f} {p99:7.1f} {worst:7.1f} {peak / (1 << 20):8.0f}")
+
+
+def current_rss():
+    """ Return resident set size of the process in bytes """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):  # no /proc, the peak is the best we have
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bench_soak(args):
+    """ Switch images like the labeller does many times and watch the memory. The switch is replayed headless
+        through the session and the ImageView of the canvas: the labels and the prefetched pyramid are taken,
+        the view of the previous image is closed, the new one is opened and its visible tiles are rendered.
+        With --window the switches go through the labeller window itself, it needs a display """
+    workdir = os.path.join(args.tmp, 'labeller_soak')
+    directory = os.path.join(workdir, 'templates')
+    os.makedirs(directory, exist_ok=True)
+    types = ["Redact_Blur", "Redact_Blur_Text", "Ticker", "Account_Name", "Value", "Curr_Ticker", "Date"]
+    for i in range(args.images):
+        name = os.path.join(directory, f'page_{i:03d}')
+        if not os.path.exists(name + '.jpg'):
+            random_page(args.width, args.height, seed=i).save(name + '.jpg', quality=85)
+            with open(name + '.txt', 'w') as f:
+                f.writelines(f'{types[j % len(types)]} {x} {y} {x1} {y1}\n'
+                             for j, (x, y, x1, y1) in enumerate(random_boxes(args.labels, args.width, args.height, i)))
+    os.chdir(workdir)  # the pyramid cache and the catalog of the soak stay in the work folder
+    if args.window:
+        from instrument import profiler
+        from label import App
+        app = App(directory='templates')
+        app.geometry(f'{args.view_width}x{args.view_height}')
+        app.update()
+        profiler.enabled = True  # counts the created PhotoImages
+
+        def switch(file_name):
+            app.change_img(file_name)
+            app.update()  # the canvas is drawn
+
+        def counts():  # live Tk images are the PhotoImages which are not freed yet
+            return len(app.tk.call('image', 'names')), profiler.counters['photoimage']
+        files, close = app.files, app.close
+        columns = ('images', 'created')
+    else:
+        from session import Session
+        from viewport import ImageView
+        session = Session('templates', types)
+        view = ImageView(64 << 20, lambda image: (image.copy(), 4 * image.width * image.height))
+        visible = (0.0, 0.0, float(args.view_width), float(args.view_height))  # visible area of the canvas
+
+        def switch(file_name):
+            pyramid = session.load_file(file_name)
+            viewport = view.open(file_name, pyramid, session.pyramid_cache, session.refiner)
+            for tile, box in viewport.tiles([0.0, 0.0, float(view.image.width), float(view.image.height)], visible):
+                view.tile((viewport.zoom_key,) + tile, box)
+            if not view.pyramid.complete:
+                view.pyramid.refine()  # the first frame is shown, build the rest of the pyramid
+            session.prefetch_neighbours(file_name)
+
+        def counts():
+            return len(view.tile_cache), view.rendered
+
+        def close():
+            view.close()
+            session.shutdown()
+        files = session.files
+        columns = ('tiles', 'rendered')
+    samples, times = [], []
+    for i in range(args.switches):
+        start = time.perf_counter()
+        switch(files[(i + 1) % len(files)])
+        times.append(time.perf_counter() - start)
+        if i % args.every == 0 or i == args.switches - 1:
+            samples.append((i + 1, current_rss()) + counts())
+    close()
+    print(f"{args.switches} switches over {args.images} images {args.width}x{args.height} with {args.labels} labels")
+    print(f"{'switches':>8} {'RSS MB':>8} {columns[0]:>8} {columns[1]:>8}")
+    for switches, rss, live, made in samples:
+        print(f"{switches:8d} {rss / (1 << 20):8.1f} {live:8d} {made:8d}")
+    p50, p90, p99, worst = (1000 * value for value in percentiles(times))
+    print(f"switch latency p50 {p50:.1f} p90 {p90:.1f} p99 {p99:.1f} max {worst:.1f} ms")
+    # memory growth after the caches are warm, every image was shown at least once
+    warm = [sample[:2] for sample in samples if sample[0] > 2 * args.images] or [sample[:2] for sample in samples]
+    if len(warm) > 1:
+        x, y = np.array(warm, dtype=np.float64).T
+        slope = np.polyfit(x, y, 1)[0]
+        print(f"RSS growth after warm-up: {slope * 1000 / (1 << 20):.2f} MB per 1000 switches")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the labeller and the generator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    redact_parser = subparsers.add_parser("redact", help="redaction of the template regions")
+    redact_parser.add_argument("--width", type=int, default=2480, help="page width (A4 at 300 dpi by default)")
+    redact_parser.add_argument("--height", type=int, default=3508, help="page height")
+    redact_parser.add_argument("--boxes", type=int, default=40, help="number of redact boxes on the page")
+    redact_parser.add_argument("--repeat", type=int, default=5, help="number of runs, the best one is reported")
+    redact_parser.set_defaults(run=bench_redact)
+
+    viewer_parser = subparsers.add_parser("viewer", help="zoom and pan of the image viewer")
+    viewer_parser.add_argument("--sizes", type=int, nargs="+", default=[2000, 8000, 20000],
+                               help="widths of the synthetic 16:9 images")
+    viewer_parser.add_argument("--events", help="JSON file with the recorded wheel and drag events")
+    viewer_parser.add_argument("--view-width", type=int, default=1280, help="width of the visible area")
+    viewer_parser.add_argument("--view-height", type=int, default=800, help="height of the visible area")
+    viewer_parser.add_argument("--cache", type=int, default=64, help="budget of the tile cache in MB")
+    viewer_parser.add_argument("--tmp", default=tempfile.gettempdir(), help="directory for the synthetic images")
+    viewer_parser.add_argument("--keep", action="store_true", help="keep the synthetic images for the next run")
+    viewer_parser.set_defaults(run=bench_viewer)
+
+    soak_parser = subparsers.add_parser("soak", help="memory of the labeller over many image switches")
+    soak_parser.add_argument("--switches", type=int, default=1000, help="number of image switches")
+    soak_parser.add_argument("--images", type=int, default=20, help="number of the synthetic templates")
+    soak_parser.add_argument("--width", type=int, default=2480, help="template width")
+    soak_parser.add_argument("--height", type=int, default=3508, help="template height")
+    soak_parser.add_argument("--labels", type=int, default=200, help="number of labels of every template")
+    soak_parser.add_argument("--every", type=int, default=50, help="RSS is sampled every this many switches")
+    soak_parser.add_argument("--view-width", type=int, default=1280, help="width of the visible area")
+    soak_parser.add_argument("--view-height", type=int, default=800, help="height of the visible area")
+    soak_parser.add_argument("--tmp", default=tempfile.gettempdir(), help="work folder of the soak")
+    soak_parser.add_argument("--window", action="store_true",
+                             help="switch the images in the labeller window and count its live PhotoImages")
+    soak_parser.set_defaults(run=bench_soak)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import bisect
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.tif')
+SIZE_BINS = (0, 16, 32, 64, 128, 256, 512, 1024)  # histogram bins of the box size sqrt(w * h) in pixels
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,          -- path of the image as it was scanned
+    directory TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,                  -- NULL if the image could not be opened
+    height INTEGER,
+    label_path TEXT,                -- NULL if the image has no label file
+    label_mtime_ns INTEGER,
+    labels INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+CREATE TABLE IF NOT EXISTS boxes (
+    path TEXT NOT NULL REFERENCES images (path) ON DELETE CASCADE,
+    cls TEXT NOT NULL,
+    bin INTEGER NOT NULL,           -- index in SIZE_BINS
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxes_path ON boxes (path);
+'''
+
+
+def read_boxes(label_path, width=None, height=None):
+    """ Return class names and Nx4 boxes (x, y, x1, y1) in pixels from the label file.
+        Labels of the labeller are 'type x y x1 y1' with the class name, YOLO labels 'id cx cy w h' have
+        the integer class id and are normalized to [0, 1]. YOLO boxes stay normalized without the image size """
+    with open(label_path, 'r') as f:
+        fields = [line.split() for line in f if line.strip()]
+    fields = [row for row in fields if len(row) >= 5]
+    if not fields:
+        return [], np.empty((0, 4), dtype=np.float32)
+    table = np.array([row[:5] for row in fields], dtype=str)
+    boxes = table[:, 1:5].astype(np.float32)
+    yolo = bool(np.char.isdigit(table[:, 0]).all())  # the labeller writes class names, YOLO the class ids
+    if width and height and yolo:
+        cx, cy, w, h = (boxes * np.array([width, height, width, height], dtype=np.float32)).T
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    return table[:, 0].tolist(), boxes
+
+
+def probe(task):
+    """ Return (path, width, height, number of labels, [(class, bin, count)]) of the image. Called in the workers """
+    path, label_path = task
+    try:
+        with Image.open(path) as image:  # only the header is read
+            width, height = image.size
+    except OSError:
+        width = height = None
+    counts = []
+    labels = 0
+    if label_path is not None:
+        try:
+            classes, boxes = read_boxes(label_path, width, height)
+        except (OSError, ValueError):
+            classes, boxes = [], np.empty((0, 4), dtype=np.float32)
+        labels = len(classes)
+        if labels:
+            sides = np.sqrt(np.abs((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])))
+            bins = np.searchsorted(SIZE_BINS, sides, side='right') - 1
+            names, inverse = np.unique(np.array(classes), return_inverse=True)
+            pairs, number = np.unique(np.stack([inverse.reshape(-1), bins], axis=1), axis=0, return_counts=True)
+            counts = [(str(names[c]), int(b), int(n)) for (c, b), n in zip(pairs.tolist(), number.tolist())]
+    return path, width, height, labels, counts
+
+
+class Catalog:
+    """ SQLite catalog of the images, their sizes, label files and per-class box statistics.
+        Scans are incremental: only images or label files with changed mtime are probed again """
+    def __init__(self, path='catalog.sqlite'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.execute('PRAGMA journal_mode = WAL')  # readers don't wait for the scan
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, directory, extensions=IMAGE_EXTENSIONS, workers=None, parallel=256):
+        """ Bring the catalog of the directory up to date. Return number of the probed images.
+            Images are probed in the process pool when there are more than parallel of them """
+        directory = os.path.normpath(directory)
+        files = {}  # name -> stat of all files in the directory
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[entry.name] = entry.stat()
+        known = {path: (mtime, size, label_mtime) for path, mtime, size, label_mtime in self.db.execute(
+            'SELECT path, mtime_ns, size, label_mtime_ns FROM images WHERE directory = ?', (directory,))}
+        found, changed = {}, []
+        for name, stat in files.items():
+            stem, extension = os.path.splitext(name)
+            if extension not in extensions:
+                continue
+            path = os.path.normpath(os.path.join(directory, name))
+            label = files.get(stem + '.txt')
+            label_path = os.path.normpath(os.path.join(directory, stem + '.txt')) if label is not None else None
+            label_mtime = label.st_mtime_ns if label is not None else None
+            found[path] = (stat.st_mtime_ns, stat.st_size, label_path, label_mtime)
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size, label_mtime):
+                changed.append((path, label_path))
+        if len(changed) > parallel and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(probe, changed, chunksize=64))
+        else:
+            results = [probe(task) for task in changed]
+        with self.db:  # one transaction for the whole scan
+            gone = [(path,) for path in known if path not in found]
+            self.db.executemany('DELETE FROM images WHERE path = ?', gone)
+            self.__store(directory, found, results)
+        return len(results)
+
+    def refresh(self, paths):
+        """ Probe the images again, e.g. after their label files were written """
+        found = {}
+        for path in map(os.path.normpath, paths):
+            label_path = os.path.splitext(path)[0] + '.txt'
+            label_mtime = os.stat(label_path).st_mtime_ns if os.path.exists(label_path) else None
+            stat = os.stat(path)
+            found[path] = (stat.st_mtime_ns, stat.st_size, label_path if label_mtime is not None else None, label_mtime)
+        with self.db:
+            for path, (_, _, label_path, _) in found.items():
+                self.__store(os.path.dirname(path) or '.', {path: found[path]}, [probe((path, label_path))])
+
+    def __store(self, directory, found, results):
+        self.db.executemany('DELETE FROM boxes WHERE path = ?', [(result[0],) for result in results])
+        self.db.executemany(
+            'INSERT OR REPLACE INTO images (path, directory, mtime_ns, size, width, height, label_path, '
+            'label_mtime_ns, labels) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(path, directory, found[path][0], found[path][1], width, height, found[path][2], found[path][3], labels)
+             for path, width, height, labels, _ in results])
+        self.db.executemany('INSERT INTO boxes (path, cls, bin, count) VALUES (?, ?, ?, ?)',
+                            [(path, cls, b, n) for path, _, _, _, counts in results for cls, b, n in counts])
+
+    def images(self, directory=None, labelled=None, cls=None):
+        """ Return sorted paths of the images, optionally only (un)labelled ones or ones with the class """
+        query, args = 'SELECT path FROM images WHERE 1', []
+        if directory is not None:
+            query += ' AND directory = ?'
+            args.append(os.path.normpath(directory))
+        if labelled is not None:
+            query += ' AND label_path IS NOT NULL' if labelled else ' AND label_path IS NULL'
+        if cls is not None:
+            query += ' AND path IN (SELECT path FROM boxes WHERE cls = ?)'
+            args.append(cls)
+        return [path for path, in self.db.execute(query + ' ORDER BY path', args)]
+
+    def labelled(self, directory=None):
+        """ Return sorted (image, label file) pairs """
+        query, args = 'SELECT path, label_path FROM images WHERE label_path IS NOT NULL', []
+        if directory is not None:
+            query += ' AND directory = ?'
+            args.append(os.path.normpath(directory))
+        return self.db.execute(query + ' ORDER BY path', args).fetchall()
+
+    def info(self, path):
+        """ Return (width, height, label file, number of labels) of the image or None """
+        return self.db.execute('SELECT width, height, label_path, labels FROM images WHERE path = ?',
+                               (os.path.normpath(path),)).fetchone()
+
+    def class_counts(self, directory=None):
+        """ Return {class: (number of boxes, number of images)} """
+        query = 'SELECT cls, SUM(count), COUNT(DISTINCT boxes.path) FROM boxes JOIN images USING (path)'
+        args = []
+        if directory is not None:
+            query += ' WHERE directory = ?'
+            args.append(os.path.normpath(directory))
+        return {cls: (boxes, images) for cls, boxes, images in self.db.execute(query + ' GROUP BY cls', args)}
+
+    def classes(self, directory=None):
+        """ Return {path: set of classes of the boxes} of the labelled images """
+        query = 'SELECT images.path, cls FROM boxes JOIN images USING (path)'
+        args = []
+        if directory is not None:
+            query += ' WHERE directory = ?'
+            args.append(os.path.normpath(directory))
+        classes = {}
+        for path, cls in self.db.execute(query, args):
+            classes.setdefault(path, set()).add(cls)
+        return classes
+
+    def size_histogram(self, directory=None):
+        """ Return {class: array of box counts in the SIZE_BINS} """
+        query = 'SELECT cls, bin, SUM(count) FROM boxes JOIN images USING (path)'
+        args = []
+        if directory is not None:
+            query += ' WHERE directory = ?'
+            args.append(os.path.normpath(directory))
+        histograms = {}
+        for cls, b, n in self.db.execute(query + ' GROUP BY cls, bin', args):
+            histograms.setdefault(cls, np.zeros(len(SIZE_BINS), dtype=np.int64))[b] = n
+        return histograms
+
+    def summary(self, directory=None):
+        """ Return (number of images, labelled images, boxes) """
+        query = 'SELECT COUNT(*), COUNT(label_path), COALESCE(SUM(labels), 0) FROM images'
+        args = []
+        if directory is not None:
+            query += ' WHERE directory = ?'
+            args.append(os.path.normpath(directory))
+        return self.db.execute(query, args).fetchone()
+
+
+class NameIndex:
+    """ Search index over the file names for the file picker. Prefix matches go first, then the other
+        names containing the query, every group in the order of the paths """
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.position = {path: i for i, path in enumerate(self.paths)}  # path -> its index
+        names = [os.path.basename(path).lower() for path in self.paths]
+        self.__names = np.array(names, dtype=str)
+        self.__order = sorted(range(len(names)), key=names.__getitem__)  # indices by name, for prefix search
+        self.__sorted = [names[i] for i in self.__order]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def search(self, query):
+        """ Return indices of the paths which names start with or contain the query """
+        query = query.strip().lower()
+        if not query:
+            return np.arange(len(self.paths))
+        lo = bisect.bisect_left(self.__sorted, query)
+        hi = bisect.bisect_left(self.__sorted, query + '\uffff')
+        prefix = np.sort(np.array(self.__order[lo:hi], dtype=np.int64))
+        contains = np.flatnonzero(np.char.find(self.__names, query) > 0)  # found, but not at the start
+        return np.concatenate([prefix, contains]) if len(self.paths) else prefix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog of the images and their labels")
+    parser.add_argument("--db", default="catalog.sqlite", help="catalog file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="update the catalog of the directories")
+    scan_parser.add_argument("directories", nargs="+")
+    scan_parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+
+    list_parser = subparsers.add_parser("list", help="print paths of the images")
+    list_parser.add_argument("directory", nargs="?")
+    group = list_parser.add_mutually_exclusive_group()
+    group.add_argument("--labelled", action="store_true", default=None, help="only images with label files")
+    group.add_argument("--unlabelled", dest="labelled", action="store_false", help="only images without label files")
+    list_parser.add_argument("--class", dest="cls", help="only images with boxes of the class")
+
+    stats_parser = subparsers.add_parser("stats", help="print per-class box counts and size histograms")
+    stats_parser.add_argument("directory", nargs="?")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.command == "scan":
+        for directory in args.directories:
+            print(f"{directory}: {catalog.scan(directory, workers=args.workers)} images probed")
+    elif args.command == "list":
+        for path in catalog.images(args.directory, args.labelled, args.cls):
+            print(path)
+    elif args.command == "stats":
+        images, labelled, boxes = catalog.summary(args.directory)
+        print(f"{images} images, {labelled} labelled, {boxes} boxes")
+        histograms = catalog.size_histogram(args.directory)
+        print(f"{'class':<20} {'boxes':>8} {'images':>7}  " + " ".join(f"{'>=' + str(b):>6}" for b in SIZE_BINS))
+        for cls, (count, images) in sorted(catalog.class_counts(args.directory).items()):
+            print(f"{cls:<20} {count:8d} {images:7d}  " + " ".join(f"{n:6d}" for n in histograms[cls]))
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
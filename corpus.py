@@ -0,0 +1,174 @@
+import os
+import random
+import string
+import numpy as np
+
+UPPERCASE = np.frombuffer(string.ascii_uppercase.encode('utf-32-le'), dtype=np.uint32)
+DIGITS = np.frombuffer(string.digits.encode('utf-32-le'), dtype=np.uint32)
+ALPHANUMERIC = np.concatenate([UPPERCASE, DIGITS])
+LETTERS = np.frombuffer(string.ascii_letters.encode('utf-32-le'), dtype=np.uint32)
+
+MONTHS = np.array(['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                   'August', 'September', 'October', 'November', 'December'])
+WEEKDAYS = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+# date formats with their strftime weights, the long ones are more frequent
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%m-%d-%Y", "%Y/%m/%d", "%d-%m-%Y", "%B %d, %Y",
+                "%A, %B %d %Y", "%B %d, %Y", "%A, %B %d %Y", "%A, %B %d %Y", "%B %d, %Y", "%B %d %Y"]
+
+
+def strings(codes):
+    """ Return array of strings from NxL array of code points, zero code points are cut from the end """
+    codes = np.ascontiguousarray(codes, dtype=np.uint32)
+    return codes.view('<U{0}'.format(codes.shape[1])).reshape(-1)
+
+
+def pick(rng, alphabet, n, k):
+    """ Return NxK array of random characters of the alphabet """
+    return alphabet[rng.integers(0, len(alphabet), (n, k))]
+
+
+def gen_curr_tickers(rng, n):
+    return strings(pick(rng, UPPERCASE, n, 3))
+
+
+def gen_tickers(rng, n):
+    """ One to three chunks of 5 letters joined with underscores """
+    codes = pick(rng, UPPERCASE, n, 17)
+    codes[:, [5, 11]] = ord('_')
+    length = 6 * rng.integers(1, 4, n) - 1
+    codes[np.arange(17) >= length[:, None]] = 0
+    return strings(codes)
+
+
+def gen_ibans(rng, n):
+    return strings(np.concatenate([pick(rng, UPPERCASE, n, 2), pick(rng, DIGITS, n, 2),
+                                   pick(rng, ALPHANUMERIC, n, 16)], axis=1))
+
+
+def gen_swift_codes(rng, n):
+    return strings(np.concatenate([pick(rng, UPPERCASE, n, 8), pick(rng, DIGITS, n, 3)], axis=1))
+
+
+def gen_dates(rng, n):
+    """ Dates from 1900 to 2100 in random formats, 20% of them are 'ASAP' """
+    year = rng.integers(1900, 2101, n)
+    month = rng.integers(1, 13, n)
+    day = rng.integers(1, 29, n)
+    days = (np.array(year - 1970, dtype='datetime64[Y]').astype('datetime64[M]') + (month - 1)).astype('datetime64[D]')
+    weekday = ((days.astype(np.int64) + day - 1) + 3) % 7  # 1970-01-01 was Thursday
+    fields = {'%Y': year.astype(str), '%m': np.char.zfill(month.astype(str), 2), '%d': np.char.zfill(day.astype(str), 2),
+              '%B': MONTHS[month - 1], '%A': WEEKDAYS[weekday]}
+    chosen = rng.integers(0, len(DATE_FORMATS), n)
+    out = np.empty(n, dtype=object)
+    for i, fmt in enumerate(DATE_FORMATS):
+        rows = np.flatnonzero(chosen == i)
+        text = np.full(len(rows), '', dtype=object)
+        for token in filter(None, fmt.replace('%', '\0%').split('\0')):  # '%Y-', '%m-', '%d'
+            text = text + fields[token[:2]][rows].astype(object) + token[2:]
+        out[rows] = text
+    out[rng.random(n) < 0.2] = 'ASAP'
+    return out.astype(str)
+
+
+def gen_currency_values(rng, n):
+    """ Values from 1 to 100000 with a currency letter before or after them or with thousands separators """
+    value = np.round(rng.uniform(1, 100000, n), 2)
+    symbol = strings(pick(rng, LETTERS, n, 1))
+    plain = np.char.mod('%.2f', value)
+    position = rng.integers(0, 3, n)
+    separated = np.array(['{0:,.2f}'.format(v) for v in value.tolist()])
+    dots = rng.random(n) < 0.5  # the separator is a comma or a dot
+    separated[dots] = np.char.replace(separated[dots], ',', '.')
+    return np.where(position == 0, np.char.add(symbol, plain),
+                    np.where(position == 1, np.char.add(plain, symbol), separated))
+
+
+class _Sentences:
+    """ Sentences of the essential_generators DocumentGenerator. The generator is slow to construct,
+        so it is created only when the pool is refilled """
+    generator = None
+
+    @classmethod
+    def get(cls):
+        if cls.generator is None:
+            from essential_generators import DocumentGenerator
+            cls.generator = DocumentGenerator()
+        return cls.generator
+
+
+def gen_sentences(rng, n):
+    random.seed(int(rng.integers(1 << 31)))  # the generator uses the global random module
+    g = _Sentences.get()
+    return np.array([g.gen_sentence(min_words=2, max_words=10) for _ in range(n)])
+
+
+def gen_account_names(rng, n):
+    random.seed(int(rng.integers(1 << 31)))
+    g = _Sentences.get()
+    names = [g.gen_sentence(min_words=2, max_words=4) for _ in range(n)]
+    for i, name in enumerate(names):  # some spaces become ' and ' or ' & '
+        name = name.replace(" ", " and ", int(rng.integers(0, name.count(" ") + 1)))
+        names[i] = name.replace(" ", " & ", int(rng.integers(0, name.count(" ") + 1)))
+    return np.array(names)
+
+
+class CorpusPool:
+    """ Pre-generated texts of every field type, they are drawn at random by the generator.
+        The pool is kept in the .npz file between runs and it is refilled only when a field is missing,
+        so the texts cost an index lookup per label """
+    fields = {
+        'date': gen_dates,
+        'value': gen_currency_values,
+        'curr_ticker': gen_curr_tickers,
+        'ticker': gen_tickers,
+        'iban': gen_ibans,
+        'swift': gen_swift_codes,
+        'sentence': gen_sentences,
+        'account_name': gen_account_names,
+    }
+
+    def __init__(self, path='.corpus_pool.npz', size=20000, seed=0):
+        self.path = path
+        self.size = size  # number of texts of every field
+        self.seed = seed
+        self.__texts = None  # field -> array of texts, loaded on the first draw
+
+    def load(self):
+        """ Read the pool from the file and generate the missing fields """
+        texts = {}
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as f:
+                    texts = {field: f[field] for field in f.files if len(f[field]) >= self.size}
+            except (OSError, ValueError):
+                texts = {}  # broken file, the pool is generated again
+        missing = [field for field in self.fields if field not in texts]
+        for field in missing:
+            rng = np.random.default_rng([self.seed, list(self.fields).index(field)])
+            texts[field] = self.fields[field](rng, self.size)
+        self.__texts = texts
+        if missing:
+            self.save()
+        return self
+
+    def refill(self):
+        """ Generate all fields again with the next seed """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.seed += 1
+        return self.load()
+
+    def save(self):
+        tmp = self.path + '.tmp.npz'
+        np.savez(tmp, **self.__texts)
+        os.replace(tmp, self.path)  # workers never see a half-written pool
+
+    def texts(self, field):
+        if self.__texts is None:
+            self.load()
+        return self.__texts[field]
+
+    def draw(self, field):
+        """ Return random text of the field, drawn with the random module, so seeding it makes draws repeatable """
+        texts = self.texts(field)
+        return str(texts[random.randrange(len(texts))])
@@ -0,0 +1,287 @@
+import argparse
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from catalog import IMAGE_EXTENSIONS
+from group import walk
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    dhash INTEGER,                  -- 64 bits stored as signed integer, NULL if the image could not be opened
+    phash INTEGER
+);
+'''
+
+
+def dct_matrix(n):
+    """ Return NxN matrix of the orthonormal DCT-II, dct(x) = m @ x """
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+DCT32 = dct_matrix(32)
+BIT_WEIGHTS = (1 << np.arange(63, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def pack_bits(bits):
+    """ Return uint64 of 64 booleans, the first one is the highest bit """
+    return np.uint64(np.bitwise_or.reduce(BIT_WEIGHTS[np.asarray(bits).reshape(64)]))
+
+
+def dhash(gray):
+    """ Difference hash: signs of the horizontal gradients of the 9x8 thumbnail """
+    pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray):
+    """ Perceptual hash: low 8x8 DCT frequencies of the 32x32 thumbnail above their median, the DC term excluded """
+    pixels = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    low = (DCT32 @ pixels @ DCT32.T)[:8, :8].reshape(-1)
+    return pack_bits(low > np.median(low[1:]))
+
+
+def hash_image(task):
+    """ Return (path, mtime, size, dhash, phash) of the image, the hashes are None if it can't be read.
+        Called in the workers """
+    path, mtime, size = task
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (64, 64))  # JPEG is decoded at the reduced scale
+            gray = image.convert('L')
+    except OSError:
+        return path, mtime, size, None, None
+    return path, mtime, size, int(dhash(gray).view(np.int64)), int(phash(gray).view(np.int64))
+
+
+def popcount(values):
+    """ Return number of the set bits of the uint64 array """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[values.reshape(values.shape + (1,)).view(np.uint8)].sum(axis=-1)
+
+
+def near_pairs(hashes, threshold, block=2048):
+    """ Return Kx2 array of index pairs i < j of the hashes within the Hamming distance threshold.
+        The 64 bits are split into threshold + 1 chunks, near hashes share at least one chunk,
+        so only the hashes in the same bucket of a chunk value are compared. A big bucket, e.g. of a static camera,
+        is compared in tiles of block x block hashes, so the memory doesn't grow with the bucket """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    chunks = threshold + 1
+    bounds = np.linspace(0, 64, chunks + 1).astype(np.uint64)
+    pairs = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        key = (hashes >> lo) & np.uint64((1 << int(hi - lo)) - 1)  # Python int, the 64 bit mask doesn't overflow
+        order = np.argsort(key, kind='stable')
+        starts = np.flatnonzero(np.r_[True, key[order][1:] != key[order][:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            members = order[start:end]
+            for i in range(0, len(members), block):  # block x block tiles keep the distance matrix small
+                rows = members[i:i + block]
+                for j in range(i, len(members), block):  # the tiles above the diagonal, every pair once
+                    columns = members[j:j + block]
+                    distance = popcount(hashes[rows][:, None] ^ hashes[columns][None, :])
+                    if i == j:
+                        distance[np.tril_indices(len(rows))] = threshold + 1  # no self pairs and no mirrored ones
+                    r, c = np.nonzero(distance <= threshold)
+                    a, b = rows[r], columns[c]
+                    pairs.append(np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs).astype(np.int64), axis=0)
+
+
+def clusters(n, pairs):
+    """ Return array of the cluster root of every item, the root is the smallest index of the cluster """
+    parent = np.arange(n)
+    for a, b in pairs.tolist():  # union-find with the smaller index as the root
+        while parent[a] != a:
+            a = parent[a]
+        while parent[b] != b:
+            b = parent[b]
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    while True:  # compress the paths at once
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+class HashIndex:
+    """ Perceptual hashes of the images in the SQLite file, rehashed only when the image changed """
+    def __init__(self, path='dedupe.sqlite'):
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, directory, extensions=IMAGE_EXTENSIONS, workers=None, parallel=256):
+        """ Hash the new and changed images of the directory tree. Return number of the hashed images """
+        known = {path: (mtime, size) for path, mtime, size in self.db.execute(
+            'SELECT path, mtime_ns, size FROM hashes WHERE path >= ? AND path < ?', self.__range(directory))}
+        found, changed = set(), []
+        for path, _ in walk(directory, extensions):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            found.add(path)
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                changed.append((path, stat.st_mtime_ns, stat.st_size))
+        if len(changed) > parallel and workers != 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(hash_image, changed, chunksize=64))
+        else:
+            results = [hash_image(task) for task in changed]
+        with self.db:
+            self.db.executemany('DELETE FROM hashes WHERE path = ?', [(path,) for path in known if path not in found])
+            self.db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)', results)
+        return len(results)
+
+    @staticmethod
+    def __range(directory):
+        """ Return bounds of the paths under the directory for the range query """
+        prefix = os.path.join(os.path.abspath(directory), '')
+        return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+    def forget(self, paths):
+        """ Drop the images from the index, e.g. after they were pruned """
+        with self.db:
+            self.db.executemany('DELETE FROM hashes WHERE path = ?', [(os.path.abspath(path),) for path in paths])
+
+    def hashes(self, directory=None, kinds=('dhash',)):
+        """ Return sorted absolute paths and Nxlen(kinds) uint64 array of their hashes.
+            Only the images which have all the hashes are returned, so the columns are aligned by path """
+        if isinstance(kinds, str):
+            kinds = (kinds,)
+        query = 'SELECT path, {0} FROM hashes WHERE {1}'.format(
+            ', '.join(kinds), ' AND '.join('{0} IS NOT NULL'.format(kind) for kind in kinds))
+        args = ()
+        if directory is not None:
+            query += ' AND path >= ? AND path < ?'
+            args = self.__range(directory)
+        rows = self.db.execute(query + ' ORDER BY path', args).fetchall()
+        paths = [row[0] for row in rows]
+        values = np.array([row[1:] for row in rows], dtype=np.int64).reshape(-1, len(kinds))
+        return paths, values.view(np.uint64)
+
+    def duplicates(self, directory=None, threshold=4, kind='dhash'):
+        """ Return list of (duplicate, kept image) pairs. The kept image is the first path of the cluster
+            in the sorted order. With kind 'both' the images must be near in both hashes """
+        kinds = ['dhash', 'phash'] if kind == 'both' else [kind]
+        paths, columns = self.hashes(directory, kinds)
+        pairs = None
+        for hashes in columns.T:
+            unique, inverse = np.unique(hashes, return_inverse=True)  # equal hashes are compared once
+            near = near_pairs(unique, threshold)
+            found = expand(inverse.reshape(-1), near)
+            pairs = found if pairs is None else intersect(pairs, found)
+        roots = clusters(len(paths), pairs)
+        return [(paths[i], paths[root]) for i, root in enumerate(roots.tolist()) if root != i]
+
+
+def expand(inverse, near):
+    """ Return pairs of the items i < j whose unique hashes are equal or near """
+    order = np.argsort(inverse, kind='stable')
+    starts = np.searchsorted(inverse[order], np.arange(inverse.max() + 1 if len(inverse) else 0))
+    ends = np.r_[starts[1:], len(order)]
+    pairs = []
+    groups = [order[s:e] for s, e in zip(starts, ends)]
+    for group in groups:  # items with the equal hash are chained to the first one
+        if len(group) > 1:
+            pairs.append(np.stack([np.full(len(group) - 1, group[0]), group[1:]], axis=1))
+    for a, b in near.tolist():  # the first items of the near hashes are linked
+        pairs.append(np.array([[groups[a][0], groups[b][0]]]))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def intersect(a, b):
+    """ Return pairs of the clusters of a which are linked in the clusters of b too """
+    n = int(max(a.max(initial=-1), b.max(initial=-1))) + 1
+    if len(a) == 0 or len(b) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    ra, rb = clusters(n, a), clusters(n, b)
+    items = np.unique(np.concatenate([a.reshape(-1), b.reshape(-1)]))
+    keys = ra[items] * n + rb[items]  # items of the same cluster in both
+    order = np.argsort(keys, kind='stable')
+    first = np.flatnonzero(np.r_[True, keys[order][1:] != keys[order][:-1]])
+    heads = np.repeat(items[order][first], np.diff(np.r_[first, len(order)]))
+    pairs = np.stack([heads, items[order]], axis=1)
+    return pairs[pairs[:, 0] != pairs[:, 1]]
+
+
+def prune(duplicates, trash, root='.'):
+    """ Move the duplicates and their label files into the trash folder, keeping their paths relative to the root.
+        Paths outside the root keep their whole absolute path under the trash. Return list of the moved images """
+    root = os.path.join(os.path.abspath(root), '')
+    moved = []
+    for path, _ in duplicates:
+        path = os.path.abspath(path)
+        relative = path[len(root):] if path.startswith(root) else os.path.splitdrive(path)[1].lstrip(os.sep)
+        target = os.path.join(os.path.abspath(trash), relative)
+        if os.path.exists(target):  # never overwrite what is in the trash
+            print(f"{target} exists, {path} is left in place")
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+        label = os.path.splitext(path)[0] + '.txt'
+        if os.path.exists(label):
+            shutil.move(label, os.path.splitext(target)[0] + '.txt')
+        moved.append(path)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicate images by their perceptual hashes")
+    parser.add_argument("--db", default="dedupe.sqlite", help="index of the hashes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="hash the new and changed images of the folders")
+    scan_parser.add_argument("directories", nargs="+")
+    scan_parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+
+    find_parser = subparsers.add_parser("find", help="print or handle the near-duplicates")
+    find_parser.add_argument("directory", nargs="?")
+    find_parser.add_argument("--threshold", type=int, default=4, help="maximal Hamming distance of the hashes")
+    find_parser.add_argument("--hash", choices=["dhash", "phash", "both"], default="dhash")
+    action = find_parser.add_mutually_exclusive_group()
+    action.add_argument("--prune", metavar="TRASH", help="move the duplicates into this folder")
+    action.add_argument("--tag", metavar="FILE", help="write 'duplicate kept' lines for group.py --duplicates")
+    args = parser.parse_args()
+
+    index = HashIndex(args.db)
+    if args.command == "scan":
+        for directory in args.directories:
+            print(f"{directory}: {index.scan(directory, workers=args.workers)} images hashed")
+    elif args.command == "find":
+        duplicates = index.duplicates(args.directory, args.threshold, args.hash)
+        if args.prune:
+            moved = prune(duplicates, args.prune, args.directory or ".")
+            index.forget(moved)
+            print(f"{len(moved)} duplicates moved to {args.prune}")
+        elif args.tag:
+            with open(args.tag, "w") as f:
+                f.write("".join(f"{path}\t{kept}\n" for path, kept in duplicates))
+            print(f"{len(duplicates)} duplicates written to {args.tag}")
+        else:
+            for path, kept in duplicates:
+                print(f"{path}\t{kept}")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,186 @@
+import argparse
+import collections
+import hashlib
 import os
+import re
 import numpy as np
+from catalog import Catalog, IMAGE_EXTENSIONS
 
-pics = [os.path.join(os.getcwd(), 'pic', file) for file in os.listdir(os.path.join(os.getcwd(), 'pic')) if 
-'.txt' not in file]
-print(len(pics))
-percentage = 10.0
-numberOfFiles = int((percentage/100)*len(pics))
-
-lol = np.random.choice(pics, numberOfFiles, replace=False)
-with open('train.txt', 'w') as file:
-	for i in pics:
-		if i not in lol:
-			file.write(i + '\n')
-with open('test.txt', 'w') as file:
-	for i in lol:
-		file.write(i + '\n')
+
+def walk(directory, extensions=IMAGE_EXTENSIONS):
+	""" Yield (image, label file or None) of the directory and its subdirectories, one directory in memory at a time """
+	stack = [directory]
+	while stack:
+		current = stack.pop()
+		files, labels = [], set()
+		with os.scandir(current) as entries:
+			for entry in entries:
+				if entry.is_dir():
+					stack.append(entry.path)
+				elif entry.name.endswith('.txt'):
+					labels.add(entry.name[:-4])
+				elif os.path.splitext(entry.name)[1] in extensions:
+					files.append(entry.name)
+		for name in files:
+			stem = os.path.splitext(name)[0]
+			yield os.path.join(current, name), os.path.join(current, stem + '.txt') if stem in labels else None
+
+
+def walk_catalog(directory, catalog, extensions=IMAGE_EXTENSIONS):
+	""" Yield (image, set of classes) of the directory tree, the classes are taken from the catalog """
+	for current, _, _ in os.walk(directory):
+		catalog.scan(current, extensions)
+		classes = catalog.classes(current)
+		for path in catalog.images(current):
+			yield path, classes.get(path, set())
+
+
+def label_classes(label_path):
+	""" Return set of the classes of the label file, the class is the first field of the line """
+	if label_path is None:
+		return set()
+	with open(label_path, 'r') as f:
+		return {line.split(None, 1)[0] for line in f if line.strip()}
+
+
+def stable_hash(key, salt=''):
+	""" Return number in [0, 1) of the key. It depends only on the key, so new frames never move the old ones """
+	digest = hashlib.blake2b(key.encode(), digest_size=8, key=salt.encode()[:64]).digest()
+	return int.from_bytes(digest, 'little') / 2.0 ** 64
+
+
+def content_key(path, chunk=1 << 20):
+	""" Return hash of the file content, so the split survives renames of the files """
+	h = hashlib.blake2b(digest_size=16)
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(chunk), b''):
+			h.update(block)
+	return h.hexdigest()
+
+
+def unit_key(path, directory, group, hash_mode):
+	""" Return key of the unit which goes into one split: the group of the image or the image itself """
+	relative = os.path.relpath(path, directory).replace(os.sep, '/')
+	if group is not None:
+		match = group.search(relative)
+		if match:
+			return 'group:' + (match.group(1) if group.groups else match.group(0))
+	return content_key(path) if hash_mode == 'content' else relative
+
+
+def read_previous(names):
+	""" Return {absolute path: split index} of the existing list files """
+	previous = {}
+	for index, name in enumerate(names):
+		if os.path.exists(name):
+			with open(name, 'r') as f:
+				for line in f:
+					if line.strip():
+						previous[os.path.normpath(line.strip())] = index
+	return previous
+
+
+def read_duplicates(name):
+	""" Return {duplicate: kept image} of the 'duplicate<TAB>kept' lines written by dedupe.py find --tag """
+	with open(name, 'r') as f:
+		return dict(line.rstrip('\n').split('\t') for line in f if line.strip())
+
+
+def assign(units, shares, previous, stratify, salt=''):
+	""" Return list of path lists of the splits.
+		units is {key: (paths, classes)}. Units listed before stay in their split. New units go by the stable
+		hash into the split of its share or, with stratify, to the split which is the most behind its share
+		in the stratum of the unit; the stratum is the rarest class of the unit """
+	shares = np.asarray(shares, dtype=np.float64) / np.sum(shares)
+	edges = np.cumsum(shares)[:-1]
+	frequency = collections.Counter(cls for paths, classes in units.values() for cls in classes for _ in paths)
+	lists = [[] for _ in shares]
+	counts = collections.defaultdict(lambda: np.zeros(len(shares)))  # stratum -> images in the splits
+	new = []
+	for key, (paths, classes) in units.items():
+		stratum = min(classes, key=lambda cls: (frequency[cls], cls)) if classes else ''
+		old = [previous[p] for p in paths if p in previous]
+		if old:
+			split = collections.Counter(old).most_common(1)[0][0]
+			lists[split].extend(paths)
+			counts[stratum][split] += len(paths)
+		else:
+			new.append((stratum, stable_hash(key, salt), key))
+	new.sort()  # by stratum and hash, so the order doesn't depend on the directory listing
+	for stratum, u, key in new:
+		paths = units[key][0]
+		if stratify:
+			count = counts[stratum]
+			split = int(np.argmax(shares * (count.sum() + len(paths)) - count))
+		else:
+			split = int(np.searchsorted(edges, u, side='right'))
+		lists[split].extend(paths)
+		counts[stratum][split] += len(paths)
+	return lists
+
+
+def write_list(name, paths):
+	""" Write the paths at once and replace the old list atomically """
+	tmp = name + '.tmp'
+	with open(tmp, 'w') as f:
+		f.write(''.join(path + '\n' for path in sorted(paths)))
+	os.replace(tmp, name)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Split the images into train and test lists or k folds')
+	parser.add_argument('directory', nargs='?', default='pic', help='folder of the images, subfolders included')
+	parser.add_argument('--test', type=float, default=10.0, help='percentage of the test images')
+	parser.add_argument('--folds', type=int, help='write k fold lists fold0.txt... instead of train and test')
+	parser.add_argument('--stratify', action='store_true', help='balance the splits in every class')
+	parser.add_argument('--group', choices=['none', 'camera'], default='none',
+						help='camera keeps all images of a camera subfolder in one split')
+	parser.add_argument('--group-pattern', help='regular expression of the relative path, its first group is the group')
+	parser.add_argument('--hash', choices=['path', 'content'], default='path',
+						help='hash the relative path or the content of the image')
+	parser.add_argument('--salt', default='', help='salt of the hash, another salt gives another split')
+	parser.add_argument('--output', default='.', help='folder of the list files')
+	parser.add_argument('--reset', action='store_true', help='ignore the existing list files')
+	parser.add_argument('--catalog', default='catalog.sqlite',
+						help='catalog of the labels, only changed folders are read again')
+	parser.add_argument('--no-catalog', dest='catalog', action='store_const', const=None,
+						help='read all label files instead of the catalog')
+	parser.add_argument('--duplicates', help='file of dedupe.py find --tag, a duplicate goes into the split of its kept image')
+	parser.add_argument('--drop-duplicates', action='store_true', help='leave the duplicates out of the lists')
+	args = parser.parse_args()
+
+	if args.folds:
+		names = ['fold{0}.txt'.format(i) for i in range(args.folds)]
+		shares = [1.0] * args.folds
+	else:
+		names = ['train.txt', 'test.txt']
+		shares = [100.0 - args.test, args.test]
+	names = [os.path.join(args.output, name) for name in names]
+	pattern = args.group_pattern or (r'^([^/]+)/' if args.group == 'camera' else None)
+	group = re.compile(pattern) if pattern else None
+
+	duplicates = read_duplicates(args.duplicates) if args.duplicates else {}
+	units = {}  # key -> (paths, classes)
+	catalog = Catalog(args.catalog) if args.catalog else None
+	images = walk_catalog(args.directory, catalog) if catalog else \
+		((path, label_classes(label_path)) for path, label_path in walk(args.directory))
+	for path, classes in images:
+		path = os.path.abspath(path)
+		kept = duplicates.get(path, path)
+		if kept != path and args.drop_duplicates:
+			continue
+		paths, unit_classes = units.setdefault(unit_key(kept, args.directory, group, args.hash), ([], set()))
+		paths.append(path)
+		unit_classes.update(classes)
+	if catalog:
+		catalog.close()
+
+	previous = {} if args.reset else read_previous(names)
+	lists = assign(units, shares, previous, args.stratify, args.salt)
+	for name, paths in zip(names, lists):
+		write_list(name, paths)
+		print('{0}: {1} images'.format(name, len(paths)))
+
+
+if __name__ == '__main__':
+	main()
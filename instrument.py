@@ -0,0 +1,108 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Profiler:
+    """ Timings and counters of the hot paths, exported as Chrome trace JSON (chrome://tracing, Perfetto).
+        Spans cost one clock call when the profiler is disabled """
+    def __init__(self, enabled=False, capacity=200000, window=120):
+        self.enabled = enabled
+        self.__start = time.perf_counter()
+        self.__events = collections.deque(maxlen=capacity)  # trace events, the oldest ones are dropped
+        self.__recent = collections.defaultdict(lambda: collections.deque(maxlen=window))  # name -> (end, seconds)
+        self.counters = collections.Counter()  # name -> number of the events
+        self.__lock = threading.Lock()
+
+    def __now(self):
+        return (time.perf_counter() - self.__start) * 1e6  # trace time is in microseconds
+
+    def record(self, name, start, duration):
+        """ Record span of the duration in seconds, start is the time.perf_counter() value """
+        if not self.enabled:
+            return
+        ts = (start - self.__start) * 1e6
+        self.__recent[name].append((start + duration, duration))
+        self.__events.append({'name': name, 'ph': 'X', 'ts': ts, 'dur': duration * 1e6,
+                              'pid': os.getpid(), 'tid': threading.get_ident()})
+
+    def span(self, name):
+        """ Context manager which records the time of the block """
+        return _Span(self, name)
+
+    def count(self, name, delta=1):
+        """ Increase the counter and put its value into the trace """
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.counters[name] += delta
+            value = self.counters[name]
+        self.__events.append({'name': name, 'ph': 'C', 'ts': self.__now(), 'pid': os.getpid(),
+                              'args': {name: value}})
+
+    def gauge(self, name, value):
+        """ Put current value of the quantity into the trace """
+        if not self.enabled:
+            return
+        self.counters[name] = value
+        self.__events.append({'name': name, 'ph': 'C', 'ts': self.__now(), 'pid': os.getpid(),
+                              'args': {name: value}})
+
+    def latency(self, name, percentile=50):
+        """ Return percentile of the recent durations of the span in milliseconds or None """
+        durations = sorted(duration for _, duration in self.__recent.get(name, ()))
+        if not durations:
+            return None
+        return 1000 * durations[min(len(durations) - 1, len(durations) * percentile // 100)]
+
+    def rate(self, name, period=1.0):
+        """ Return number of the spans per second over the last period """
+        now = time.perf_counter()
+        return sum(1 for end, _ in self.__recent.get(name, ()) if now - end <= period) / period
+
+    def export(self, path):
+        """ Write the trace as Chrome trace JSON """
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': list(self.__events), 'displayTimeUnit': 'ms'}, f)
+
+    def clear(self):
+        self.__events.clear()
+        self.__recent.clear()
+        self.counters.clear()
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter() - self.start)
+
+
+profiler = Profiler()  # shared by the labeller modules
+
+
+def timed(name):
+    """ Decorator which records every call of the function as a span of the shared profiler """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
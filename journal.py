@@ -0,0 +1,115 @@
+import os
+import numpy as np
+
+
+class LabelJournal:
+    """ Append-only journal of the label operations of one image.
+        Records are lines 'add index type x y x1 y1', 'bin index...', 'retrieve index...', 'delete index...'
+        with indices of the LabelStore rows. The journal is replayed over the labels from the text file
+        after a crash and it is compacted into the text file on export.
+        A 'base index...' record maps rows of the compacted text file to the indices of the session """
+    def __init__(self, path, batch=16):
+        self.path = path
+        self.batch = batch  # number of records between fsync calls
+        self.records = 0  # number of records since the last compaction
+        self.__pending = 0  # number of records which are not synced to the disk
+        self.__file = None  # opened lazily, so an untouched image gets no journal
+
+    def __write(self, line):
+        if self.__file is None:
+            self.__file = open(self.path, 'a')
+        self.__file.write(line)
+        self.records += 1
+        self.__pending += 1
+        if self.__pending >= self.batch:
+            self.sync()
+
+    def add(self, labels, index):
+        x, y, x1, y1 = labels.box(index)
+        self.__write('add {0} {1} {2!r} {3!r} {4!r} {5!r}\n'.format(index, labels.type(index), x, y, x1, y1))
+
+    def bin(self, indices):
+        """ Record label (or list of labels) moved to the bin """
+        self.__write('bin {0}\n'.format(' '.join(str(int(i)) for i in np.atleast_1d(indices))))
+
+    def retrieve(self, indices):
+        self.__write('retrieve {0}\n'.format(' '.join(str(int(i)) for i in np.atleast_1d(indices))))
+
+    def delete(self, indices):
+        if len(indices):
+            self.__write('delete {0}\n'.format(' '.join(str(int(i)) for i in indices)))
+
+    def sync(self):
+        """ Flush pending records to the disk """
+        if self.__file is not None and self.__pending:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+        self.__pending = 0
+
+    def close(self):
+        self.sync()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def replay(self, labels):
+        """ Apply the journal to the labels read from the text file. Return set of the binned indices.
+            The journal is rewritten in the indices of the labels, so the session continues it """
+        binned = set()
+        if not os.path.exists(self.path):
+            return binned
+        with open(self.path, 'r') as f:
+            lines = f.read().split('\n')
+        base = labels.count  # rows from the text file
+        mapping = {}  # journal index -> index in labels, the same index if absent
+        for line in lines[:-1]:  # the last line is empty or it was cut by the crash
+            op, *args = line.split()
+            if op == 'base':
+                mapping = {int(index): row for row, index in enumerate(args)}
+            elif op == 'add':
+                mapping[int(args[0])] = labels.add(*map(float, args[2:6]), args[1])
+            else:
+                indices = [mapping.get(int(index), int(index)) for index in args]
+                if op == 'bin':
+                    binned.update(indices)
+                elif op == 'retrieve':
+                    binned.difference_update(indices)
+                elif op == 'delete':
+                    labels.delete(indices)
+                    binned.difference_update(indices)
+        # Rewrite the journal in the indices of the labels
+        indices = labels.indices()
+        self.__rewrite(['add {0} {1} {2!r} {3!r} {4!r} {5!r}\n'.format(index, labels.type(index), *labels.box(index))
+                        for index in range(base, labels.count) if labels.rows['alive'][index]] +
+                       ['delete {0}\n'.format(index) for index in range(base) if not labels.rows['alive'][index]] +
+                       ['bin {0}\n'.format(index) for index in sorted(binned)])
+        return binned
+
+    def compact(self, labels, text_file_name, binned=()):
+        """ Write the labels into the text file and start the journal from it """
+        tmp = text_file_name + '.tmp'
+        labels.save(tmp)
+        with open(tmp, 'r+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, text_file_name)  # the text file is replaced atomically
+        indices = labels.indices()
+        lines = ['bin {0}\n'.format(index) for index in sorted(binned)]
+        if not np.array_equal(indices, np.arange(len(indices))):  # rows of the text file aren't the session indices
+            lines.insert(0, 'base {0}\n'.format(' '.join(str(int(i)) for i in indices)))
+        self.__rewrite(lines)  # the journal is removed when nothing is left in it
+
+    def __rewrite(self, lines):
+        """ Replace the journal with the lines """
+        self.close()
+        if not lines:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.records = 0
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.records = 0
@@ -1,10 +1,16 @@
 import tkinter as tk
 from tkinter import ttk
 from PIL import Image, ImageDraw, ImageTk
-import glob
+import argparse
 import os
-import math
-import warnings
+import numpy as np
+from pyramid import HUGE_SIZE, reduce_huge
+from spatial import normalized
+from viewport import ImageView
+from instrument import profiler, timed
+from session import Session
+from yolo import ClassMap, normalize, write_labels
+from propagate import propagate
 
 
 class AutoScrollbar(ttk.Scrollbar):
@@ -16,12 +22,178 @@ class AutoScrollbar(ttk.Scrollbar):
             self.grid()
             ttk.Scrollbar.set(self, lo, hi)
 
+class VirtualList(ttk.Frame):
+    """ List which shows only the visible rows. Items could be any sequence, the rows are rendered
+        by the render function, so a list of a hundred thousand items costs as much as a screen of them """
+    def __init__(self, master, rows=15, width=40, render=str, command=None, click=None, selected=None):
+        super().__init__(master)
+        self.items = []
+        self.render = render  # item -> text of the row
+        self.command = command  # called with the index of the chosen item
+        self.click = click  # called with the index of the clicked item and the event instead of the command
+        self.selected = selected  # item -> True if the row is selected, only the current row by default
+        self.rows = rows  # number of the visible rows
+        self.top = 0  # index of the first visible item
+        self.current = None  # index of the highlighted item
+        self.listbox = tk.Listbox(self, height=rows, width=width, activestyle='none', exportselection=False)
+        self.scrollbar = AutoScrollbar(self, orient='vertical', command=self.__scroll)
+        self.listbox.grid(row=0, column=0, sticky='nswe')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.columnconfigure(0, weight=1)
+        self.listbox.bind('<MouseWheel>', lambda event: self.scroll(-1 if event.delta > 0 else 1))
+        self.listbox.bind('<Button-4>', lambda event: self.scroll(-1))
+        self.listbox.bind('<Button-5>', lambda event: self.scroll(1))
+        self.listbox.bind('<ButtonRelease-1>', self.__click)
+        self.listbox.bind('<Up>', lambda event: self.move(-1))
+        self.listbox.bind('<Down>', lambda event: self.move(1))
+        self.listbox.bind('<Prior>', lambda event: self.move(-self.rows))
+        self.listbox.bind('<Next>', lambda event: self.move(self.rows))
+        self.listbox.bind('<Return>', lambda event: self.choose(self.current))
+
+    def set_items(self, items, keep=False):
+        """ Show the items from the start, or at the same position if keep """
+        self.items = items
+        if keep:
+            self.top = max(0, min(self.top, len(items) - self.rows))
+            self.current = min(self.current, len(items) - 1) if self.current is not None and len(items) else None
+        else:
+            self.top = 0
+            self.current = 0 if len(items) else None
+        self.refresh()
+
+    def row(self, event):
+        """ Return index of the item under the cursor or None """
+        index = self.top + self.listbox.nearest(event.y)
+        return index if len(self.items) and index < len(self.items) else None
+
+    def refresh(self):
+        """ Render the visible rows """
+        self.listbox.delete(0, 'end')
+        visible = range(self.top, min(self.top + self.rows, len(self.items)))
+        self.listbox.insert('end', *[self.render(self.items[i]) for i in visible])
+        if self.selected is not None:
+            for row, i in enumerate(visible):
+                if self.selected(self.items[i]):
+                    self.listbox.selection_set(row)
+        elif self.current is not None and self.top <= self.current < self.top + self.rows:
+            self.listbox.selection_set(self.current - self.top)
+        total = max(len(self.items), 1)
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + self.rows) / total))
+
+    def scroll(self, rows):
+        self.see_top(self.top + rows)
+
+    def see_top(self, top):
+        self.top = max(0, min(int(top), len(self.items) - self.rows))
+        self.refresh()
+
+    def see(self, index):
+        """ Scroll so the item is visible and highlight it """
+        self.current = index
+        if not self.top <= index < self.top + self.rows:
+            self.top = max(0, min(index - self.rows // 2, len(self.items) - self.rows))
+        self.refresh()
+
+    def move(self, step):
+        if len(self.items):
+            self.see(min(max(0, (self.current or 0) + step), len(self.items) - 1))
+        return 'break'
+
+    def choose(self, index):
+        if index is not None and self.command is not None:
+            self.command(index)
+
+    def __scroll(self, *args):
+        """ Respond to the scrollbar """
+        if args[0] == 'moveto':
+            self.see_top(float(args[1]) * len(self.items))
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]) * (self.rows if args[2] == 'pages' else 1))
+
+    def __click(self, event):
+        index = self.row(event)
+        if index is not None:
+            self.current = index
+            if self.click is not None:
+                self.click(index, event)
+            else:
+                self.choose(index)
+
+
+class FilePicker(ttk.Frame):
+    """ Entry with the name of the current file. Typing filters the files by the name index,
+        the matches are shown in the virtual list under the entry """
+    def __init__(self, master, index, command, width=40):
+        super().__init__(master)
+        self.index = index  # NameIndex of the files
+        self.command = command  # called with the chosen path
+        self.matches = np.arange(len(index))  # indices of the files matching the query
+        self.query = tk.StringVar()
+        self.__job = None  # scheduled filtering
+        self.entry = ttk.Entry(self, textvariable=self.query, width=width)
+        self.entry.grid(row=0, column=0)
+        ttk.Button(self, text='\u25be', width=2, command=self.toggle).grid(row=0, column=1)
+        self.popup = tk.Toplevel(self)
+        self.popup.withdraw()
+        self.popup.overrideredirect(True)
+        self.list = VirtualList(self.popup, width=width,
+                                render=lambda i: os.path.basename(self.index.paths[i]), command=self.__choose)
+        self.list.pack(fill='both', expand=True)
+        self.entry.bind('<KeyRelease>', self.__typed)
+        self.entry.bind('<Down>', self.__down)
+        self.entry.bind('<Return>', lambda event: self.list.choose(self.list.current))
+        self.entry.bind('<Escape>', lambda event: self.hide())
+        self.list.listbox.bind('<Escape>', lambda event: self.hide())
+
+    def set(self, path):
+        """ Show the current file in the entry """
+        self.query.set(os.path.basename(path))
+        self.hide()
+
+    def show(self):
+        self.popup.geometry('+{0}+{1}'.format(self.entry.winfo_rootx(),
+                                              self.entry.winfo_rooty() + self.entry.winfo_height()))
+        self.popup.deiconify()
+        self.popup.lift()
+
+    def hide(self):
+        self.popup.withdraw()
+
+    def toggle(self):
+        if self.popup.winfo_viewable():
+            self.hide()
+        else:
+            self.__filter('')
+            self.show()
+
+    def __down(self, event):
+        """ Go from the entry to the list of the matches """
+        self.show()
+        self.list.listbox.focus_set()
+        return self.list.move(1)
+
+    def __typed(self, event):
+        if event.keysym in ('Return', 'Escape', 'Down', 'Up'):
+            return
+        if self.__job is not None:
+            self.after_cancel(self.__job)
+        self.__job = self.after(150, self.__filter, None)  # filter when the user stops typing
+
+    def __filter(self, query):
+        self.__job = None
+        self.matches = self.index.search(self.query.get() if query is None else query)
+        self.list.set_items(self.matches)
+        self.show()
+
+    def __choose(self, row):
+        self.hide()
+        self.command(self.index.paths[self.matches[row]])
+
+
 class CanvasImage:
     """ Display and zoom image """
-    def __init__(self, placeholder, path):
-        """ Initialize the ImageFrame """
-        self.imscale = 1.0  # scale for the canvas image zoom, public for outer classes
-        self.__delta = 1.3  # zoom magnitude
+    def __init__(self, placeholder, path, pyramid=None):
+        """ Initialize the ImageFrame, pyramid could be prepared in advance by the prefetcher """
         self.__filter = Image.ANTIALIAS  # could be: NEAREST, BILINEAR, BICUBIC and ANTIALIAS
         self.__previous_state = 0  # previous state of the keyboard
         self.path = path  # path to the image, should be public for outer classes
@@ -48,84 +220,86 @@ class CanvasImage:
         self.canvas.bind('<Button-5>',   self.__wheel)  # zoom for Linux, wheel scroll down
         self.canvas.bind('<Button-4>',   self.__wheel)  # zoom for Linux, wheel scroll up
         self.canvas.bind("<ButtonRelease-1>", self.__on_release)
+        self.canvas.bind('<Motion>', self.__hover)  # highlight the label under the cursor
+        self.canvas.bind('<ButtonPress-3>', self.__select)  # send the label under the cursor to the bin
         # Handle keystrokes in idle mode, because program slows down on a weak computers,
         # when too many key stroke events in the same time
         self.canvas.bind('<Key>', lambda event: self.canvas.after_idle(self.__keystroke, event))
-        # Decide if this image huge or not
-        self.__huge = False  # huge or not
-        self.__huge_size = 14000  # define size of the huge image
+        self.canvas.bind('<F3>', lambda event: self.toggle_overlay())  # show or hide the FPS overlay
+        self.__huge_size = HUGE_SIZE  # define size of the huge image
         self.__band_width = 1024  # width of the tile band
-        Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for the big image
-        with warnings.catch_warnings():  # suppress DecompressionBombWarning
-            warnings.simplefilter('ignore')
-            self.__image = Image.open(self.path)  # open image, but down't load it
-        self.imwidth, self.imheight = self.__image.size  # public for outer classes
-        if self.imwidth * self.imheight > self.__huge_size * self.__huge_size and \
-           self.__image.tile[0][0] == 'raw':  # only raw images could be tiled
-            self.__huge = True  # image is huge
-            self.__offset = self.__image.tile[0][2]  # initial tile offset
-            self.__tile = [self.__image.tile[0][0],  # it have to be 'raw'
-                           [0, 0, self.imwidth, 0],  # tile extent (a rectangle)
-                           self.__offset,
-                           self.__image.tile[0][3]]  # list of arguments to the decoder
-        self.__min_side = min(self.imwidth, self.imheight)  # get the smaller image side
-        # Create image pyramid
-        self.__pyramid = [self.smaller()] if self.__huge else [Image.open(self.path)]
-        # Set ratio coefficient for image pyramid
-        self.__ratio = max(self.imwidth, self.imheight) / self.__huge_size if self.__huge else 1.0
-        self.__curr_img = 0  # current image from the pyramid
-        self.__scale = self.imscale * self.__ratio  # image pyramide scale
         self.__reduction = 2  # reduction degree of image pyramid
-        w, h = self.__pyramid[-1].size
-        while w > 512 and h > 512:  # top pyramid image is around 512 pixels in size
-            w /= self.__reduction  # divide on reduction degree
-            h /= self.__reduction  # divide on reduction degree
-            self.__pyramid.append(self.__pyramid[-1].resize((int(w), int(h)), self.__filter))
+        # Image is shown by tiles of the fixed size, ready tiles are kept in the LRU cache of the view
+        self.__view = ImageView(64 << 20, self.__photo)  # buffers of the shown image
+        self.__tiles = {}  # (column, row) -> (canvas item, zoom, PhotoImage) of the shown tiles
+        self.__spare_tiles = []  # hidden canvas items which could be reused for new tiles
         # Put image into container rectangle and use it to set proper coordinates to the image
-        self.container = self.canvas.create_rectangle((0, 0, self.imwidth, self.imheight), width=0)
+        self.container = self.canvas.create_rectangle((0, 0, 0, 0), width=0)
 
-        if self.parent_container.labels_created != []:
-            for label in self.parent_container.labels_created:
-                label.rectangle_drawn = self.canvas.create_rectangle(label.x, label.y, label.x1, label.y1, outline="green2")
-                label.text_drawn = self.canvas.create_text(label.x, label.y, text=label.type, fill="green2")
+        # Labels are drawn only when they are in the visible area
+        self.__drawn = set()  # labels which have items on the canvas
+        self.__hovered = None  # label under the cursor
+        self.__overlay = None  # canvas item of the FPS and latency overlay
+        self.__overlay_job = None  # scheduled refresh of the overlay
+        self.__refine_job = None  # scheduled check of the background refinement
 
-        self.__show_image()  # show image on the canvas
+        self.load(path, pyramid)  # show image on the canvas
         self.canvas.focus_set()  # set focus on the canvas
+        if placeholder.overlay:
+            self.__refresh_overlay()
+
+    def load(self, path, pyramid=None):
+        """ Show the image on the same canvas, buffers of the previous image are freed first.
+            Pyramid could be prepared in advance by the prefetcher """
+        self.close_image()
+        self.path = path
+        # Huge image is memory-mapped. Image pyramid is taken from the on-disk cache if the image was opened
+        # before, otherwise the preview is shown at once and the levels are built in the background.
+        # Zoom and tile maths are done by the viewport, it doesn't depend on Tk
+        self.__view.open(self.path, pyramid, self.parent_container.pyramid_cache, self.parent_container.refiner,
+                         huge_size=self.__huge_size, reduction=self.__reduction, resample=self.__filter,
+                         tile_size=256, delta=1.3)
+        self.imwidth, self.imheight = self.__view.image.size  # public for outer classes
+        self.__pyramid_version = self.__view.pyramid.version  # levels which are shown on the canvas
+        # The new image is shown at 1:1 scale from the top left corner
+        self.canvas.coords(self.container, 0, 0, self.imwidth, self.imheight)
+        self.canvas.configure(scrollregion=(0, 0, self.imwidth, self.imheight))
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.__show_image()
+        if not self.__view.pyramid.complete:
+            self.__view.pyramid.refine()  # the first frame is shown, build the rest of the pyramid
+            self.__refine_job = self.canvas.after(100, self.__check_refinement)
+
+    def close_image(self):
+        """ Free the tiles, the pyramid and the memory map of the shown image. Canvas items are kept for reuse """
+        if self.__refine_job is not None:
+            self.canvas.after_cancel(self.__refine_job)
+            self.__refine_job = None
+        self.canvas.delete('label')  # items of all labels at once
+        self.__drawn.clear()
+        self.__hovered = None
+        for imageid, _, _ in self.__tiles.values():
+            self.canvas.itemconfigure(imageid, image='', state='hidden')
+            self.__spare_tiles.append(imageid)
+        self.__tiles = {}
+        self.__view.close()
+
+    @staticmethod
+    def __photo(image):
+        """ Return PhotoImage of the rendered tile and its size in bytes """
+        imagetk = ImageTk.PhotoImage(image)
+        profiler.count('photoimage')
+        return imagetk, 4 * imagetk.width() * imagetk.height()
+
+    @property
+    def imscale(self):
+        """ Scale for the canvas image zoom, public for outer classes """
+        return self.__view.viewport.imscale
 
     def smaller(self):
         """ Resize image proportionally and return smaller image """
-        w1, h1 = float(self.imwidth), float(self.imheight)
-        w2, h2 = float(self.__huge_size), float(self.__huge_size)
-        aspect_ratio1 = w1 / h1
-        aspect_ratio2 = w2 / h2  # it equals to 1.0
-        if aspect_ratio1 == aspect_ratio2:
-            image = Image.new('RGB', (int(w2), int(h2)))
-            k = h2 / h1  # compression ratio
-            w = int(w2)  # band length
-        elif aspect_ratio1 > aspect_ratio2:
-            image = Image.new('RGB', (int(w2), int(w2 / aspect_ratio1)))
-            k = h2 / w1  # compression ratio
-            w = int(w2)  # band length
-        else:  # aspect_ratio1 < aspect_ration2
-            image = Image.new('RGB', (int(h2 * aspect_ratio1), int(h2)))
-            k = h2 / h1  # compression ratio
-            w = int(h2 * aspect_ratio1)  # band length
-        i, j, n = 0, 1, round(0.5 + self.imheight / self.__band_width)
-        while i < self.imheight:
-            print('\rOpening image: {j} from {n}'.format(j=j, n=n), end='')
-            band = min(self.__band_width, self.imheight - i)  # width of the tile band
-            self.__tile[1][3] = band  # set band width
-            self.__tile[2] = self.__offset + self.imwidth * i * 3  # tile offset (3 bytes per pixel)
-            self.__image.close()
-            self.__image = Image.open(self.path)  # reopen / reset image
-            self.__image.size = (self.imwidth, band)  # set size of the tile band
-            self.__image.tile = [self.__tile]  # set tile
-            cropped = self.__image.crop((0, 0, self.imwidth, band))  # crop tile band
-            image.paste(cropped.resize((w, int(band * k)+1), self.__filter), (0, int(i * k)))
-            i += band
-            j += 1
-        print('\r' + 30*' ' + '\r', end='')  # hide printed string
-        return image
+        return reduce_huge(self.__view.raw, self.__huge_size, self.__band_width, self.__filter)
 
     def redraw_figures(self):
         """ Dummy function to redraw figures in the children classes """
@@ -150,56 +324,153 @@ class CanvasImage:
         self.canvas.yview(*args)  # scroll vertically
         self.__show_image()  # redraw the image
 
+    @timed('show_image')
     def __show_image(self):
         """ Show image on the Canvas. Implements correct image zoom almost like in Google Maps """
+        viewport = self.__view.viewport
+        if viewport is None:
+            return  # the image is being replaced
         box_image = self.canvas.coords(self.container)  # get image area
         box_canvas = (self.canvas.canvasx(0),  # get visible area of the canvas
                       self.canvas.canvasy(0),
                       self.canvas.canvasx(self.canvas.winfo_width()),
                       self.canvas.canvasy(self.canvas.winfo_height()))
-        box_img_int = tuple(map(int, box_image))  # convert to integer or it will not work properly
-        # Get scroll region box
-        box_scroll = [min(box_img_int[0], box_canvas[0]), min(box_img_int[1], box_canvas[1]),
-                      max(box_img_int[2], box_canvas[2]), max(box_img_int[3], box_canvas[3])]
-        # Horizontal part of the image is in the visible area
-        if  box_scroll[0] == box_canvas[0] and box_scroll[2] == box_canvas[2]:
-            box_scroll[0]  = box_img_int[0]
-            box_scroll[2]  = box_img_int[2]
-        # Vertical part of the image is in the visible area
-        if  box_scroll[1] == box_canvas[1] and box_scroll[3] == box_canvas[3]:
-            box_scroll[1]  = box_img_int[1]
-            box_scroll[3]  = box_img_int[3]
-        # Convert scroll region to tuple and to integer
-        self.canvas.configure(scrollregion=tuple(map(int, box_scroll)))  # set scroll region
-        x1 = max(box_canvas[0] - box_image[0], 0)  # get coordinates (x1,y1,x2,y2) of the image tile
-        y1 = max(box_canvas[1] - box_image[1], 0)
-        x2 = min(box_canvas[2], box_image[2]) - box_image[0]
-        y2 = min(box_canvas[3], box_image[3]) - box_image[1]
-        if int(x2 - x1) > 0 and int(y2 - y1) > 0:  # show image if it in the visible area
-            if self.__huge and self.__curr_img < 0:  # show huge image
-                h = int((y2 - y1) / self.imscale)  # height of the tile band
-                self.__tile[1][3] = h  # set the tile band height
-                self.__tile[2] = self.__offset + self.imwidth * int(y1 / self.imscale) * 3
-                self.__image.close()
-                self.__image = Image.open(self.path)  # reopen / reset image
-                self.__image.size = (self.imwidth, h)  # set size of the tile band
-                self.__image.tile = [self.__tile]
-                image = self.__image.crop((int(x1 / self.imscale), 0, int(x2 / self.imscale), h))
-            else:  # show normal image
-                image = self.__pyramid[max(0, self.__curr_img)].crop(  # crop current img from pyramid
-                                    (int(x1 / self.__scale), int(y1 / self.__scale),
-                                     int(x2 / self.__scale), int(y2 / self.__scale)))
-            #
-            imagetk = ImageTk.PhotoImage(image.resize((int(x2 - x1), int(y2 - y1)), self.__filter))
-            imageid = self.canvas.create_image(max(box_canvas[0], box_img_int[0]),
-                                               max(box_canvas[1], box_img_int[1]),
-                                               anchor='nw', image=imagetk)
+        self.canvas.configure(scrollregion=viewport.scroll_region(box_image, box_canvas))  # set scroll region
+        visible = set()  # tiles (column, row) in the visible area
+        zoom = viewport.zoom_key  # zoom key of the tiles
+        for tile, box in viewport.tiles(box_image, box_canvas):
+            visible.add(tile)
+            shown = self.__tiles.get(tile)
+            if shown is not None and shown[1] == zoom:
+                continue  # tile is on the canvas already
+            imagetk = self.__view.tile((zoom,) + tile, box)
+            if shown is not None:
+                imageid = shown[0]  # reuse canvas item of the same tile
+            elif self.__spare_tiles:
+                imageid = self.__spare_tiles.pop()  # reuse canvas item of the hidden tile
+            else:
+                imageid = self.canvas.create_image(0, 0, anchor='nw')
+            self.canvas.itemconfigure(imageid, image=imagetk, state='normal')
+            self.canvas.coords(imageid, box_image[0] + box[0], box_image[1] + box[1])
             self.canvas.lower(imageid)  # set image into background
-            self.canvas.imagetk = imagetk  # keep an extra reference to prevent garbage-collection
+            # keep a reference to prevent garbage-collection of the image on the canvas
+            self.__tiles[tile] = (imageid, zoom, imagetk)
+        for tile in [tile for tile in self.__tiles if tile not in visible]:  # hide invisible tiles
+            imageid = self.__tiles.pop(tile)[0]
+            self.canvas.itemconfigure(imageid, image='', state='hidden')
+            self.__spare_tiles.append(imageid)
+        self.__show_labels(box_image, box_canvas)
+        if profiler.enabled:
+            profiler.gauge('canvas items', len(self.canvas.find_all()))
+        if self.__overlay is not None:
+            self.__draw_overlay()
+
+    def toggle_overlay(self):
+        """ Show or hide the FPS and latency overlay in the corner of the canvas """
+        self.parent_container.overlay = not self.parent_container.overlay
+        if self.parent_container.overlay:
+            profiler.enabled = True
+            self.__refresh_overlay()
+        else:
+            if self.__overlay_job is not None:
+                self.canvas.after_cancel(self.__overlay_job)
+            self.canvas.delete(self.__overlay)
+            self.__overlay = self.__overlay_job = None
+
+    def __refresh_overlay(self):
+        """ Redraw the overlay twice a second, so the FPS falls to zero when nothing happens """
+        self.__draw_overlay()
+        self.__overlay_job = self.canvas.after(500, self.__refresh_overlay)
+
+    def __draw_overlay(self):
+        p50, p99 = profiler.latency('show_image', 50), profiler.latency('show_image', 99)
+        text = '{0:.0f} fps  frame p50 {1} p99 {2} ms  wheel p50 {3} ms\nPhotoImages {4}  canvas items {5}'.format(
+            profiler.rate('show_image'), *('{0:.1f}'.format(v) if v is not None else '-' for v in
+                                           (p50, p99, profiler.latency('wheel', 50))),
+            profiler.counters['photoimage'], profiler.counters['canvas items'])
+        x, y = self.canvas.canvasx(4), self.canvas.canvasy(4)
+        if self.__overlay is None:
+            self.__overlay = self.canvas.create_text(x, y, anchor='nw', fill='yellow', font=('TkFixedFont', 9))
+        self.canvas.itemconfigure(self.__overlay, text=text)
+        self.canvas.coords(self.__overlay, x, y)
+        self.canvas.tag_raise(self.__overlay)
+
+    def __check_refinement(self):
+        """ Swap in pyramid levels built by the background worker """
+        self.__refine_job = None
+        if self.__view.pyramid.version != self.__pyramid_version:
+            self.__pyramid_version = self.__view.pyramid.version
+            self.__view.tile_cache.clear()  # tiles could be rendered from the preview
+            self.__tiles = {tile: (imageid, None, imagetk) for tile, (imageid, _, imagetk) in self.__tiles.items()}
+            self.__show_image()
+        if not self.__view.pyramid.complete:
+            self.__refine_job = self.canvas.after(100, self.__check_refinement)
+
+    def __show_labels(self, box_image, box_canvas):
+        """ Create canvas items of the labels in the visible area and delete items of the other labels """
+        labels = self.parent_container.labels_created
+        scale = (box_image[2] - box_image[0]) / self.imwidth  # canvas pixels in the image pixel
+        visible = self.parent_container.label_index.query(  # visible area in image coordinates
+            (box_canvas[0] - box_image[0]) / scale, (box_canvas[1] - box_image[1]) / scale,
+            (box_canvas[2] - box_image[0]) / scale, (box_canvas[3] - box_image[1]) / scale)
+        self.erase_labels(list(self.__drawn.difference(visible.tolist())))
+        new = np.array([index for index in visible.tolist() if index not in self.__drawn], dtype=np.int64)
+        if len(new) == 0:
+            return
+        boxes = labels.transform(scale, box_image[0], box_image[1], new)  # canvas coordinates
+        classes = labels.rows['cls'][new]
+        # All items are created by one Tcl call, captions are set by one call per class
+        canvas = str(self.canvas)
+        review = self.parent_container.review  # propagated labels which changed are drawn in orange
+        script = ' '.join('[{0} create rectangle {1!r} {2!r} {3!r} {4!r} -outline {8} -tags label] '
+                          '[{0} create text {5!r} {6!r} -fill {8} -tags {{label cls{7}}}]'.format(
+                              canvas, x, y, x1, y1, tx, ty, cls, 'orange' if index in review else 'green2')
+                          for (x, y, x1, y1), (tx, ty, _, _), cls, index in
+                          zip(boxes.tolist(), normalized(boxes).tolist(), classes.tolist(), new.tolist()))
+        ids = np.array(self.canvas.tk.splitlist(self.canvas.tk.eval('list ' + script)), dtype=np.int32)
+        labels.rows['rect'][new] = ids[0::2]
+        labels.rows['text'][new] = ids[1::2]
+        for cls in np.unique(classes).tolist():
+            self.canvas.itemconfigure('cls{0}'.format(cls), text=labels.classes[cls])
+        self.__drawn.update(new.tolist())
+
+    def erase_labels(self, indices):
+        """ Delete canvas items of the labels """
+        labels = self.parent_container.labels_created
+        indices = np.array([index for index in indices if index in self.__drawn], dtype=np.int64)
+        if len(indices) == 0:
+            return
+        self.canvas.delete(*labels.rows['rect'][indices].tolist(), *labels.rows['text'][indices].tolist())
+        labels.rows['rect'][indices] = labels.rows['text'][indices] = -1
+        self.__drawn.difference_update(indices.tolist())
+        if self.__hovered not in self.__drawn:
+            self.__hovered = None
+
+    def label_at(self, event):
+        """ Return index of the label under the cursor or None """
+        box_image = self.canvas.coords(self.container)  # get image area
+        scale = (box_image[2] - box_image[0]) / self.imwidth
+        return self.parent_container.label_index.at((self.canvas.canvasx(event.x) - box_image[0]) / scale,
+                                                    (self.canvas.canvasy(event.y) - box_image[1]) / scale)
+
+    def __hover(self, event):
+        """ Highlight the label under the cursor, it is found by the spatial index """
+        index = self.label_at(event)
+        if index != self.__hovered:
+            if self.__hovered is not None:
+                self.parent_container.unhighlight(self.__hovered)
+            if index is not None:
+                self.parent_container.highlight(index)
+            self.__hovered = index
+
+    def __select(self, event):
+        """ Send the label under the cursor to the bin """
+        index = self.label_at(event)
+        if index is not None:
+            self.parent_container.send_label_to_bin(index)
 
     def __move_from(self, event):
         """ Remember previous coordinates for scrolling with the mouse """
-        print(self.parent_container.label_mode.get())
         if self.parent_container.label_mode.get():
             self.cursorlocations = [[self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)]]
             box_image = self.canvas.coords(self.container)  # get image area
@@ -225,16 +496,18 @@ class CanvasImage:
         if self.parent_container.label_mode.get():
             first = self.cursorlocations[0]
             last = self.cursorlocations[-1]
-            print("drawing...")
-            rect = self.canvas.create_rectangle(first[0], first[1], last[0], last[1], outline="green2")
-            rect_text = self.canvas.create_text(min(first[0], last[0]), min(first[1], last[1]), text=self.parent_container.label_type.get(), fill="green2")
+            rect = self.canvas.create_rectangle(first[0], first[1], last[0], last[1], outline="green2", tags="label")
+            rect_text = self.canvas.create_text(min(first[0], last[0]), min(first[1], last[1]), text=self.parent_container.label_type.get(), fill="green2", tags="label")
             first = self.locations[0]
             last = self.locations[-1]
-            new_label = Label(first[0], first[1], last[0], last[1], self.parent_container.label_type.get(), rect, rect_text)
-            self.parent_container.labels_created.append(
-                new_label
+            index = self.parent_container.labels_created.add(
+                first[0], first[1], last[0], last[1], self.parent_container.label_type.get(), rect, rect_text
             )
-            self.parent_container.create_label(new_label)
+            self.parent_container.label_index.insert(index)
+            self.__drawn.add(index)
+            self.parent_container.create_label(index)
+            self.parent_container.journal.add(self.parent_container.labels_created, index)
+            self.parent_container.schedule_idle()
 
     def outside(self, x, y):
         """ Checks if the point (x,y) is outside the image area """
@@ -244,32 +517,25 @@ class CanvasImage:
         else:
             return True  # point (x,y) is outside the image area
 
+    @timed('wheel')
     def __wheel(self, event):
         """ Zoom with mouse wheel """
         x = self.canvas.canvasx(event.x)  # get coordinates of the event on the canvas
         y = self.canvas.canvasy(event.y)
         if self.outside(x, y): return  # zoom only inside image area
-        scale = 1.0
         # Respond to Linux (event.num) or Windows (event.delta) wheel event
         if event.num == 5 or event.delta == -120:  # scroll down, smaller
-            if round(self.__min_side * self.imscale) < 30: return  # image is less than 30 pixels
-            self.imscale /= self.__delta
-            scale        /= self.__delta
-        if event.num == 4 or event.delta == 120:  # scroll up, bigger
-            i = min(self.canvas.winfo_width(), self.canvas.winfo_height()) >> 1
-            if i < self.imscale: return  # 1 pixel is bigger than the visible area
-            self.imscale *= self.__delta
-            scale        *= self.__delta
-        # Take appropriate image from the pyramid
-        k = self.imscale * self.__ratio  # temporary coefficient
-        self.__curr_img = min((-1) * int(math.log(k, self.__reduction)), len(self.__pyramid) - 1)
-        self.__scale = k * math.pow(self.__reduction, max(0, self.__curr_img))
-        #
+            direction = -1
+        elif event.num == 4 or event.delta == 120:  # scroll up, bigger
+            direction = 1
+        else:
+            return
+        scale = self.__view.viewport.zoom(direction, self.canvas.winfo_width(), self.canvas.winfo_height())
+        if scale is None: return
         self.canvas.scale('all', x, y, scale, scale)  # rescale all objects
         # Redraw some figures before showing image on the screen
         self.redraw_figures()  # method for child classes
         self.__show_image()
-        print(self.__scale)
 
     def __keystroke(self, event):
         """ Scrolling with the keyboard.
@@ -290,60 +556,50 @@ class CanvasImage:
 
     def crop(self, bbox):
         """ Crop rectangle from the image and return it """
-        if self.__huge:  # image is huge and not totally in RAM
-            band = bbox[3] - bbox[1]  # width of the tile band
-            self.__tile[1][3] = band  # set the tile height
-            self.__tile[2] = self.__offset + self.imwidth * bbox[1] * 3  # set offset of the band
-            self.__image.close()
-            self.__image = Image.open(self.path)  # reopen / reset image
-            self.__image.size = (self.imwidth, band)  # set size of the tile band
-            self.__image.tile = [self.__tile]
-            return self.__image.crop((bbox[0], 0, bbox[2], band))
-        else:  # image is totally in RAM
-            return self.__pyramid[0].crop(bbox)
+        return self.__view.viewport.crop(bbox)
 
     def destroy(self):
         """ ImageFrame destructor """
-        self.__image.close()
-        map(lambda i: i.close, self.__pyramid)  # close all pyramid images
-        del self.__pyramid[:]  # delete pyramid list
-        del self.__pyramid  # delete pyramid variable
+        if self.__overlay_job is not None:
+            self.canvas.after_cancel(self.__overlay_job)
+        self.close_image()
         self.canvas.destroy()
         self.__imframe.destroy()
 
-class Label():
-    def __init__(self, x, y, x1, y1, label_type, rectangle_drawn=None, text_drawn=None):
-        self.x = x
-        self.y = y
-        self.x1 = x1
-        self.y1 = y1
-        self.type = label_type
-        self.rectangle_drawn = rectangle_drawn
-        self.text_drawn = text_drawn
-
-class App(tk.Tk):
-    def __init__(self):
+class App(tk.Tk, Session):
+    def __init__(self, cache_budget=512 << 20, prefetch_radius=2, idle_compact=30000, trace=None, overlay=False,
+                 directory="templates", yolo_dir=None, classes="classes.names", propagate=False, change_threshold=12.0):
         super().__init__()
+        Session.__init__(self, directory, ["Redact_Blur", "Redact_Blur", "Redact_Blur_Text", "Ticker", "Account_Name",
+                                           "Value", "Curr_Ticker", "Date"], cache_budget, prefetch_radius)
+        self.yolo_dir = yolo_dir  # folder of the YOLO label files written on export, None to skip them
+        self.class_map = ClassMap(classes) if yolo_dir is not None else None  # class ids of the YOLO labels
+        self.trace = trace  # path of the Chrome trace JSON written on close
+        self.overlay = overlay  # show the FPS and latency overlay on the canvas
+        profiler.enabled = bool(trace or overlay)
         self.label_type = tk.StringVar()
         self.label_type.set("Redact")
         self.label_mode = tk.BooleanVar()
         self.label_mode.set(False)
-        self.label_options = ["Redact_Blur", "Redact_Blur", "Redact_Blur_Text", "Ticker", "Account_Name", "Value", "Curr_Ticker", "Date"]
-        self.labels_created = []
-        self.files = [i for i in glob.glob("templates/*") if os.path.splitext(i)[1] in [".png", ".jpg", ".tif"]]
-        print(self.files)
+        self.propagate = tk.BooleanVar(value=propagate)  # copy labels of the previous frame into unlabelled images
+        self.change_threshold = change_threshold  # mean grey level difference in the box which needs the review
+        self.review = set()  # propagated labels whose box content changed
+        self.__left = None  # (file name, labels, binned) of the image shown before the current one
+        self.idle_compact = idle_compact  # idle time in ms before the journal is compacted into the text file
+        self.__sync_job = None  # scheduled fsync of the journal
+        self.__idle_job = None  # scheduled compaction of the journal
+        self.protocol("WM_DELETE_WINDOW", self.close)
         self.file_name = tk.StringVar()
         if self.files != []:
-            self.files.insert(0, self.files[0])
             self.file_name.set(self.files[0])
         self.__create_widgets()
 
     def __create_widgets(self):
-        self.read_labels()
+        pyramid = self.load_file(self.file_name.get())
         self.columnconfigure(index=0, weight=1)
         self.rowconfigure(index=0, weight=1)
 
-        self.canvas_image = CanvasImage(self, self.file_name.get())
+        self.canvas_image = CanvasImage(self, self.file_name.get(), pyramid)
         self.canvas_image.grid(column=0, row=0)
 
         self.button_frame = CanvasButtonFrame(self)
@@ -351,7 +607,6 @@ class App(tk.Tk):
 
         self.label_frame = LabelsFrame(self)
         self.label_frame.grid(column=1, row=0)
-        self.add_existing_labels()
 
         label_button_frame = LabelButtonFrame(self)
         label_button_frame.grid(column=1, row=1)
@@ -361,6 +616,46 @@ class App(tk.Tk):
 
         bin_button_frame = BinButtonFrame(self, self.bin_frame)
         bin_button_frame.grid(column=2, row=1)
+        self.add_existing_labels()
+        self.prefetch_neighbours(self.file_name.get())
+
+    def __load_image(self):
+        """ Show the current file in the existing widgets """
+        pyramid = self.load_file(self.file_name.get())
+        self.review = set()
+        if self.propagate.get():
+            self.propagate_labels()
+        self.label_frame.clear()
+        self.bin_frame.clear()
+        self.canvas_image.load(self.file_name.get(), pyramid)  # buffers of the previous image are freed
+        self.button_frame.file_picker.set(self.file_name.get())
+        self.add_existing_labels()
+        self.prefetch_neighbours(self.file_name.get())
+
+    def propagate_labels(self):
+        """ Copy labels of the previous frame into the image without labels. Labels whose box content
+            changed more than the threshold are marked for the review """
+        file_name = self.file_name.get()
+        position = self.file_index.position.get(file_name, 0)
+        text_file_name = os.path.splitext(file_name)[0] + ".txt"
+        if position == 0 or len(self.labels_created) or os.path.exists(text_file_name):
+            return
+        previous = self.files[position - 1]
+        if self.__left is not None and self.__left[0] == previous:  # unsaved labels of the image just left
+            _, labels, binned = self.__left
+        else:
+            labels, binned = self.parse_labels(previous), set()
+        indices = [index for index in labels.indices().tolist() if index not in binned]
+        if not indices:
+            return
+        copied, changed = propagate(labels, indices, previous, file_name, self.change_threshold)
+        new = self.labels_created.extend(copied.boxes(), [copied.type(index) for index in copied.indices()])
+        for index in new.tolist():
+            self.journal.add(self.labels_created, index)
+        self.label_index.insert(new)
+        self.review = set(new[changed].tolist())
+        self.schedule_idle()
+        print(f"Propagated {len(new)} labels from {previous}, {len(self.review)} to review")
 
     def label_mode_off(self):
         self.button_frame.label_button["state"] = "enabled"
@@ -372,58 +667,130 @@ class App(tk.Tk):
         self.button_frame.label_button["state"] = "disabled"
         self.label_mode.set(True)
 
-    def create_label(self, label):
-        self.label_frame.add_label(label)
-
-    def highlight(self, label_rectangle):
-        self.canvas_image.canvas.itemconfig(label_rectangle, width='3')
-        self.canvas_image.canvas.itemconfig(label_rectangle, width='3')
-
-    def unhighlight(self, label_rectangle):
-        self.canvas_image.canvas.itemconfig(label_rectangle, width='1')
-
-    def send_label_to_bin(self, label, label_id):
-        self.bin_frame.add_label(label)
-        self.unhighlight(label.rectangle_drawn)
-        label_id.destroy()
-
-    def retrieve_label_from_bin(self, label, label_id):
-        self.label_frame.add_label(label)
-        self.unhighlight(label.rectangle_drawn)
-        label_id.destroy()
-
-    def read_labels(self):
-        extension = self.file_name.get().split(".")[-1]
-        text_file_name = self.file_name.get().replace(f".{extension}", ".txt")
-        if os.path.exists(text_file_name):
-            with open(text_file_name, "r") as f:
-                labels = f.readlines()
-            self.labels_created = []
-            for label in labels:
-                i = label.strip().split(" ")
-                self.labels_created.append(Label(float(i[1]), float(i[2]), float(i[3]), float(i[4]), i[0]))
-            print(self.labels_created)
-        else:
-            self.labels_created = []
+    def create_label(self, index):
+        self.label_frame.add([index])
+
+    def highlight(self, index):
+        rectangle = int(self.labels_created.rows['rect'][index])
+        if rectangle >= 0:  # label is drawn on the canvas
+            self.canvas_image.canvas.itemconfig(rectangle, width='3')
+
+    def unhighlight(self, index):
+        rectangle = int(self.labels_created.rows['rect'][index])
+        if rectangle >= 0:
+            self.canvas_image.canvas.itemconfig(rectangle, width='1')
+
+    def send_label_to_bin(self, index):
+        self.send_labels_to_bin([index])
+
+    def send_labels_to_bin(self, indices):
+        """ Move the labels to the bin, the journal gets one record for all of them """
+        indices = [index for index in indices if index in self.label_frame.members]  # skip labels in the bin
+        if not indices:
+            return
+        self.review.difference_update(indices)  # the changed box is reviewed
+        self.label_frame.remove(indices)
+        self.bin_frame.add(indices)
+        for index in indices:
+            self.unhighlight(index)
+        self.journal.bin(indices)
+        self.schedule_idle()
+
+    def retrieve_label_from_bin(self, index):
+        self.retrieve_labels_from_bin([index])
+
+    def retrieve_labels_from_bin(self, indices):
+        indices = [index for index in indices if index in self.bin_frame.members]
+        if not indices:
+            return
+        self.bin_frame.remove(indices)
+        self.label_frame.add(indices)
+        for index in indices:
+            self.unhighlight(index)
+        self.journal.retrieve(indices)
+        self.schedule_idle()
+
+    def schedule_idle(self):
+        """ Sync the journal soon and compact it into the text file when the user is idle """
+        if self.__sync_job is None:
+            self.__sync_job = self.after(1000, self.__sync_journal)
+        if self.__idle_job is not None:
+            self.after_cancel(self.__idle_job)
+        self.__idle_job = self.after(self.idle_compact, self.export) if self.idle_compact else None
+
+    def __sync_journal(self):
+        self.__sync_job = None
+        self.journal.sync()
+
+    def __cancel_jobs(self):
+        for job in (self.__sync_job, self.__idle_job):
+            if job is not None:
+                self.after_cancel(job)
+        self.__sync_job = self.__idle_job = None
+
+    def close(self):
+        """ Save the journal, stop the workers and destroy the window """
+        self.__cancel_jobs()
+        self.shutdown()
+        if self.trace:
+            profiler.export(self.trace)
+        self.destroy()
+
+    def step_img(self, step):
+        """ Show the next (step=1) or the previous (step=-1) file """
+        if self.file_name.get() not in self.file_index.position:
+            return
+        index = self.file_index.position[self.file_name.get()] + step
+        if 0 <= index < len(self.files):
+            self.change_img(self.files[index])
+
+    def next_unlabelled(self):
+        """ Show the next file without the label file, the search wraps around """
+        unlabelled = set(self.catalog.images(self.directory, labelled=False))
+        start = self.file_index.position.get(self.file_name.get(), -1) + 1
+        for i in range(len(self.files)):
+            file_name = self.files[(start + i) % len(self.files)]
+            if file_name in unlabelled and file_name != self.file_name.get():
+                self.change_img(file_name)
+                return
 
     def add_existing_labels(self):
-        for label in self.labels_created:
-            self.create_label(label)
+        indices = self.labels_created.indices().tolist()
+        self.label_frame.add([index for index in indices if index not in self.binned])
+        self.bin_frame.add([index for index in indices if index in self.binned])
 
+    @timed('export')
     def export(self):
-        print(self.file_name.get())
+        self.image_cache.discard(self.file_name.get())  # cached labels are stale now
         extension = self.file_name.get().split(".")[-1]
         text_file_name = self.file_name.get().replace(f".{extension}", ".txt")
-        with open(text_file_name, "w") as f:
-            for label in self.labels_created:
-                string = f"{label.type} {label.x} {label.y} {label.x1} {label.y1}\n"
-                f.write(string)
+        self.__cancel_jobs()
+        self.journal.compact(self.labels_created, text_file_name, self.bin_frame.members)
+        self.catalog.refresh([self.file_name.get()])  # class statistics of the image changed
         print(f"Written to file {text_file_name}")
-
+        if self.yolo_dir is not None:
+            self.export_yolo()
+
+    def export_yolo(self):
+        """ Write labels outside the bin as 'class_id cx cy w h' normalized to the image size """
+        labels = self.labels_created
+        indices = np.setdiff1d(labels.indices(), np.fromiter(self.bin_frame.members, dtype=np.int64))
+        boxes, keep = normalize(labels.boxes(indices), self.canvas_image.imwidth, self.canvas_image.imheight)
+        # only the classes of the written labels get ids, like in 'yolo.py convert'
+        used, inverse = np.unique(labels.rows['cls'][indices[keep]], return_inverse=True)
+        ids = self.class_map.ids([labels.classes[cls] for cls in used.tolist()])[inverse.reshape(-1)]
+        relative = os.path.relpath(os.path.splitext(self.file_name.get())[0] + ".txt", self.directory)
+        yolo_file_name = os.path.join(self.yolo_dir, relative)
+        os.makedirs(os.path.dirname(yolo_file_name), exist_ok=True)
+        write_labels(yolo_file_name, ids, boxes[keep])
+        print(f"Written to file {yolo_file_name}")
+
+    @timed('change_img')
     def change_img(self, value):
-        self.__create_widgets()
+        self.__cancel_jobs()  # the journal keeps unsaved labels of the previous image
+        self.__left = (self.file_name.get(), self.labels_created, set(self.bin_frame.members))
         self.file_name.set(value)
-        print(value)
+        self.__load_image()
 
 class CanvasButtonFrame(ttk.Frame):
     def __init__(self, container):
@@ -431,37 +798,175 @@ class CanvasButtonFrame(ttk.Frame):
         self.__create_widgets(container)
 
     def __create_widgets(self, container):
-        ttk.Button(self, text="<").grid(column=0, row=0)
-        ttk.OptionMenu(self, container.file_name, *container.files, command=container.change_img).grid(column=1, row=0)
-        # ttk.Label(self, text="Some text here...").grid(column=1, row=0)
-        ttk.Button(self, text=">").grid(column=2, row=0)
+        ttk.Button(self, text="<", command=lambda: container.step_img(-1)).grid(column=0, row=0)
+        self.file_picker = FilePicker(self, container.file_index, container.change_img)
+        self.file_picker.set(container.file_name.get())
+        self.file_picker.grid(column=1, row=0)
+        ttk.Button(self, text=">", command=lambda: container.step_img(1)).grid(column=2, row=0)
+        ttk.Button(self, text="Next Unlabelled", command=container.next_unlabelled).grid(column=3, row=0)
+        ttk.Checkbutton(self, text="Propagate", variable=container.propagate).grid(column=7, row=0)
         self.label_button = ttk.Button(self, text="Label Mode", command=container.label_mode_on, state="enabled")
-        self.label_button.grid(column=3, row=0)
+        self.label_button.grid(column=4, row=0)
         self.nav_button = ttk.Button(self, text="Navigate Mode", command=container.label_mode_off, state="disabled")
-        self.nav_button.grid(column=4, row=0)
+        self.nav_button.grid(column=5, row=0)
         self.export_button = ttk.Button(self, text="Export", command=container.export)
-        self.export_button.grid(column=5, row=0)
+        self.export_button.grid(column=6, row=0)
 
         for widget in self.winfo_children():
             widget.grid(padx=0, pady=0)
 
-class LabelsFrame(ttk.Frame):
-    def __init__(self, container):
+class LabelPanel(ttk.Frame):
+    """ Labels of the store in the virtual list, only the visible rows are rendered.
+        Rows are label indices, optionally grouped by class under the headers, which are
+        encoded as negative rows -1 - class id. Selected labels are moved in one pass """
+    def __init__(self, container, title, action_text, action):
         super().__init__(container)
         self.container = container
+        self.title = title
+        self.action_text = action_text  # text of the button which moves the selected labels
+        self.action = action  # called with the label indices to move them to the other panel
+        self.members = set()  # label indices in the panel
+        self.selected = set()  # selected label indices
+        self.collapsed = set()  # class ids of the collapsed groups
+        self.counts = {}  # class id -> number of the labels in the group
+        self.grouped = tk.BooleanVar(value=True)
+        self.__anchor = None  # row of the last clicked label, start of the shift-click range
+        self.__hovered = None  # label highlighted on the canvas
+        self.__job = None  # scheduled rebuild of the rows
         self.__create_widgets()
-        self.labels = []
 
     def __create_widgets(self):
-        self.frame = ttk.LabelFrame(self, text="Labels", borderwidth=2, border=2)
+        self.frame = ttk.LabelFrame(self, text=self.title, borderwidth=2, border=2)
         self.frame.grid(column=0, row=0, sticky="NEWS")
+        self.list = VirtualList(self.frame, rows=25, width=30, render=self.__render, click=self.__click,
+                                selected=lambda row: row in self.selected)
+        self.list.grid(column=0, row=0, columnspan=3, sticky="NEWS")
+        self.list.listbox.bind('<Motion>', self.__hover)
+        self.list.listbox.bind('<Leave>', lambda event: self.__highlight(None))
+        self.list.listbox.bind('<Return>', lambda event: self.move_selected())
+        ttk.Checkbutton(self.frame, text="Group", variable=self.grouped, command=self.rebuild).grid(column=0, row=1)
+        ttk.Button(self.frame, text="All", width=4, command=self.select_all).grid(column=1, row=1)
+        ttk.Button(self.frame, text=self.action_text, command=self.move_selected).grid(column=2, row=1)
+
+    def add(self, indices):
+        self.members.update(indices)
+        self.schedule()
+
+    def clear(self):
+        """ Forget the labels of the previous image """
+        self.members.clear()
+        self.selected.clear()
+        self.collapsed.clear()
+        self.__anchor = self.__hovered = None
+        self.schedule()
+
+    def remove(self, indices):
+        self.members.difference_update(indices)
+        self.selected.difference_update(indices)
+        if self.__hovered in indices:
+            self.__hovered = None
+        self.schedule()
+
+    def schedule(self):
+        """ Rebuild the rows once after a batch of changes """
+        if self.__job is None:
+            self.__job = self.after_idle(self.rebuild)
+
+    def rebuild(self):
+        """ Sort the labels by class in one NumPy pass and show them """
+        self.__job = None
+        labels = self.container.labels_created
+        members = np.sort(np.fromiter(self.members, dtype=np.int64, count=len(self.members)))
+        classes = labels.rows['cls'][members]
+        order = np.argsort(classes, kind='stable')
+        members, classes = members[order], classes[order]
+        ids, starts, counts = np.unique(classes, return_index=True, return_counts=True)
+        self.counts = dict(zip(ids.tolist(), counts.tolist()))
+        if self.grouped.get():
+            parts = []
+            for cls, start, count in zip(ids.tolist(), starts.tolist(), counts.tolist()):
+                parts.append(np.array([-1 - cls], dtype=np.int64))
+                if cls not in self.collapsed:
+                    parts.append(members[start:start + count])
+            rows = np.concatenate(parts) if parts else members
+        else:
+            rows = members
+        self.list.set_items(rows, keep=True)
+
+    def __render(self, row):
+        labels = self.container.labels_created
+        if row < 0:
+            cls = -1 - int(row)
+            return '{0} {1} ({2})'.format('+' if cls in self.collapsed else '-', labels.classes[cls],
+                                          self.counts.get(cls, 0))
+        x, y, x1, y1 = labels.box(row)
+        mark = '!' if row in self.container.review else ' '  # propagated label which changed
+        return '  {0} {1}  {2:.0f}x{3:.0f}'.format(mark, labels.type(row), abs(x1 - x), abs(y1 - y))
+
+    def group(self, cls):
+        """ Return labels of the class in the panel """
+        labels = self.container.labels_created
+        return [index for index in self.members if labels.rows['cls'][index] == cls]
+
+    def __click(self, position, event):
+        """ Click moves the label, Ctrl-click selects it, Shift-click selects the range.
+            Click on the header collapses the group, Ctrl-click selects the whole group """
+        row = int(self.list.items[position])
+        control, shift = event.state & 0x4, event.state & 0x1
+        if row < 0:
+            cls = -1 - row
+            if control:
+                group = self.group(cls)
+                if self.selected.issuperset(group):
+                    self.selected.difference_update(group)
+                else:
+                    self.selected.update(group)
+                self.list.refresh()
+            else:
+                self.collapsed.symmetric_difference_update({cls})
+                self.rebuild()
+        elif shift and self.__anchor is not None:
+            lo, hi = sorted((self.__anchor, position))
+            self.selected.update(int(r) for r in self.list.items[lo:hi + 1] if r >= 0)
+            self.list.refresh()
+        elif control:
+            self.selected.symmetric_difference_update({row})
+            self.__anchor = position
+            self.list.refresh()
+        else:
+            self.__anchor = None
+            self.action([row])
 
-    def add_label(self, label):
-        self.label = ttk.Label(self.frame, text=label.type)
-        self.label.bind('<Enter>', lambda event, id = label.rectangle_drawn: self.container.highlight(id))
-        self.label.bind('<Leave>', lambda event, id = label.rectangle_drawn: self.container.unhighlight(id))
-        self.label.bind('<1>', lambda event, id = label, label_id = self.label: self.container.send_label_to_bin(label, label_id))
-        self.label.pack()
+    def select_all(self):
+        if self.selected.issuperset(self.members):
+            self.selected.clear()
+        else:
+            self.selected.update(self.members)
+        self.list.refresh()
+
+    def move_selected(self):
+        indices = sorted(self.selected)
+        self.selected.clear()
+        self.action(indices)
+
+    def __hover(self, event):
+        position = self.list.row(event)
+        row = int(self.list.items[position]) if position is not None else -1
+        self.__highlight(row if row >= 0 else None)
+
+    def __highlight(self, index):
+        """ Highlight the label under the cursor on the canvas """
+        if index == self.__hovered:
+            return
+        if self.__hovered is not None:
+            self.container.unhighlight(self.__hovered)
+        if index is not None:
+            self.container.highlight(index)
+        self.__hovered = index
+
+class LabelsFrame(LabelPanel):
+    def __init__(self, container):
+        super().__init__(container, "Labels", "Bin", container.send_labels_to_bin)
 
 class LabelButtonFrame(ttk.Frame):
     def __init__(self, container):
@@ -475,37 +980,17 @@ class LabelButtonFrame(ttk.Frame):
         for widget in self.winfo_children():
             widget.grid(padx=0, pady=0)
 
-class BinsFrame(ttk.Frame):
+class BinsFrame(LabelPanel):
     def __init__(self, container):
-        super().__init__(container)
-        self.container = container
-        self.__create_widgets()
-        self.labels = []
-        self.label_widgets = []
-
-    def __create_widgets(self):
-        self.frame = ttk.LabelFrame(self, text="Bins", borderwidth=2, border=2)
-        self.frame.grid(column=0, row=0, sticky="NEWS")
-
-    def add_label(self, label):
-        self.labels.append(label)
-        self.label = ttk.Label(self.frame, text=label.type)
-        self.label.bind('<Enter>', lambda event, id = label.rectangle_drawn: self.container.highlight(id))
-        self.label.bind('<Leave>', lambda event, id = label.rectangle_drawn: self.container.unhighlight(id))
-        self.label.bind('<1>', lambda event, id = label, label_id = self.label: self.container.retrieve_label_from_bin(label, label_id))
-        self.label_widgets.append(self.label)
-        self.label.pack()
+        super().__init__(container, "Bins", "Retrieve", container.retrieve_labels_from_bin)
 
     def empty_bin(self):
-        print(self.container.labels_created)
-        for label_widget in self.label_widgets:
-            label_widget.destroy()
-        for label in self.labels:
-            self.container.canvas_image.canvas.delete(label.rectangle_drawn)
-            self.container.canvas_image.canvas.delete(label.text_drawn)
-            self.container.labels_created.remove(label)
-        self.labels = []
-        print(self.container.labels_created)
+        indices = sorted(self.members)
+        self.container.canvas_image.erase_labels(indices)
+        self.container.labels_created.delete(indices)  # tombstones, no list search
+        self.container.journal.delete(indices)
+        self.container.schedule_idle()
+        self.remove(indices)
 
 class BinButtonFrame(ttk.Frame):
     def __init__(self, container, bin_frame):
@@ -520,6 +1005,16 @@ class BinButtonFrame(ttk.Frame):
             widget.grid(padx=0, pady=0)
 
 if __name__ == "__main__":
-    app = App()
+    parser = argparse.ArgumentParser(description="Draw labels over the template images")
+    parser.add_argument("--trace", help="write Chrome trace JSON of the session to this file on close")
+    parser.add_argument("--overlay", action="store_true", help="show FPS and latency overlay, toggled with F3")
+    parser.add_argument("--yolo", metavar="DIR", help="also export YOLO labels 'class_id cx cy w h' into this folder")
+    parser.add_argument("--classes", default="classes.names", help="class names file of the YOLO class ids")
+    parser.add_argument("--propagate", action="store_true", help="copy labels of the previous frame into unlabelled images")
+    parser.add_argument("--change-threshold", type=float, default=12.0,
+                        help="mean grey level difference in the propagated box which marks it for the review")
+    args = parser.parse_args()
+    app = App(trace=args.trace, overlay=args.overlay, yolo_dir=args.yolo, classes=args.classes,
+              propagate=args.propagate, change_threshold=args.change_threshold)
     app.mainloop()
 
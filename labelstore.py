@@ -0,0 +1,125 @@
+import numpy as np
+
+
+class LabelStore:
+    """ Labels of one image in columns of the NumPy structured array.
+        A label is addressed by its row index, which stays the same till the store is compacted.
+        Deleted labels are only marked (tombstones), so delete is O(1) """
+    dtype = np.dtype([
+        ('cls', np.int16),  # class id, index in the classes list
+        ('x', np.float32), ('y', np.float32), ('x1', np.float32), ('y1', np.float32),  # box in image pixels
+        ('rect', np.int32), ('text', np.int32),  # canvas items of the box and its caption, -1 if not drawn
+        ('alive', np.bool_),  # False for the deleted labels
+    ])
+
+    def __init__(self, classes=(), capacity=16):
+        self.classes = []  # class names, index in the list is the class id
+        self.__ids = {}  # class name -> class id
+        for name in classes:
+            self.class_id(name)
+        self.rows = np.zeros(capacity, dtype=self.dtype)
+        self.count = 0  # number of used rows, deleted ones included
+
+    def __len__(self):
+        """ Return number of the alive labels """
+        return int(np.count_nonzero(self.rows['alive'][:self.count]))
+
+    def class_id(self, name):
+        """ Return id of the class name, new names are registered """
+        if name not in self.__ids:
+            self.__ids[name] = len(self.classes)
+            self.classes.append(name)
+        return self.__ids[name]
+
+    def __reserve(self, count):
+        """ Grow the array, so it has room for count more rows """
+        if self.count + count > len(self.rows):
+            rows = np.zeros(max(2 * len(self.rows), self.count + count), dtype=self.dtype)
+            rows[:self.count] = self.rows[:self.count]
+            self.rows = rows
+
+    def add(self, x, y, x1, y1, label_type, rect=-1, text=-1):
+        """ Add label and return its index """
+        self.__reserve(1)
+        index = self.count
+        self.rows[index] = (self.class_id(label_type), x, y, x1, y1, rect, text, True)
+        self.count += 1
+        return index
+
+    def extend(self, boxes, types):
+        """ Add Nx4 array of boxes with their class names at once. Return indices of the new labels """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        names, inverse = np.unique(np.asarray(types, dtype=str), return_inverse=True)
+        ids = np.array([self.class_id(str(name)) for name in names], dtype=np.int16)
+        self.__reserve(len(boxes))
+        new = self.rows[self.count:self.count + len(boxes)]
+        new['cls'] = ids[inverse.reshape(-1)] if len(boxes) else 0
+        for i, column in enumerate(('x', 'y', 'x1', 'y1')):
+            new[column] = boxes[:, i]
+        new['rect'] = new['text'] = -1
+        new['alive'] = True
+        self.count += len(boxes)
+        return np.arange(self.count - len(boxes), self.count)
+
+    def delete(self, indices):
+        """ Mark label (or array of labels) as deleted """
+        self.rows['alive'][indices] = False
+
+    def indices(self):
+        """ Return indices of the alive labels """
+        return np.flatnonzero(self.rows['alive'][:self.count])
+
+    def type(self, index):
+        """ Return class name of the label """
+        return self.classes[self.rows['cls'][index]]
+
+    def box(self, index):
+        """ Return (x, y, x1, y1) box of the label """
+        row = self.rows[index]
+        return float(row['x']), float(row['y']), float(row['x1']), float(row['y1'])
+
+    def boxes(self, indices=None):
+        """ Return Nx4 float32 array of the boxes of the labels, alive ones by default """
+        rows = self.rows[self.indices() if indices is None else indices]
+        return np.stack([rows['x'], rows['y'], rows['x1'], rows['y1']], axis=-1)
+
+    def transform(self, scale, dx=0.0, dy=0.0, indices=None):
+        """ Return boxes converted from image to canvas coordinates: canvas = image * scale + offset """
+        return self.boxes(indices) * np.float32(scale) + np.array([dx, dy, dx, dy], dtype=np.float32)
+
+    def compact(self):
+        """ Drop deleted labels. Indices of the labels change """
+        self.rows = self.rows[self.indices()].copy()
+        self.count = len(self.rows)
+
+    def copy(self):
+        store = LabelStore(self.classes)
+        store.rows = self.rows[:self.count].copy()
+        store.count = self.count
+        return store
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes
+
+    @classmethod
+    def load(cls, path, classes=()):
+        """ Read labels 'type x y x1 y1' from the text file """
+        store = cls(classes)
+        with open(path, 'r') as f:
+            fields = [line.split() for line in f if line.strip()]
+        if fields:
+            table = np.array(fields, dtype=str)
+            store.extend(table[:, 1:5].astype(np.float32), table[:, 0])
+        return store
+
+    def save(self, path):
+        """ Write alive labels 'type x y x1 y1' to the text file """
+        indices = self.indices()
+        names = np.array(self.classes + [''], dtype=object)[self.rows['cls'][indices]]
+        boxes = self.boxes(indices)
+        # the shortest text which is read back as the same float32, e.g. 12345.67 instead of 12345.669921875
+        lines = ['{0} {1} {2} {3} {4}\n'.format(name, *(np.format_float_positional(v, unique=True, trim='-')
+                                                       for v in box)) for name, box in zip(names, boxes)]
+        with open(path, 'w') as f:
+            f.writelines(lines)
@@ -1,229 +1,214 @@
 import os
-import glob
+import io
+import argparse
+import functools
+import multiprocessing.util
+import time
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageFilter, ImageDraw, ImageFont
 import random
-import textwrap
 import string
-import random
-import re
-
-import random
-from datetime import date
-from essential_generators import DocumentGenerator
-
-g = DocumentGenerator()
+import numpy as np
+from corpus import CorpusPool
+from catalog import Catalog
+from redact import redact
+from textlayout import FontPool, fit_to_box
+from labelstore import LabelStore
+from shards import ShardWriter, recover
+
+corpus = CorpusPool()  # texts are loaded from the pool file on the first draw
+fonts = FontPool()  # fonts are loaded once per process, on the first use
+shard_writer = None  # shards of the worker process, None when the variants are written as files
 
 def generate_sentence():
-    sentence = g.gen_sentence(min_words=2, max_words=10)
-    return sentence
+    return corpus.draw("sentence")
 
 def generate_account_name():
-    sentence = g.gen_sentence(min_words=2, max_words=4)
-    sentence = sentence.replace(" ", " and ", random.randint(0, sentence.count(" ")))
-    sentence = sentence.replace(" ", " & ", random.randint(0, sentence.count(" ")))
-    return sentence
+    return corpus.draw("account_name")
 
 def generate_curr_tick():
-    letters = string.ascii_uppercase
-    return "".join(random.choices(letters, k=3))
+    return corpus.draw("curr_ticker")
 
 def generate_random_iban():
-    # define the possible characters for each part of the IBAN number
-    country_code_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    check_digits_chars = "0123456789"
-    basic_bank_account_number_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-
-    # generate random characters for each part of the IBAN number
-    country_code = "".join([random.choice(country_code_chars) for _ in range(2)])
-    check_digits = "".join([random.choice(check_digits_chars) for _ in range(2)])
-    basic_bank_account_number = "".join([random.choice(basic_bank_account_number_chars) for _ in range(16)])
-
-    # return the random IBAN number as a string
-    return f"{country_code}{check_digits}{basic_bank_account_number}"
+    return corpus.draw("iban")
 
 def generate_random_swift_code():
-    # define the possible characters for each part of the SWIFT code
-    bank_code_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    country_code_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    location_code_chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    branch_code_chars = "0123456789"
-
-    # generate random characters for each part of the SWIFT code
-    bank_code = "".join([random.choice(bank_code_chars) for _ in range(4)])
-    country_code = "".join([random.choice(country_code_chars) for _ in range(2)])
-    location_code = "".join([random.choice(location_code_chars) for _ in range(2)])
-    branch_code = "".join([random.choice(branch_code_chars) for _ in range(3)])
-
-    # return the random SWIFT code as a string
-    return f"{bank_code}{country_code}{location_code}{branch_code}"
+    return corpus.draw("swift")
 
 def generate_random_date():
-    # generate a random date or return "ASAP" 20% of the time
-    if random.random() < 0.2:
-        return "ASAP"
-    else:
-        year = random.randint(1900, 2100)
-        month = random.randint(1, 12)
-        day = random.randint(1, 28)
-        d = date(year, month, day)
-
-    # generate a random format for the date string
-    formats = [
-        "%Y-%m-%d",
-        "%d/%m/%Y",
-        "%m-%d-%Y",
-        "%Y/%m/%d",
-        "%d-%m-%Y",
-        "%B %d, %Y",
-        "%A, %B %d %Y",
-        "%B %d, %Y",
-        "%A, %B %d %Y",
-        "%A, %B %d %Y",
-        "%B %d, %Y",
-        "%B %d %Y",
-    ]
-    format = random.choice(formats)
-
-    # return the date as a string in the chosen format
-    return d.strftime(format)
+    return corpus.draw("date")
 
 def generate_currency_value():
-    # generate a random numerical value
-    value = random.uniform(1, 100000)
-
-    # generate a random currency symbol
-    currency_symbol = random.choice(list(string.ascii_letters.split()))
-
-    # generate a random position for the currency symbol
-    position = random.choice(["before", "after", "split"])
-
-    # add the currency symbol and split the value as needed
-    if position == "before" or position == "after":
-        # round the value to 2 decimal places
-        value = round(value, 2)
-        # add the currency symbol before or after the value
-        if position == "before":
-            value = f"{currency_symbol}{value}"
-        elif position == "after":
-            value = f"{value}{currency_symbol}"
-    elif position == "split":
-        # generate a random split character
-        split_char = random.choice([",", "."])
-
-        # split the value by the split character
-        value = re.sub(r"(\d)(?=(\d{3})+$)", r"\1" + split_char, f"{value:,.2f}")
-
-    # return the formatted value
-    return value
+    return corpus.draw("value")
 
 def generate_ticker():
-    # generate a random length for the string
-    length = random.randint(1, 3)
+    return corpus.draw("ticker")
 
-    # generate a random string of the desired length
-    string = "".join([random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(5)])
-
-    # split the string into chunks of 5 or 7 characters and join them with underscores
-    return "_".join(["".join([random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(5)]) for i in range(length)])
-
-def blur_region(image, label):
+def blur_region(image, box):
     # crop the image to the desired region
-    cropped_image = image.crop((label.x, label.y, label.x1, label.y1))
+    cropped_image = image.crop(box)
 
     # apply the blur filter to the cropped image
     blurred_image = cropped_image.filter(ImageFilter.BLUR)
     blurred_image = blurred_image.filter(ImageFilter.BLUR)
     # paste the blurred image back onto the original image
-    image.paste(blurred_image, (label.x, label.y, label.x1, label.y1))
-
-def add_text(image, label, text):
-    # crop the image to the desired region
-    cropped_image = image.crop((label.x, label.y, label.x1, label.y1))
+    image.paste(blurred_image, box)
 
-    # create a Draw object to draw on the blurred image
-    draw = ImageDraw.Draw(cropped_image)
+def add_text(image, box, text):
+    # pick a font which fits the box and cut the text to the box width
+    x, y, x1, y1 = box
+    font = fonts.choice(y1 - y)
+    text, (text_width, text_height) = fit_to_box(font, text, x1 - x, y1 - y)
+    if text == "":
+        return
 
-    # generate some random text
-    text_width, text_height = draw.multiline_textsize(text)
+    # generate a random x and y coordinate within the region
+    x = random.randint(x, x1 - text_width)
+    y = random.randint(y, y1 - text_height)
 
-    while text_width > cropped_image.width or text_height > cropped_image.height:
-        text = text[:-1]
-        if text == "":
-            break
-        text_width, text_height = draw.multiline_textsize(text)
-
-    # generate a random x and y coordinate within the blurred region
-    x = random.randint(0, cropped_image.width - text_width)
-    y = random.randint(0, cropped_image.height - text_height)
-
-    # draw the text at the random position
+    # draw the text at the random position, it fits the box, so no crop is needed
     alignments = ["left", "center", "right"]
     align = random.choice(alignments)
-    draw.multiline_text((x, y), text, fill=(0,0,0), align=align)
-
-    # paste the blurred image back onto the original image
-    image.paste(cropped_image, (label.x, label.y, label.x1, label.y1))
-
-def blur_region_with_text(image, label):
-    # crop the image to the desired region
-    cropped_image = image.crop((label.x, label.y, label.x1, label.y1))
-
-    # apply the blur filter to the cropped image
-    blurred_image = cropped_image.filter(ImageFilter.BLUR)
-    blurred_image = blurred_image.filter(ImageFilter.BLUR)
-
-    # create a Draw object to draw on the blurred image
-    draw = ImageDraw.Draw(blurred_image)
-
-    # generate some random text
-    random_text = "".join([random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range( 5* (label.x1 - label.x)) ])
-
-    # measure the size of the text
-    text_width, text_height = draw.multiline_textsize(random_text)
-
-    # calculate the vertical center of the blurred image
-    y = (blurred_image.height - text_height) / 2
-
-    # draw the text at the vertical center of the blurred image
-    draw.multiline_text((0, y), random_text, fill=(0,0,0))
-
-    # paste the blurred image back onto the original image
-    image.paste(blurred_image, (label.x, label.y, label.x1, label.y1))
-
-class Label():
-    def __init__(self, x, y, x1, y1, label_type):
-        self.x = x
-        self.y = y
-        self.x1 = x1
-        self.y1 = y1
-        self.type = label_type
-
-files = [i for i in glob.glob("templates/*") if os.path.splitext(i)[1] in [".png", ".jpg", ".tif"] if os.path.exists(os.path.splitext(i)[0] + ".txt")]
-text_files = [os.path.splitext(file_path)[0] + ".txt" for file_path in files if os.path.exists(os.path.splitext(file_path)[0] + ".txt")]
-
-index = 0
-
-with open(text_files[0], "r") as f:
-    label_data = [i.strip().split(" ") for i in f.readlines()]
-    labels = [Label(int(float(j[1])), int(float(j[2])), int(float(j[3])), int(float(j[4])), j[0]) for j in label_data]
-
-img = Image.open(files[0])
-
-for label in labels:
-    print(label.type)
-    if label.type == "Redact_Blur":
-        # blur_region(img, label)
-        blur_region_with_text(img, label)
-    elif label.type == "Redact_Blur_Text":
-        blur_region_with_text(img, label)
-    elif label.type == "Value":
-        add_text(img, label, generate_currency_value())
-    elif label.type == "Curr_Ticker":
-        add_text(img, label, generate_curr_tick())
-    elif label.type == "Ticker":
-        add_text(img, label, generate_ticker())
-    elif label.type == "Date":
-        add_text(img, label, generate_random_date())
-    elif label.type == "Account_Name":
-        add_text(img, label, generate_account_name())
-img.show()
\ No newline at end of file
+    ImageDraw.Draw(image).text((x, y), text, font=font.font, fill=(0,0,0), align=align)
+
+def add_random_text(image, box):
+    # the region is blurred already by redact, only the text is drawn
+    draw_random_text(image, box)
+
+def draw_random_text(image, box):
+    x, y, x1, y1 = box
+    font = fonts.default()
+
+    # generate just enough random letters to fill the box width and cut them to the width
+    count = int((x1 - x) / font.advances(string.ascii_uppercase).min()) + 1
+    random_text, (text_width, text_height) = fit_to_box(font, "".join(random.choices(string.ascii_uppercase, k=count)), x1 - x, y1 - y)
+    if random_text == "":
+        return
+
+    # draw the text at the vertical center of the box
+    ImageDraw.Draw(image).text((x, y + (y1 - y - text_height) / 2), random_text, font=font.font, fill=(0,0,0))
+
+REDACT_TYPES = ("Redact_Blur", "Redact_Blur_Text")
+
+def find_templates(directory="templates"):
+    # pair every template image with its label file, images without labels are skipped
+    catalog = Catalog()
+    catalog.scan(directory)
+    templates = catalog.labelled(directory)
+    catalog.close()
+    return templates
+
+def read_labels(text_file):
+    return LabelStore.load(text_file)
+
+def render(page, labels):
+    # replace the content of every label region of the page array with random data of its type
+    # all redact regions are blurred at once, then the page is converted to the image for the text
+    boxes = labels.boxes()
+    # integer pixel boxes with the top left corner first, whatever direction they were drawn in
+    boxes = np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1).astype(int)
+    types = [labels.type(index) for index in labels.indices()]
+    redact(page, boxes[np.isin(types, REDACT_TYPES)] if types else boxes)
+    img = Image.fromarray(page)
+    for box, label_type in zip(map(tuple, boxes.tolist()), types):
+        if label_type in REDACT_TYPES:
+            add_random_text(img, box)
+        elif label_type == "Value":
+            add_text(img, box, generate_currency_value())
+        elif label_type == "Curr_Ticker":
+            add_text(img, box, generate_curr_tick())
+        elif label_type == "Ticker":
+            add_text(img, box, generate_ticker())
+        elif label_type == "Date":
+            add_text(img, box, generate_random_date())
+        elif label_type == "Account_Name":
+            add_text(img, box, generate_account_name())
+    return img
+
+@functools.lru_cache(maxsize=8)
+def load_template(file_path, text_file):
+    # decoded template array, its labels and raw label text, cached per worker process
+    page = np.asarray(Image.open(file_path).convert("RGB"))
+    with open(text_file, "r") as f:
+        label_text = f.read()
+    return page, read_labels(text_file), label_text
+
+def render_variant(task):
+    file_path, text_file, variant, seed, output, quality = task
+    # every variant gets its own random stream, so the output doesn't depend on the worker which rendered it
+    random.seed(f"{seed}:{os.path.basename(file_path)}:{variant}")
+    template, labels, label_text = load_template(file_path, text_file)
+    img = render(template.copy(), labels)
+    name = os.path.join(output, f"{os.path.splitext(os.path.basename(file_path))[0]}_{variant:05d}")
+    if shard_writer is not None:
+        data = io.BytesIO()
+        img.save(data, format="JPEG", quality=quality)
+        shard_writer.add(os.path.basename(name), {"jpg": data.getvalue(), "txt": label_text.encode()})
+        return name + ".jpg"
+    img.save(name + ".jpg", quality=quality)
+    with open(name + ".txt", "w") as f:
+        f.write(label_text)
+    return name + ".jpg"
+
+def use_corpus(path, size):
+    # point the worker to the text pool prepared by the main process
+    corpus.path, corpus.size = path, size
+
+def init_worker(path, size, shards=None, shard_bytes=256 << 20):
+    # every worker writes its own shards, they are closed when the pool shuts the worker down
+    global shard_writer
+    use_corpus(path, size)
+    if shards is not None:
+        shard_writer = ShardWriter(shards, f"variants-{os.getpid()}", shard_bytes)
+        multiprocessing.util.Finalize(shard_writer, shard_writer.close, exitpriority=10)
+
+def generate(templates, output, variants, workers=None, seed=0, quality=90, shards=False, shard_bytes=256 << 20):
+    # render variants of every template in the process pool, return number of written images
+    # with shards the variants are packed into tar shards in the output folder instead of separate files
+    os.makedirs(output, exist_ok=True)
+    corpus.load()  # the pool is refilled here once, not in every worker
+    tasks = [(file_path, text_file, variant, seed, output, quality) for file_path, text_file in templates for variant in range(variants)]
+    if shards:
+        recover(output, "variants-*")  # shards of the killed run, no worker is writing them now
+    initargs = (corpus.path, corpus.size, output if shards else None, shard_bytes)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+        # variants of one template go in one chunk, so the worker decodes the template once
+        chunksize = max(1, min(variants, 64))
+        return sum(1 for _ in executor.map(render_variant, tasks, chunksize=chunksize))
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic documents from the labelled templates")
+    parser.add_argument("--templates", default="templates", help="folder with template images and their label files")
+    parser.add_argument("--output", default="generated", help="folder for the generated images and labels")
+    parser.add_argument("-n", "--variants", type=int, default=10, help="number of variants of every template")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generators")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality of the generated images")
+    parser.add_argument("--show", action="store_true", help="render the first template once and show it")
+    parser.add_argument("--corpus", default=corpus.path, help="file of the pre-generated text pool")
+    parser.add_argument("--corpus-size", type=int, default=corpus.size, help="number of texts of every field in the pool")
+    parser.add_argument("--refresh-corpus", action="store_true", help="generate the text pool again")
+    parser.add_argument("--shards", action="store_true", help="pack the variants into tar shards in the output folder")
+    parser.add_argument("--shard-size", type=int, default=256, help="size of the shard in MB")
+    args = parser.parse_args()
+    use_corpus(args.corpus, args.corpus_size)
+    if args.refresh_corpus:
+        corpus.refill()
+
+    templates = find_templates(args.templates)
+    if not templates:
+        parser.error(f"no labelled templates in {args.templates}")
+    if args.show:
+        template, labels, _ = load_template(*templates[0])
+        render(template.copy(), labels).show()
+        return
+
+    start = time.perf_counter()
+    count = generate(templates, args.output, args.variants, args.workers, args.seed, args.quality,
+                     args.shards, args.shard_size << 20)
+    elapsed = time.perf_counter() - start
+    print(f"Written {count} images from {len(templates)} templates to {args.output} in {elapsed:.1f}s")
+    print(f"Throughput: {count / elapsed:.1f} images/s, {60 * count / elapsed:.0f} images/min with {args.workers} workers")
+
+if __name__ == "__main__":
+    main()
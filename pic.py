@@ -1,31 +1,369 @@
-import cv2
-import time
+import argparse
+import collections
+import glob
+import io
+import json
 import os
+import queue
+import signal
+import threading
+import time
+import numpy as np
+from PIL import Image
+from instrument import Profiler
+from shards import ShardWriter
+
+try:
+	import cv2
+except ImportError:  # frames are written with PIL and only the file camera works
+	cv2 = None
+
+
+class Camera:
+	""" Capture stream which stays open between the shots, it is reopened if it fails """
+	def __init__(self, source=0):
+		self.source = source
+		self.cap = None
+
+	def read(self):
+		""" Return BGR frame or None """
+		for attempt in range(2):
+			if self.cap is None or not self.cap.isOpened():
+				self.cap = cv2.VideoCapture(self.source)
+			ok, frame = self.cap.read()
+			if ok:
+				return frame
+			self.close()  # the stream is broken, reopen it once
+		return None
+
+	def close(self):
+		if self.cap is not None:
+			self.cap.release()
+			self.cap = None
+
+
+class FileCamera:
+	""" Fake camera which returns images of the folder one by one in a loop, for tests without a camera """
+	def __init__(self, directory, extensions=('.jpg', '.png')):
+		self.files = sorted(f for f in glob.glob(os.path.join(directory, '*')) if os.path.splitext(f)[1] in extensions)
+		self.position = 0
+		if not self.files:
+			raise ValueError('no images in {0}'.format(directory))
+
+	def read(self):
+		path = self.files[self.position % len(self.files)]
+		self.position += 1
+		return np.ascontiguousarray(np.asarray(Image.open(path).convert('RGB'))[..., ::-1])  # BGR like OpenCV
+
+	def close(self):
+		pass
+
+
+class Counter:
+	""" Sequence number of the shots, kept in a file of the output folder, so startup doesn't scan it.
+		The number is rewritten in place with the fixed width, one small write within a block, because
+		replacing the file by rename flushes it to the disk on every shot """
+	width = 20
+
+	def __init__(self, directory, name='.counter'):
+		self.path = os.path.join(directory, name)
+		self.lock = threading.Lock()
+		try:
+			with open(self.path, 'r') as f:
+				self.value = int(f.read().strip() or 0)
+		except (OSError, ValueError):
+			self.value = self.scan(directory)  # the first run over an old folder
+		self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+
+	@staticmethod
+	def scan(directory):
+		""" Return the biggest number of the written images """
+		numbers = [int(name[:-4]) for name in os.listdir(directory) if name.endswith('.jpg') and name[:-4].isdigit()]
+		return max(numbers, default=0)
+
+	def next(self):
+		with self.lock:
+			self.value += 1
+			os.pwrite(self.fd, '{0:0{1}d}\n'.format(self.value, self.width).encode(), 0)
+			return self.value
+
+	def close(self):
+		with self.lock:
+			if self.fd is not None:
+				os.close(self.fd)
+				self.fd = None
+
+
+def encode_jpeg(frame, quality):
+	""" Return JPEG bytes of BGR frame """
+	if cv2 is not None:
+		ok, data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+		return data.tobytes()
+	data = io.BytesIO()
+	Image.fromarray(frame[..., ::-1]).save(data, format='JPEG', quality=quality)
+	return data.getvalue()
+
+
+def write_jpeg(path, frame, quality):
+	""" Write BGR frame as JPEG """
+	data = encode_jpeg(frame, quality)  # a bad frame leaves no file behind
+	tmp = path + '.tmp'
+	with open(tmp, 'wb') as f:
+		f.write(data)
+	os.replace(tmp, path)  # readers never see a half-written image
+
+
+class Writer:
+	""" Pool of threads which write the frames from the bounded queue. When the disk is too slow and
+		the queue is full, new frames are dropped, so the capture keeps its timing.
+		With shards the frames are packed into them, the key is the path relative to the shard folder """
+	def __init__(self, quality=95, workers=2, size=16, shards=None):
+		self.quality = quality
+		self.shards = shards
+		self.queue = queue.Queue(maxsize=size)
+		self.lock = threading.Lock()  # the counters are changed by the capture and writer threads
+		self.written = 0
+		self.dropped = 0
+		self.failed = 0  # frames which could not be written
+		self.failures = collections.Counter()  # camera name -> frames which could not be written
+		self.threads = [threading.Thread(target=self.__work, daemon=True) for _ in range(workers)]
+		for thread in self.threads:
+			thread.start()
+
+	def put(self, path, frame, name=None):
+		""" Queue the frame of the camera, return False if it is dropped """
+		try:
+			self.queue.put_nowait((path, frame, name))
+			return True
+		except queue.Full:
+			with self.lock:
+				self.dropped += 1
+			print('Queue is full, dropped {0}'.format(path))
+			return False
+
+	def __work(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+			path, frame, name = item
+			try:
+				if self.shards is not None:
+					key = os.path.splitext(os.path.relpath(path, self.shards.directory))[0].replace(os.sep, '/')
+					self.shards.add(key, {'jpg': encode_jpeg(frame, self.quality)})
+				else:
+					write_jpeg(path, frame, self.quality)
+			except Exception as e:  # full disk or bad frame, the thread goes on with the next frame
+				with self.lock:
+					self.failed += 1
+					self.failures[name] += 1
+				print('Failed to write {0}: {1}'.format(path, e))
+				continue
+			with self.lock:
+				self.written += 1
+			print('Written {0}!'.format(path))
+
+	def close(self):
+		""" Write the queued frames and stop the threads """
+		for _ in self.threads:
+			self.queue.put(None)
+		for thread in self.threads:
+			thread.join()
+		if self.shards is not None:
+			self.shards.close()
+
+
+def open_camera(source):
+	""" Return camera of the source: folder of images (fake camera), device index, video file or stream URL """
+	if os.path.isdir(source):
+		return FileCamera(source)
+	if cv2 is None:
+		raise RuntimeError('OpenCV is needed for {0}, use a folder of images as a fake camera'.format(source))
+	return Camera(int(source) if source.isdigit() else source)
+
+
+class CameraJob:
+	""" Capture thread of one camera. Shots are on the fixed grid start + k * interval, so the time of
+		the capture doesn't drift, and the ticks missed by a slow camera are skipped, not bunched up """
+	def __init__(self, name, camera, output, interval, writer, profiler, stop):
+		os.makedirs(output, exist_ok=True)
+		self.name = name
+		self.camera = camera
+		self.output = output
+		self.interval = interval
+		self.counter = Counter(output)
+		self.writer = writer  # shared by all cameras
+		self.profiler = profiler
+		self.stop = stop  # event which stops all cameras
+		self.shots = 0
+		self.thread = None
+
+	def shoot(self):
+		start = time.perf_counter()
+		try:
+			frame = self.camera.read()
+		except Exception as e:  # the broken camera must not stop the others
+			print('Camera {0} failed: {1}'.format(self.name, e))
+			frame = None
+		self.profiler.record(self.name + ' capture', start, time.perf_counter() - start)
+		if frame is None:
+			self.profiler.count(self.name + ' failed')
+			return None
+		path = os.path.join(self.output, '{0}.jpg'.format(self.counter.next()))
+		if not self.writer.put(path, frame, self.name):
+			self.profiler.count(self.name + ' dropped')
+		return path
+
+	def run(self, count=None, finished=None):
+		""" Capture count frames or until the stop event. finished() is called when the capture ends """
+		deadline = time.monotonic()
+		try:
+			while not self.stop.is_set() and (count is None or self.shots < count):
+				self.shoot()
+				self.shots += 1
+				deadline += self.interval
+				missed = int((time.monotonic() - deadline) // self.interval) + 1 if self.interval > 0 else 0
+				if missed > 0:  # the shot took longer than the interval
+					deadline += missed * self.interval
+					self.profiler.count(self.name + ' missed', missed)
+				if count is None or self.shots < count:
+					self.stop.wait(max(0.0, deadline - time.monotonic()))
+		finally:
+			self.camera.close()
+			self.counter.close()
+			if finished is not None:
+				finished()
+
+	def start(self, count=None, finished=None):
+		self.thread = threading.Thread(target=self.run, args=(count, finished), name=self.name, daemon=True)
+		self.thread.start()
+
+	def metrics(self):
+		""" Return dictionary of the capture statistics, latencies are in milliseconds """
+		key = self.name + ' capture'
+		counters = self.profiler.counters
+		return {'shots': self.shots, 'failed': counters[self.name + ' failed'],
+				'dropped': counters[self.name + ' dropped'], 'missed': counters[self.name + ' missed'],
+				'write_failed': self.writer.failures[self.name],
+				'latency_p50': self.profiler.latency(key, 50), 'latency_p90': self.profiler.latency(key, 90),
+				'latency_max': self.profiler.latency(key, 100)}
+
+
+class Scheduler:
+	""" Capture from many cameras at once. Every camera has its own thread, interval, subfolder of the
+		output and counter, so a slow or broken camera never delays the others. Frames of all cameras
+		are written by one pool of writer threads, as files or into the shards of the output folder """
+	def __init__(self, output, quality=95, writers=2, queue_size=16, window=1000, shard_bytes=None, shard_age=3600.0):
+		self.output = output
+		shards = ShardWriter(output, 'capture', shard_bytes, max_age=shard_age) if shard_bytes else None
+		self.writer = Writer(quality, writers, queue_size, shards)
+		self.profiler = Profiler(enabled=True, capacity=10 * window, window=window)
+		self.stop = threading.Event()  # set by close() or SIGTERM, or when the last camera took its count
+		self.jobs = []
+		self.running = 0  # cameras which still capture
+		self.lock = threading.Lock()
+
+	def add(self, name, camera, interval=300.0, subfolder=True):
+		""" Add camera, its images go into output/name or into output if subfolder is False """
+		output = os.path.join(self.output, name) if subfolder else self.output
+		job = CameraJob(name, camera, output, interval, self.writer, self.profiler, self.stop)
+		self.jobs.append(job)
+		return job
+
+	def start(self, count=None):
+		self.running = len(self.jobs)
+		for job in self.jobs:
+			job.start(count, self.__finished)
+
+	def __finished(self):
+		with self.lock:
+			self.running -= 1
+			if self.running == 0:
+				self.stop.set()  # wake up the report loop at once
+
+	def alive(self):
+		return any(job.thread.is_alive() for job in self.jobs)
+
+	def metrics(self):
+		metrics = {job.name: job.metrics() for job in self.jobs}
+		metrics['writer'] = {'written': self.writer.written, 'dropped': self.writer.dropped, 'failed': self.writer.failed,
+							 'queued': self.writer.queue.qsize()}
+		return metrics
+
+	def close(self, timeout=5.0):
+		""" Stop the cameras and write the queued frames. A camera hung in the read is left behind """
+		self.stop.set()
+		for job in self.jobs:
+			job.thread.join(timeout)
+		self.writer.close()
+
+
+def write_metrics(path, metrics):
+	tmp = path + '.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(metrics, f, indent=2)
+	os.replace(tmp, path)
+
+
+def read_cameras(args):
+	""" Return list of (name, source, interval) of the command line or of the JSON config """
+	if args.config:
+		with open(args.config, 'r') as f:
+			return [(c['name'], str(c['source']), float(c.get('interval', args.interval))) for c in json.load(f)]
+	cameras = []
+	for camera in args.camera:
+		name, _, source = camera.partition('=')
+		cameras.append((name, source or name, args.interval))
+	return cameras
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Capture frames from the cameras every interval')
+	parser.add_argument('--camera', action='append', default=[],
+						help='NAME=SOURCE, SOURCE is device index, video file, stream URL or folder of images')
+	parser.add_argument('--config', help='JSON list of cameras {"name", "source", "interval"}')
+	parser.add_argument('--source', default='0', help='camera index or stream URL of the single camera')
+	parser.add_argument('--fake', help='folder of images used as a fake single camera')
+	parser.add_argument('--output', default='pic', help='folder of the captured images')
+	parser.add_argument('--interval', type=float, default=300.0, help='seconds between the shots')
+	parser.add_argument('--quality', type=int, default=95, help='JPEG quality')
+	parser.add_argument('--writers', type=int, default=2, help='number of writer threads')
+	parser.add_argument('--queue', type=int, default=16, help='number of frames waiting for the writers')
+	parser.add_argument('--count', type=int, help='stop after this many shots of every camera')
+	parser.add_argument('--metrics', help='JSON file of the capture metrics, rewritten every report period')
+	parser.add_argument('--report', type=float, default=60.0, help='seconds between the metrics reports')
+	parser.add_argument('--shards', action='store_true', help='pack the frames into tar shards in the output folder')
+	parser.add_argument('--shard-size', type=int, default=256, help='size of the shard in MB')
+	parser.add_argument('--shard-age', type=float, default=3600.0, help='seconds after which an unfilled shard is closed')
+	args = parser.parse_args()
+	scheduler = Scheduler(args.output, args.quality, args.writers, args.queue,
+						  shard_bytes=args.shard_size << 20 if args.shards else None, shard_age=args.shard_age)
+	try:
+		cameras = read_cameras(args)
+		if cameras:
+			for name, source, interval in cameras:
+				scheduler.add(name, open_camera(source), interval)
+		else:  # the single camera writes straight into the output folder
+			scheduler.add('camera', open_camera(args.fake or args.source), args.interval, subfolder=False)
+	except (RuntimeError, ValueError) as e:
+		scheduler.writer.close()
+		parser.error(str(e))
+	# the service manager stops the daemon with SIGTERM, the queued frames and the open shard are saved then
+	signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop.set())
+	scheduler.start(args.count)
+	try:
+		while not scheduler.stop.wait(args.report):
+			if args.metrics:
+				write_metrics(args.metrics, scheduler.metrics())
+	except KeyboardInterrupt:
+		pass
+	finally:
+		scheduler.close()
+	metrics = scheduler.metrics()
+	if args.metrics:
+		write_metrics(args.metrics, metrics)
+	print(json.dumps(metrics, indent=2))
+
 
-def takePic():
-	cap = cv2.VideoCapture(0)
-	if cap.isOpened():
-		_, frame = cap.read()
-	cap.release()
-	return frame
-
-def savePic(pic, counter):
-	cv2.imwrite(str(counter)+'.jpg', pic)
-	print('Written {0}.jpg!'.format(counter))
-
-def updateCounter():
-	counter = 0
-	for file in os.listdir('D:/Work/carpark/pic'):
-		if file.endswith('.jpg'):
-			number = int(file.strip('.jpg'))
-			if number > counter:
-				counter = number
-	return counter
-
-counter = updateCounter() + 1
-os.chdir('D:/work/carpark/pic')
-while True:
-	pic = takePic()
-	savePic(pic, counter)
-	counter += 1
-	time.sleep(300)
+if __name__ == '__main__':
+	main()
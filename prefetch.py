@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+
+class ImageCache:
+    """ Thread safe LRU cache with a memory budget in bytes """
+    def __init__(self, budget=512 << 20):
+        self.budget = budget  # maximal total size of the cached values
+        self.size = 0  # current total size of the cached values
+        self.__items = OrderedDict()  # key -> (value, size), the most recently used is the last
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__items)
+
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__items
+
+    def get(self, key, default=None):
+        """ Return cached value and mark it as the most recently used """
+        with self.__lock:
+            if key not in self.__items:
+                return default
+            self.__items.move_to_end(key)
+            return self.__items[key][0]
+
+    def put(self, key, value, size):
+        """ Cache value and evict the least recently used ones till the cache fits into the budget """
+        with self.__lock:
+            if key in self.__items:
+                self.size -= self.__items.pop(key)[1]
+            self.__items[key] = (value, size)
+            self.size += size
+            while self.size > self.budget and len(self.__items) > 1:
+                _, (_, evicted) = self.__items.popitem(last=False)
+                self.size -= evicted
+
+    def discard(self, key):
+        """ Remove value from the cache if it is there """
+        with self.__lock:
+            if key in self.__items:
+                self.size -= self.__items.pop(key)[1]
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+            self.size = 0
+
+
+class Prefetcher:
+    """ Load values in the thread pool ahead of time and keep them in the ImageCache """
+    def __init__(self, loader, cache, sizeof, workers=2):
+        self.loader = loader  # function which loads value by key
+        self.cache = cache  # ImageCache for the loaded values
+        self.sizeof = sizeof  # function which returns size of the value in bytes
+        self.__pending = {}  # key -> future of the loading value
+        self.__lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    def __load(self, key):
+        """ Load value and put it into the cache, runs in the thread pool """
+        try:
+            value = self.loader(key)
+            self.cache.put(key, value, self.sizeof(value))
+            return value
+        finally:
+            with self.__lock:
+                self.__pending.pop(key, None)
+
+    def prefetch(self, keys):
+        """ Schedule loading of the keys, cancel scheduled loadings of the other keys """
+        with self.__lock:
+            for key, future in list(self.__pending.items()):
+                if key not in keys and future.cancel():
+                    del self.__pending[key]
+            for key in keys:
+                if key not in self.__pending and key not in self.cache:
+                    self.__pending[key] = self.__executor.submit(self.__load, key)
+
+    def get(self, key):
+        """ Return value, wait for it if it is loading now or load it in the calling thread """
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+        with self.__lock:
+            future = self.__pending.get(key)
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:  # loading was cancelled by the next prefetch
+                pass
+        return self.__load(key)
+
+    def shutdown(self):
+        """ Cancel scheduled loadings and stop the thread pool """
+        self.__executor.shutdown(wait=False, cancel_futures=True)
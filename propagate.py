@@ -0,0 +1,50 @@
+import numpy as np
+from PIL import Image
+from labelstore import LabelStore
+from spatial import normalized
+
+
+def frame_gray(path, max_side=1024):
+    """ Return float32 grayscale array of the image reduced to max_side and its scale to the image pixels """
+    with Image.open(path) as image:
+        width = image.width
+        image.draft('L', (max_side, max_side))  # JPEG is decoded at the reduced scale
+        gray = image.convert('L')
+    if max(gray.size) > max_side:
+        k = max_side / max(gray.size)
+        gray = gray.resize((max(1, round(gray.width * k)), max(1, round(gray.height * k))), Image.BILINEAR)
+    return np.asarray(gray, dtype=np.float32), gray.width / width
+
+
+def box_changes(previous, current, boxes, scale=1.0):
+    """ Return mean absolute difference of the frames inside every Nx4 box (x, y, x1, y1) in image pixels.
+        The mean brightness of every frame is subtracted first, so a passing cloud doesn't flag all boxes.
+        Box sums are read from the integral image, so the cost doesn't depend on the box sizes """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if previous.shape != current.shape:
+        return np.full(len(boxes), np.inf, dtype=np.float32)  # another camera or resolution
+    diff = np.abs((previous - previous.mean()) - (current - current.mean()))
+    integral = np.zeros((diff.shape[0] + 1, diff.shape[1] + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(diff, axis=0), axis=1, out=integral[1:, 1:])
+    height, width = diff.shape
+    b = normalized(boxes * np.float32(scale))
+    x = np.clip(np.floor(b[:, 0]), 0, width - 1).astype(np.int64)
+    y = np.clip(np.floor(b[:, 1]), 0, height - 1).astype(np.int64)
+    x1 = np.clip(np.ceil(b[:, 2]), x + 1, width).astype(np.int64)  # every box covers one pixel at least
+    y1 = np.clip(np.ceil(b[:, 3]), y + 1, height).astype(np.int64)
+    sums = integral[y1, x1] - integral[y, x1] - integral[y1, x] + integral[y, x]
+    return (sums / ((x1 - x) * (y1 - y))).astype(np.float32)
+
+
+def propagate(labels, indices, previous_path, current_path, threshold=12.0, max_side=1024):
+    """ Return the labels of the previous frame copied into the new LabelStore and the boolean array,
+        which is True for the copied labels whose box content changed by more than threshold grey levels """
+    store = LabelStore(labels.classes)
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        return store, np.zeros(0, dtype=bool)
+    boxes = labels.boxes(indices)
+    store.extend(boxes, np.array(labels.classes, dtype=object)[labels.rows['cls'][indices]].astype(str))
+    previous, scale = frame_gray(previous_path, max_side)
+    current, _ = frame_gray(current_path, max_side)
+    return store, box_changes(previous, current, boxes, scale) > threshold
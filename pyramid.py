@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from PIL import Image
+from instrument import timed
+
+HUGE_SIZE = 14000  # images with more than HUGE_SIZE ** 2 pixels are memory-mapped and reduced band by band
+
+
+@timed('build_pyramid')
+def build_pyramid(image, reduction=2, top_size=512, resample=Image.LANCZOS):
+    """ Return list of images, each one reduced by reduction degree, till top image is around top_size """
+    pyramid = [image]
+    w, h = image.size
+    while w > top_size and h > top_size:  # top pyramid image is around top_size pixels in size
+        w /= reduction  # divide on reduction degree
+        h /= reduction
+        pyramid.append(pyramid[-1].resize((int(w), int(h)), resample))
+    return pyramid
+
+
+def pyramid_sizes(size, reduction=2, top_size=512):
+    """ Return sizes of the pyramid levels, they are the same as build_pyramid makes """
+    sizes = [tuple(size)]
+    w, h = size
+    while w > top_size and h > top_size:
+        w /= reduction
+        h /= reduction
+        sizes.append((int(w), int(h)))
+    return sizes
+
+
+def huge_reduction(width, height, huge_size=HUGE_SIZE):
+    """ Return size of the reduced huge image and its compression ratio """
+    w1, h1 = float(width), float(height)
+    w2, h2 = float(huge_size), float(huge_size)
+    aspect_ratio1 = w1 / h1
+    aspect_ratio2 = w2 / h2  # it equals to 1.0
+    if aspect_ratio1 == aspect_ratio2:
+        return (int(w2), int(h2)), h2 / h1
+    elif aspect_ratio1 > aspect_ratio2:
+        return (int(w2), int(w2 / aspect_ratio1)), h2 / w1
+    else:  # aspect_ratio1 < aspect_ration2
+        return (int(h2 * aspect_ratio1), int(h2)), h2 / h1
+
+
+@timed('reduce_huge')
+def reduce_huge(raw, huge_size=HUGE_SIZE, band_width=1024, resample=Image.LANCZOS, progress=True, cancelled=None):
+    """ Resize memory-mapped huge image proportionally band by band, return image around huge_size.
+        Return None if cancelled() becomes true between the bands """
+    size, k = huge_reduction(raw.width, raw.height, huge_size)  # compression ratio
+    image = Image.new('RGB', size)
+    w = size[0]  # band length
+    i, j, n = 0, 1, round(0.5 + raw.height / band_width)
+    while i < raw.height:
+        if cancelled is not None and cancelled():
+            return None
+        if progress:
+            print('\rOpening image: {j} from {n}'.format(j=j, n=n), end='')
+        band = min(band_width, raw.height - i)  # width of the tile band
+        cropped = raw.crop((0, i, raw.width, i + band))  # read tile band from the memory map
+        image.paste(cropped.resize((w, int(band * k)+1), resample), (0, int(i * k)))
+        i += band
+        j += 1
+    if progress:
+        print('\r' + 30*' ' + '\r', end='')  # hide printed string
+    return image
+
+
+class LazyPyramid:
+    """ Image pyramid which levels are built on demand by the background worker.
+        Till a level is built it is stood in by the low-quality preview, so the viewer shows
+        the image at once. Levels are requested by indexing and refined one by one in the worker,
+        the version grows every time a level is ready """
+    def __init__(self, source, size, preview, reduction=2, top_size=512, resample=Image.LANCZOS,
+                 executor=None, on_complete=None):
+        self.sizes = pyramid_sizes(size, reduction, top_size)
+        self.preview = preview  # low-quality image of any size
+        self.resample = resample
+        self.version = 0  # number of the built levels
+        self.__source = source  # callable of the cancel check which returns the biggest level or None
+        self.__levels = [None] * len(self.sizes)
+        self.__executor = executor  # levels are built synchronously without executor
+        self.__on_complete = on_complete  # called with the levels in the worker, e.g. to cache them
+        self.__requested = []  # levels wanted by the viewer, the last one is built first
+        self.__refine = False  # build all levels when nothing is requested
+        self.__running = False  # worker is submitted
+        self.__closed = False
+        self.__lock = threading.Lock()  # guards the requests
+        self.__build_lock = threading.Lock()  # only one level is built at a time
+
+    @classmethod
+    def from_levels(cls, levels, reduction=2, top_size=512):
+        """ Wrap list of the ready levels, e.g. from the cache or the prefetcher """
+        pyramid = cls(None, levels[0].size, levels[-1], reduction, top_size)
+        pyramid.sizes = [level.size for level in levels]
+        pyramid.__levels = list(levels)
+        pyramid.version = len(levels)
+        return pyramid
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __iter__(self):
+        return (self.wait(i) for i in range(len(self)))
+
+    def size(self, i):
+        """ Return size of the level, the stand-in image is scaled to it """
+        return self.sizes[i]
+
+    def ready(self, i):
+        return self.__levels[i] is not None
+
+    @property
+    def complete(self):
+        return all(level is not None for level in self.__levels)
+
+    def __getitem__(self, i):
+        """ Return the level or the preview if the level is not built yet. The level is requested """
+        level = self.__levels[i]
+        if level is None:
+            self.request(i)
+            return self.preview
+        return level
+
+    def wait(self, i):
+        """ Return the level, build it now if it is not ready """
+        if self.__levels[i] is None:
+            self.__build(i)
+        return self.__levels[i]
+
+    def request(self, i):
+        """ Build the level in the background """
+        if self.__executor is None:
+            self.wait(i)
+            return
+        with self.__lock:
+            if i not in self.__requested:
+                self.__requested.append(i)
+            self.__start()
+
+    def refine(self):
+        """ Build all levels in the background, the requested ones first """
+        if self.__executor is None:
+            return
+        with self.__lock:
+            self.__refine = True
+            self.__start()
+
+    def close(self):
+        """ Drop the levels and stop the worker. It doesn't wait for the level being built,
+            the worker checks closing between the bands and drops its result """
+        with self.__lock:
+            self.__closed = True
+            self.__requested = []
+            self.__levels = [None] * len(self.sizes)
+            self.preview = self.__source = None
+
+    def __cancelled(self):
+        return self.__closed
+
+    def __start(self):
+        if not self.__running and not self.__closed:
+            self.__running = True
+            self.__executor.submit(self.__work)
+
+    def __next(self):
+        """ Return next level to build or None """
+        while self.__requested:
+            i = self.__requested.pop()
+            if self.__levels[i] is None:
+                return i
+        if self.__refine:
+            for i, level in enumerate(self.__levels):
+                if level is None:
+                    return i
+        return None
+
+    def __work(self):
+        while True:
+            with self.__lock:
+                i = None if self.__closed else self.__next()
+                if i is None:
+                    self.__running = False
+                    break
+            self.__build(i)
+        if self.__refine and not self.__closed and self.__on_complete is not None and self.complete:
+            self.__on_complete(list(self.__levels))
+            self.__on_complete = None
+
+    def __build(self, i):
+        with self.__build_lock:
+            for j in sorted({0, i}):  # smaller levels are reduced from the biggest one
+                if self.__levels[j] is not None or self.__closed:
+                    continue
+                levels, source = self.__levels, self.__source  # close() replaces them
+                if j == 0:
+                    image = None if source is None else source(self.__cancelled)
+                    if image is not None:
+                        image.load()
+                else:  # reduce the nearest bigger level which is ready
+                    finer = max(k for k in range(j) if levels[k] is not None)
+                    image = levels[finer].resize(self.sizes[j], self.resample)
+                with self.__lock:
+                    if image is None or self.__closed:
+                        return  # closed while building, the result is dropped
+                    self.__levels[j] = image
+                    self.version += 1
+
+
+@timed('open_pyramid')
+def open_pyramid(path, raw=None, huge_size=HUGE_SIZE, reduction=2, top_size=512, resample=Image.LANCZOS,
+                 executor=None, on_complete=None):
+    """ Return LazyPyramid of the image with a fast preview. JPEG preview is decoded by draft(),
+        huge raw image is sampled from the memory map and the other images are reduced by NEAREST """
+    if raw is not None:  # huge image, the biggest level is reduced band by band from the memory map
+        size, _ = huge_reduction(raw.width, raw.height, huge_size)
+        step = max(1, max(raw.width, raw.height) // (2 * top_size))
+        preview = Image.fromarray(np.ascontiguousarray(raw.pixels[::step, ::step]))
+        def source(cancelled):  # closing the pyramid stops the reduction between the bands
+            return reduce_huge(raw, huge_size, resample=resample, progress=False, cancelled=cancelled)
+        return LazyPyramid(source, size, preview, reduction, top_size, resample, executor, on_complete)
+    image = Image.open(path)
+    size = image.size
+    sizes = pyramid_sizes(size, reduction, top_size)
+    if image.format == 'JPEG':  # DCT scaling decodes 1/2 to 1/8 of the image
+        preview = Image.open(path)
+        preview.draft(preview.mode, sizes[-1])
+        preview.load()
+        return LazyPyramid(lambda cancelled: image, size, preview, reduction, top_size, resample, executor, on_complete)
+    image.load()  # the other formats are decoded completely anyway
+    pyramid = LazyPyramid(lambda cancelled: image, size, image.resize(sizes[-1], Image.NEAREST),
+                          reduction, top_size, resample, executor, on_complete)
+    pyramid.wait(0)  # the biggest level is ready already
+    return pyramid
+
+
+class PyramidCache:
+    """ Persistent on-disk cache of image pyramids.
+        Every pyramid level is stored as a .npy file, so it is memory-mapped on load without a copy.
+        RGB levels are stored as RGBX, PIL keeps RGB in 4 bytes per pixel and maps only such buffers.
+        Entries are keyed by path, mtime and size of the source image, least recently used
+        entries are evicted when the total size of the cache exceeds the budget """
+    modes = ('L', 'RGBA', 'RGBX')  # modes which PIL maps without a copy
+
+    def __init__(self, directory='.pyramid_cache', budget=1 << 30):
+        self.directory = directory  # cache folder
+        self.budget = budget  # total size of the cache in bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, path):
+        """ Return key of the image, it changes when the image is modified """
+        stat = os.stat(path)
+        raw = '{0}|{1}|{2}'.format(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def load(self, path):
+        """ Return cached pyramid of the image or None if it is not in the cache """
+        entry = os.path.join(self.directory, self.key(path))
+        meta_path = os.path.join(entry, 'meta.json')
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            levels = [np.load(os.path.join(entry, '{0}.npy'.format(i)), mmap_mode='r')
+                      for i in range(meta['levels'])]
+        except (OSError, ValueError, KeyError):
+            return None  # entry is absent or broken
+        os.utime(meta_path)  # remember the last access for eviction
+        mode = meta.get('mode', 'RGB')  # entries of the old versions are RGB, they are copied
+        # read-only images over the memory maps, pages are read from the disk when the level is drawn
+        return [Image.frombuffer(mode, (level.shape[1], level.shape[0]), level, 'raw', mode, 0, 1) for level in levels]
+
+    def store(self, path, pyramid):
+        """ Save pyramid of the image into the cache and evict stale entries """
+        key = self.key(path)
+        entry = os.path.join(self.directory, key)
+        if os.path.exists(entry):
+            return
+        tmp = os.path.join(self.directory, '{0}.{1}.{2}.tmp'.format(key, os.getpid(), threading.get_ident()))
+        os.makedirs(tmp, exist_ok=True)
+        mode = pyramid[0].mode if pyramid[0].mode in self.modes else 'RGBX'
+        for i, level in enumerate(pyramid):
+            np.save(os.path.join(tmp, '{0}.npy'.format(i)), np.asarray(level.convert(mode)))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'path': os.path.abspath(path), 'mode': mode, 'levels': len(pyramid)}, f)
+        try:
+            os.replace(tmp, entry)  # publish the entry atomically
+        except OSError:  # entry was stored by somebody else
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries till the cache fits into the budget """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.endswith('.tmp'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                used = os.stat(os.path.join(entry.path, 'meta.json')).st_mtime
+            except OSError:
+                used, size = 0, 0  # broken entry, evict it first
+            entries.append((used, size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in sorted(entries):
+            if total <= self.budget:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """ Remove all entries from the cache """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
@@ -0,0 +1,56 @@
+import numpy as np
+from PIL import Image
+
+
+class RawImage:
+    """ Memory-mapped access to the pixels of an uncompressed image file.
+        Row bands and crops are NumPy views on the file, nothing is read till they are used """
+    rawmodes = {  # raw mode -> (image mode, number of bytes per pixel, order of channels)
+        'L': ('L', 1, None),
+        'RGB': ('RGB', 3, None),
+        'BGR': ('RGB', 3, slice(None, None, -1)),
+        'RGBX': ('RGB', 4, slice(0, 3)),
+        'BGRX': ('RGB', 4, slice(2, None, -1)),
+        'RGBA': ('RGBA', 4, None),
+    }
+
+    def __init__(self, path, size, offset, rawmode='RGB', stride=0, orientation=1):
+        """ Map the pixels of the image, arguments are the same as for the 'raw' PIL decoder """
+        self.path = path
+        self.width, self.height = size
+        self.mode, bands, channels = self.rawmodes[rawmode]
+        stride = stride or self.width * bands  # length of the row in bytes
+        self.__map = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(self.height, stride))
+        pixels = self.__map[:, :self.width * bands].reshape(self.height, self.width, bands)
+        if orientation < 0:  # rows are stored bottom-up
+            pixels = pixels[::-1]
+        if channels is not None:
+            pixels = pixels[..., channels]
+        self.pixels = pixels[..., 0] if self.mode == 'L' else pixels  # view of all image pixels
+
+    @classmethod
+    def from_image(cls, image):
+        """ Map the pixels of the opened PIL image or return None if it can't be memory-mapped """
+        if len(image.tile) != 1 or image.tile[0][0] != 'raw':
+            return None
+        _, extent, offset, args = image.tile[0]
+        if isinstance(args, str):
+            args = (args,)
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if rawmode not in cls.rawmodes or tuple(extent) != (0, 0) + image.size:
+            return None
+        return cls(image.filename, image.size, offset, rawmode, stride, orientation)
+
+    def band(self, top, bottom):
+        """ Return rows from top to bottom as a view on the file """
+        return self.pixels[top:bottom]
+
+    def crop(self, bbox):
+        """ Crop rectangle from the image and return it, only this rectangle is read from the file """
+        x1, y1, x2, y2 = bbox
+        return Image.fromarray(np.ascontiguousarray(self.pixels[y1:y2, x1:x2]))
+
+    def close(self):
+        """ Unmap the file, it is unmapped when the last view on it is released """
+        self.pixels = None
+        self.__map = None
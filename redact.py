@@ -0,0 +1,72 @@
+import numpy as np
+
+
+def merge_regions(boxes):
+    """ Group overlapping boxes (x, y, x1, y1). Return list of (bounding box, member boxes) """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return []
+    # overlap matrix of all boxes at once
+    overlap = (boxes[:, None, 0] < boxes[None, :, 2]) & (boxes[None, :, 0] < boxes[:, None, 2]) & \
+              (boxes[:, None, 1] < boxes[None, :, 3]) & (boxes[None, :, 1] < boxes[:, None, 3])
+    overlap |= np.eye(len(boxes), dtype=bool)
+    # connected components: spread group label over the overlaps till nothing changes
+    group = np.arange(len(boxes))
+    while True:
+        spread = np.where(overlap, group[None, :], len(boxes)).min(axis=1)
+        if np.array_equal(spread, group):
+            break
+        group = spread
+    regions = []
+    for g in np.unique(group):
+        members = boxes[group == g]
+        bbox = (members[:, 0].min(), members[:, 1].min(), members[:, 2].max(), members[:, 3].max())
+        regions.append((tuple(int(i) for i in bbox), members))
+    return regions
+
+
+def box_blur(array, radius=2, passes=2):
+    """ Separable box blur of the HxW or HxWxC uint8 array, repeated box passes approximate Gaussian blur.
+        Every box pass is a sum of shifted slices, borders are extended like in the PIL filters """
+    size = 2 * radius + 1
+    weight = size ** passes  # sum of the kernel weights along one axis
+    dtype = np.uint16 if 255 * weight <= np.iinfo(np.uint16).max else np.uint32
+    result = array
+    for axis in (0, 1):  # vertical and horizontal passes
+        pad = [(0, 0)] * array.ndim
+        pad[axis] = (passes * radius, passes * radius)
+        sums = np.pad(result, pad, mode='edge').astype(dtype)
+        for _ in range(passes):
+            n = sums.shape[axis] - 2 * radius  # length after the pass
+            box = sums[_along(axis, 0, n, array.ndim)].copy()
+            for k in range(1, size):
+                box += sums[_along(axis, k, k + n, array.ndim)]
+            sums = box
+        result = ((sums + weight // 2) // weight).astype(np.uint8)
+    return result
+
+
+def _along(axis, start, stop, ndim):
+    """ Return index of the slice from start to stop along the axis """
+    index = [slice(None)] * ndim
+    index[axis] = slice(start, stop)
+    return tuple(index)
+
+
+def redact(page, boxes, radius=2, passes=2):
+    """ Blur all boxes (x, y, x1, y1) of the page array in place, in one pass over the page.
+        Overlapping boxes are blurred together, so every pixel is blurred only once """
+    height, width = page.shape[:2]
+    boxes = np.clip(np.asarray(boxes, dtype=np.int64).reshape(-1, 4), 0, [width, height, width, height])
+    boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]  # skip empty boxes
+    for (x, y, x1, y1), members in merge_regions(boxes):
+        region = page[y:y1, x:x1]
+        blurred = box_blur(region, radius, passes)
+        if len(members) == 1:
+            region[...] = blurred
+            continue
+        mask = np.zeros(region.shape[:2], dtype=bool)  # union of the member boxes
+        for mx, my, mx1, my1 in members:
+            mask[my - y:my1 - y, mx - x:mx1 - x] = True
+        region[mask] = blurred[mask]
+    return page
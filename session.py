@@ -0,0 +1,105 @@
+import os
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from catalog import Catalog, NameIndex
+from instrument import timed
+from journal import LabelJournal
+from labelstore import LabelStore
+from prefetch import ImageCache, Prefetcher
+from pyramid import build_pyramid, HUGE_SIZE, PyramidCache
+from spatial import GridIndex
+
+
+class Session:
+    """ Images of the folder with the labels of the current one, and the caches and background workers
+        which load them. Independent from Tk, so the image switches could be replayed headless.
+        The labeller window is a session too """
+    def __init__(self, directory="templates", label_options=(), cache_budget=512 << 20, prefetch_radius=2):
+        self.directory = directory  # folder with the template images and their label files
+        self.label_options = list(label_options)
+        self.labels_created = LabelStore(self.label_options)  # labels of the current image
+        self.label_index = GridIndex(self.labels_created)  # spatial index of the labels
+        self.journal = None  # journal of the label operations of the current image
+        self.binned = set()  # labels in the bin, restored from the journal
+        self.pyramid_cache = PyramidCache()  # precomputed image pyramids, shared by all images
+        self.image_cache = ImageCache(cache_budget)  # decoded pyramids and labels of the recent files
+        self.prefetcher = Prefetcher(self.load_entry, self.image_cache, self.entry_size)
+        self.refiner = ThreadPoolExecutor(max_workers=1)  # builds pyramid levels of the shown image
+        self.prefetch_radius = prefetch_radius  # number of neighbouring files to prefetch
+        self.catalog = Catalog()  # images and label files, rescanned only where they changed
+        self.catalog.scan(self.directory)
+        self.files = self.catalog.images(self.directory)
+        self.file_index = NameIndex(self.files)  # search index of the file picker
+
+    def load_file(self, file_name):
+        """ Take the labels of the file and return its pyramid, None if it should be built lazily """
+        pyramid, labels = self.prefetcher.get(file_name)
+        self.read_labels(file_name, labels.copy())  # the cached labels stay as they are in the file
+        return pyramid
+
+    def shutdown(self):
+        """ Close the journal and stop the workers """
+        if self.journal is not None:
+            self.journal.close()
+        self.prefetcher.shutdown()
+        self.refiner.shutdown(wait=False)
+        self.catalog.close()
+
+    def parse_labels(self, file_name):
+        """ Return LabelStore with the labels from the text file of the image """
+        extension = file_name.split(".")[-1]
+        text_file_name = file_name.replace(f".{extension}", ".txt")
+        if not os.path.exists(text_file_name):
+            return LabelStore(self.label_options)
+        return LabelStore.load(text_file_name, self.label_options)
+
+    @staticmethod
+    def journal_name(file_name):
+        return os.path.splitext(file_name)[0] + ".journal"
+
+    @timed('read_labels')
+    def read_labels(self, file_name, labels=None):
+        """ Take labels of the image and replay its journal over them """
+        if self.journal is not None:
+            self.journal.close()
+        self.labels_created = self.parse_labels(file_name) if labels is None else labels
+        self.journal = LabelJournal(self.journal_name(file_name))
+        self.binned = self.journal.replay(self.labels_created)  # restore the session after a crash
+        self.label_index = GridIndex(self.labels_created)
+
+    def load_entry(self, file_name):
+        """ Decode image pyramid and parse labels of the file. Called from the prefetch threads """
+        pyramid = self.pyramid_cache.load(file_name)
+        if pyramid is None:
+            Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for the big image
+            with warnings.catch_warnings():  # suppress DecompressionBombWarning
+                warnings.simplefilter('ignore')
+                image = Image.open(file_name)
+            if image.tile[0][0] == 'raw' and image.width * image.height > HUGE_SIZE * HUGE_SIZE:
+                image.close()  # huge image is opened band by band in the viewer
+            else:
+                image.load()  # decode the image now, not on the Tk thread
+                pyramid = build_pyramid(image, 2, 512, Image.LANCZOS)
+                self.pyramid_cache.store(file_name, pyramid)
+        return pyramid, self.parse_labels(file_name)
+
+    @staticmethod
+    def entry_size(entry):
+        """ Return approximate size of the prefetched entry in bytes """
+        pyramid, labels = entry
+        size = labels.nbytes
+        for image in pyramid or []:
+            size += image.width * image.height * len(image.getbands())
+        return size
+
+    def prefetch_neighbours(self, file_name):
+        """ Decode files around the given one in the background """
+        if file_name not in self.file_index.position:
+            return
+        index = self.file_index.position[file_name]
+        lo = max(0, index - self.prefetch_radius)
+        hi = min(len(self.files), index + self.prefetch_radius + 1)
+        # the nearest files are loaded first
+        neighbours = sorted(range(lo, hi), key=lambda i: abs(i - index))
+        self.prefetcher.prefetch([self.files[i] for i in neighbours if i != index])
@@ -0,0 +1,308 @@
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import tarfile
+import threading
+import time
+
+
+def write_index(name, index):
+    """ Publish the index of the shard, readers see the shard from now on """
+    with open(name + '.idx.tmp', 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(name + '.idx.tmp', name + '.idx')
+
+
+def last_members(directory, pattern='*'):
+    """ Return extensions of the last sample of the newest complete shard, None if there is no shard """
+    for name in sorted(glob.glob(os.path.join(directory, pattern + '.idx')), reverse=True):
+        with open(name, 'r') as f:
+            index = json.load(f)
+        if index:
+            return set(list(index.values())[-1])
+    return None
+
+
+def recover(directory, pattern='*'):
+    """ Publish the shards left by a killed writer: complete samples of the unfinished tar file are indexed.
+        The last sample is dropped only if the crash truncated it: the data or the header of its member is cut,
+        or, in the file without the end of the archive, its members differ from the sample before it
+        (from the last sample of the newest complete shard for the only sample).
+        Return number of the recovered samples """
+    names = [path[:-len('.tar.tmp')] for path in glob.glob(os.path.join(directory, pattern + '.tar.tmp'))]
+    names += [path[:-len('.tar')] for path in glob.glob(os.path.join(directory, pattern + '.tar'))
+              if not os.path.exists(path[:-len('.tar')] + '.idx')]  # killed between the tar and the index
+    reference = last_members(directory, pattern)  # members of the samples written before
+    count = 0
+    for name in sorted(names):
+        path = name + '.tar.tmp' if os.path.exists(name + '.tar.tmp') else name + '.tar'
+        size = os.path.getsize(path)
+        index, starts, end, cut = {}, {}, 0, None  # starts: key -> offset of its first header
+        try:
+            with tarfile.open(path, 'r') as tar:
+                for info in tar:
+                    key, _, extension = info.name.rpartition('.')
+                    if info.offset_data + info.size > size:
+                        cut = key  # the data of the member is truncated
+                        break
+                    starts.setdefault(key, info.offset)
+                    index.setdefault(key, {})[extension] = [info.offset_data, info.size]
+                    end = info.offset_data + -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        except (tarfile.TarError, EOFError):
+            pass  # the file ends in the cut header
+        with open(path, 'rb') as f:
+            f.seek(end)
+            tail = f.read(2 * tarfile.BLOCKSIZE)
+        closed = tail == b'\0' * 2 * tarfile.BLOCKSIZE  # end of the archive is written
+        keys = list(index)
+        if cut is None and tail.strip(b'\0') and keys:  # the header of the next member is cut
+            member = tail[:100].split(b'\0')[0].decode('utf-8', 'replace')  # name field of the header
+            complete = len(tail) >= 100 or b'\0' in tail
+            cut = member.rpartition('.')[0] if complete else keys[-1]  # the key is unknown, the last sample is suspect
+        if len(keys) > 1:
+            reference = set(index[keys[-2]])
+        if keys and (keys[-1] == cut or (not closed and reference is not None and set(index[keys[-1]]) != reference)):
+            end = starts[keys[-1]]
+            del index[keys[-1]]
+        if not index:
+            os.remove(path)
+            continue
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+            f.seek(end)
+            f.write(b'\0' * 2 * tarfile.BLOCKSIZE)  # end of the archive
+        os.replace(path, name + '.tar')
+        write_index(name, index)
+        count += len(index)
+    return count
+
+
+class ShardWriter:
+    """ Samples packed into tar shards of limited size, so the dataset is a few big files instead of
+        many small ones. A sample is a key with members {extension: bytes}, stored as key.extension.
+        Every shard has the index key -> {extension: [offset, size]} of the member data in the tar file.
+        The shard is written under a temporary name and its index appears last, so readers see only complete shards.
+        Shards of the prefix left by a killed writer are recovered on start. add() could be called from many threads """
+    def __init__(self, directory, prefix='shard', max_bytes=256 << 20, max_count=100000, max_age=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_count = max_count
+        self.max_age = max_age  # seconds after which the shard is published even if it is not full
+        self.opened = 0.0  # time.monotonic() of the start of the current shard
+        self.lock = threading.Lock()
+        self.recovered = recover(directory, glob.escape(prefix) + '-*')  # samples of the unfinished shards
+        self.number = len(glob.glob(os.path.join(directory, glob.escape(prefix) + '-*.idx')))  # next shard number
+        self.tar = None
+        self.index = {}  # index of the current shard
+        self.written = 0  # number of the written samples
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __shard_name(self):
+        return os.path.join(self.directory, '{0}-{1:06d}'.format(self.prefix, self.number))
+
+    def __open(self):
+        while os.path.exists(self.__shard_name() + '.idx') or os.path.exists(self.__shard_name() + '.tar'):
+            self.number += 1
+        self.tar = tarfile.open(self.__shard_name() + '.tar.tmp', 'w')
+        self.index = {}
+        self.opened = time.monotonic()
+
+    def add(self, key, members):
+        """ Add sample of the members {extension: bytes} """
+        with self.lock:
+            if self.tar is None:
+                self.__open()
+            entry = self.index.setdefault(key, {})
+            for extension, data in members.items():
+                info = tarfile.TarInfo('{0}.{1}'.format(key, extension))
+                info.size, info.mtime, info.mode = len(data), int(time.time()), 0o644
+                start = self.tar.offset
+                header = info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+                self.tar.addfile(info, io.BytesIO(data))
+                entry[extension] = [start + len(header), len(data)]
+            self.tar.fileobj.flush()  # the sample survives the kill of the process and could be recovered
+            self.written += 1
+            if self.tar.offset >= self.max_bytes or len(self.index) >= self.max_count or \
+                    (self.max_age is not None and time.monotonic() - self.opened >= self.max_age):
+                self.__finish()
+
+    def __finish(self):
+        """ Close the current shard and publish it with its index """
+        name = self.__shard_name()
+        self.tar.close()
+        os.replace(name + '.tar.tmp', name + '.tar')
+        write_index(name, self.index)
+        self.tar = None
+        self.number += 1
+
+    def close(self):
+        with self.lock:
+            if self.tar is not None:
+                self.__finish()
+
+
+class ShardReader:
+    """ Complete shards of the directory: random access to the samples by key and shuffled iteration,
+        which reads the shards sequentially in random order """
+    def __init__(self, directory, pattern='*'):
+        self.shards = sorted(name[:-4] for name in glob.glob(os.path.join(directory, pattern + '.idx')))
+        self.index = {}  # key -> (shard number, {extension: [offset, size]})
+        for number, name in enumerate(self.shards):
+            with open(name + '.idx', 'r') as f:
+                for key, members in json.load(f).items():
+                    self.index[key] = (number, members)
+        self.__files = {}  # shard number -> open file
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def __file(self, number):
+        if number not in self.__files:
+            self.__files[number] = open(self.shards[number] + '.tar', 'rb')
+        return self.__files[number]
+
+    def get(self, key, extension):
+        """ Return bytes of the member of the sample """
+        number, members = self.index[key]
+        offset, size = members[extension]
+        with self.lock:  # the file position is shared
+            f = self.__file(number)
+            f.seek(offset)
+            return f.read(size)
+
+    def __getitem__(self, key):
+        """ Return sample {extension: bytes} """
+        return {extension: self.get(key, extension) for extension in self.index[key][1]}
+
+    def samples(self, number):
+        """ Yield (key, {extension: bytes}) of the shard in the order of the file, reading it sequentially """
+        sample, current = {}, None
+        with tarfile.open(self.shards[number] + '.tar', 'r|') as tar:
+            for info in tar:
+                if not info.isfile():
+                    continue
+                key, _, extension = info.name.rpartition('.')
+                if key != current and sample:
+                    yield current, sample
+                    sample = {}
+                current = key
+                sample[extension] = tar.extractfile(info).read()
+        if sample:
+            yield current, sample
+
+    def iterate(self, shuffle=True, buffer=1000, seed=None):
+        """ Yield (key, {extension: bytes}) of all samples. With shuffle the shards go in random order and
+            the samples are mixed in the buffer of that many samples, so the reads stay sequential """
+        rng = random.Random(seed)
+        order = list(range(len(self.shards)))
+        if shuffle:
+            rng.shuffle(order)
+        pool = []
+        for number in order:
+            for item in self.samples(number):
+                if not shuffle or buffer <= 1:
+                    yield item
+                    continue
+                pool.append(item)
+                if len(pool) >= buffer:
+                    i = rng.randrange(len(pool))
+                    pool[i], pool[-1] = pool[-1], pool[i]
+                    yield pool.pop()
+        rng.shuffle(pool)
+        yield from pool
+
+    def close(self):
+        with self.lock:
+            for f in self.__files.values():
+                f.close()
+            self.__files.clear()
+
+
+def pack(directory, output, prefix='shard', max_bytes=256 << 20, extensions=('.jpg', '.png', '.tif', '.txt')):
+    """ Pack files of the directory tree into shards, the files of one stem become one sample.
+        Return number of the packed samples """
+    with ShardWriter(output, prefix, max_bytes) as writer:
+        for current, _, files in os.walk(directory):
+            samples = {}
+            for name in sorted(files):
+                stem, extension = os.path.splitext(name)
+                if extension in extensions:
+                    samples.setdefault(stem, []).append(name)
+            for stem, names in samples.items():
+                members = {}
+                for name in names:
+                    with open(os.path.join(current, name), 'rb') as f:
+                        members[os.path.splitext(name)[1][1:]] = f.read()
+                key = os.path.relpath(os.path.join(current, stem), directory).replace(os.sep, '/')
+                writer.add(key, members)
+        return writer.written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack images and labels into tar shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="pack files of the folder tree, an image and its label file are one sample")
+    pack_parser.add_argument("directory")
+    pack_parser.add_argument("output", help="folder of the shards")
+    pack_parser.add_argument("--prefix", default="shard", help="file name prefix of the shards")
+    pack_parser.add_argument("--shard-size", type=int, default=256, help="size of the shard in MB")
+
+    info_parser = subparsers.add_parser("info", help="print number of the shards and samples")
+    info_parser.add_argument("directory")
+
+    get_parser = subparsers.add_parser("get", help="write member of the sample to stdout")
+    get_parser.add_argument("directory")
+    get_parser.add_argument("key")
+    get_parser.add_argument("extension")
+
+    recover_parser = subparsers.add_parser("recover", help="publish the shards left unfinished by a killed writer")
+    recover_parser.add_argument("directory")
+
+    unpack_parser = subparsers.add_parser("unpack", help="extract all samples into the folder tree")
+    unpack_parser.add_argument("directory")
+    unpack_parser.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        start = time.perf_counter()
+        count = pack(args.directory, args.output, args.prefix, args.shard_size << 20)
+        print(f"{count} samples packed in {time.perf_counter() - start:.1f}s")
+    elif args.command == "info":
+        start = time.perf_counter()
+        reader = ShardReader(args.directory)
+        print(f"{len(reader.shards)} shards, {len(reader)} samples, index read in {time.perf_counter() - start:.2f}s")
+    elif args.command == "get":
+        reader = ShardReader(args.directory)
+        os.write(1, reader.get(args.key, args.extension))
+    elif args.command == "recover":
+        print(f"{recover(args.directory)} samples recovered")
+    elif args.command == "unpack":
+        reader = ShardReader(args.directory)
+        for key, members in reader.iterate(shuffle=False):
+            for extension, data in members.items():
+                path = os.path.join(args.output, key + '.' + extension)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+
+
+if __name__ == "__main__":
+    main()
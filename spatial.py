@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def normalized(boxes):
+    """ Return Nx4 boxes with the top left corner first, whatever direction they were drawn in """
+    return np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1)
+
+
+class GridIndex:
+    """ Uniform grid over the label boxes of the LabelStore in image coordinates.
+        Every cell keeps indices of the labels which boxes intersect it.
+        Deleted labels are not removed from the cells, they are filtered out by the queries """
+    def __init__(self, labels, cell=256):
+        self.labels = labels  # LabelStore with the boxes
+        self.cell = cell  # size of the grid cell in image pixels
+        self.__cells = {}  # (column, row) -> array of label indices
+        self.insert(labels.indices())
+
+    def __cells_of(self, boxes):
+        """ Return (label number, column, row) of every cell covered by every box """
+        first = np.floor(boxes[:, :2] / self.cell).astype(np.int64)
+        last = np.floor(boxes[:, 2:] / self.cell).astype(np.int64)
+        columns, rows = (last - first + 1).T
+        counts = columns * rows  # number of cells covered by every box
+        number = np.repeat(np.arange(len(boxes)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return number, first[number, 0] + offset % columns[number], first[number, 1] + offset // columns[number]
+
+    def insert(self, indices):
+        """ Add label (or array of labels) to the index """
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        if len(indices) == 0:
+            return
+        number, columns, rows = self.__cells_of(normalized(self.labels.boxes(indices)))
+        keys = np.stack([columns, rows], axis=1)
+        order = np.lexsort((rows, columns))  # group labels by cell
+        keys, number = keys[order], number[order]
+        cells, starts = np.unique(keys, axis=0, return_index=True)
+        for (column, row), members in zip(cells.tolist(), np.split(indices[number], starts[1:])):
+            old = self.__cells.get((column, row))
+            self.__cells[(column, row)] = members if old is None else np.concatenate([old, members])
+
+    def __candidates(self, x, y, x1, y1):
+        """ Return alive labels from the cells intersecting the area """
+        c0, r0 = int(x // self.cell), int(y // self.cell)
+        c1, r1 = int(x1 // self.cell), int(y1 // self.cell)
+        if (c1 - c0 + 1) * (r1 - r0 + 1) > len(self.__cells):  # the area is bigger than the filled grid
+            found = [members for (c, r), members in self.__cells.items() if c0 <= c <= c1 and r0 <= r <= r1]
+        else:
+            found = [self.__cells[key] for key in ((c, r) for c in range(c0, c1 + 1) for r in range(r0, r1 + 1))
+                     if key in self.__cells]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(found))
+        return candidates[self.labels.rows['alive'][candidates]]
+
+    def query(self, x, y, x1, y1):
+        """ Return indices of the labels intersecting the area (x, y, x1, y1) """
+        candidates = self.__candidates(x, y, x1, y1)
+        boxes = normalized(self.labels.boxes(candidates))
+        hit = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y)
+        return candidates[hit]
+
+    def at(self, x, y):
+        """ Return index of the smallest label containing the point (x, y) or None """
+        candidates = self.query(x, y, x, y)
+        if len(candidates) == 0:
+            return None
+        boxes = normalized(self.labels.boxes(candidates))
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        return int(candidates[np.argmin(areas)])
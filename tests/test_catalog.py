@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from PIL import Image
+from catalog import Catalog, NameIndex, read_boxes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_label_format_is_told_by_the_class_field(tmp_path):
+    labeller = tmp_path / 'page.txt'
+    labeller.write_text('Ticker 0 0 1 1\nValue 0.25 0.5 0.75 1\n')  # tiny boxes in pixels
+    classes, boxes = read_boxes(str(labeller), 200, 100)
+    assert classes == ['Ticker', 'Value']
+    np.testing.assert_array_equal(boxes, [[0, 0, 1, 1], [0.25, 0.5, 0.75, 1]])
+
+    yolo = tmp_path / 'frame.txt'
+    yolo.write_text('0 0.5 0.5 0.5 0.2\n3 0.25 0.75 0.1 0.1\n')
+    classes, boxes = read_boxes(str(yolo), 200, 100)
+    assert classes == ['0', '3']
+    np.testing.assert_allclose(boxes, [[50, 40, 150, 60], [40, 70, 60, 80]])
+    _, boxes = read_boxes(str(yolo))  # without the image size the boxes stay normalized
+    np.testing.assert_allclose(boxes[0], [0.5, 0.5, 0.5, 0.2])
+
+
+def test_group_reads_labels_from_the_catalog_by_default(tmp_path):
+    (tmp_path / 'pic' / 'cam1').mkdir(parents=True)
+    for i in range(20):
+        Image.new('RGB', (32, 24)).save(tmp_path / 'pic' / 'cam1' / f'{i:03d}.jpg')
+        (tmp_path / 'pic' / 'cam1' / f'{i:03d}.txt').write_text('Date 1 2 10 12\n')
+    command = [sys.executable, os.path.join(ROOT, 'group.py'), 'pic', '--stratify']
+    subprocess.run(command, cwd=tmp_path, check=True, capture_output=True)
+    assert (tmp_path / 'catalog.sqlite').exists()
+    lists = [(tmp_path / name).read_text().split() for name in ('train.txt', 'test.txt')]
+    assert sum(map(len, lists)) == 20
+    os.remove(tmp_path / 'catalog.sqlite')
+    subprocess.run(command + ['--no-catalog'], cwd=tmp_path, check=True, capture_output=True)
+    assert not (tmp_path / 'catalog.sqlite').exists()
+    assert [(tmp_path / name).read_text().split() for name in ('train.txt', 'test.txt')] == lists
+
+
+def make_folder(directory):
+    directory.mkdir()
+    for i in range(4):
+        Image.new('RGB', (200, 100)).save(directory / f'frame_{i}.jpg')
+    (directory / 'frame_0.txt').write_text('Ticker 0 0 10 10\nTicker 0 0 40 40\nDate 0 0 100 50\n')
+    (directory / 'frame_1.txt').write_text('0 0.5 0.5 0.5 0.5\n')  # YOLO box of 100x50 pixels
+
+
+def test_scan_probes_only_changed_files(tmp_path):
+    make_folder(tmp_path / 'pic')
+    directory = str(tmp_path / 'pic')
+    catalog = Catalog(str(tmp_path / 'catalog.sqlite'))
+    try:
+        assert catalog.scan(directory) == 4
+        assert catalog.scan(directory) == 0
+        label = tmp_path / 'pic' / 'frame_2.txt'
+        label.write_text('Value 5 5 25 25\n')
+        assert catalog.scan(directory) == 1
+        os.remove(tmp_path / 'pic' / 'frame_3.jpg')
+        assert catalog.scan(directory) == 0
+        assert [os.path.basename(path) for path in catalog.images(directory)] == \
+            ['frame_0.jpg', 'frame_1.jpg', 'frame_2.jpg']
+        assert catalog.info(os.path.join(directory, 'frame_2.jpg')) == (200, 100, os.path.normpath(str(label)), 1)
+        label.write_text('')
+        catalog.refresh([os.path.join(directory, 'frame_2.jpg')])  # e.g. after the export of the labeller
+        assert catalog.info(os.path.join(directory, 'frame_2.jpg'))[3] == 0
+    finally:
+        catalog.close()
+
+
+def test_class_statistics(tmp_path):
+    make_folder(tmp_path / 'pic')
+    directory = str(tmp_path / 'pic')
+    catalog = Catalog(str(tmp_path / 'catalog.sqlite'))
+    try:
+        catalog.scan(directory)
+        assert catalog.summary(directory) == (4, 2, 4)
+        assert catalog.class_counts() == {'Ticker': (2, 1), 'Date': (1, 1), '0': (1, 1)}
+        histograms = catalog.size_histogram(directory)
+        assert histograms['Ticker'].tolist() == [1, 0, 1, 0, 0, 0, 0, 0]  # sides 10 and 40
+        assert histograms['Date'].tolist() == histograms['0'].tolist() == [0, 0, 0, 1, 0, 0, 0, 0]  # side 70.7
+        assert [os.path.basename(path) for path in catalog.images(directory, labelled=False)] == \
+            ['frame_2.jpg', 'frame_3.jpg']
+        assert [os.path.basename(path) for path in catalog.images(cls='Date')] == ['frame_0.jpg']
+        assert catalog.classes(directory) == {os.path.join(directory, 'frame_0.jpg'): {'Ticker', 'Date'},
+                                              os.path.join(directory, 'frame_1.jpg'): {'0'}}
+    finally:
+        catalog.close()
+
+
+def test_name_index_puts_prefix_matches_first():
+    index = NameIndex(['a/report_2.jpg', 'b/annual_report.jpg', 'a/Report_1.jpg', 'c/summary.png'])
+    assert [index.paths[i] for i in index.search('report')] == \
+        ['a/report_2.jpg', 'a/Report_1.jpg', 'b/annual_report.jpg']
+    assert index.search('').tolist() == [0, 1, 2, 3]
+    assert index.search('missing').tolist() == []
+    assert index.position['c/summary.png'] == 3
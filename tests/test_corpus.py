@@ -0,0 +1,70 @@
+import datetime
+import os
+import random
+import re
+import numpy as np
+from corpus import CorpusPool, DATE_FORMATS, gen_curr_tickers, gen_currency_values, gen_dates, gen_ibans, \
+    gen_swift_codes, gen_tickers
+
+
+def matches(pattern, texts):
+    return all(re.fullmatch(pattern, text) for text in texts.tolist())
+
+
+def test_generated_formats():
+    rng = np.random.default_rng(0)
+    assert matches(r'[A-Z]{3}', gen_curr_tickers(rng, 500))
+    tickers = gen_tickers(rng, 500)
+    assert matches(r'[A-Z]{5}(_[A-Z]{5}){0,2}', tickers)
+    assert {len(text) for text in tickers.tolist()} == {5, 11, 17}
+    assert matches(r'[A-Z]{2}[0-9]{2}[A-Z0-9]{16}', gen_ibans(rng, 500))
+    assert matches(r'[A-Z]{8}[0-9]{3}', gen_swift_codes(rng, 500))
+    assert matches(r'[A-Za-z][0-9]+\.[0-9]{2}|[0-9]+\.[0-9]{2}[A-Za-z]|[0-9]{1,3}([,.][0-9]{3})*[,.][0-9]{2}',
+                   gen_currency_values(rng, 500))
+
+
+def test_dates_are_real_days_with_their_weekdays():
+    dates = gen_dates(np.random.default_rng(1), 2000).tolist()
+    assert 0.1 < dates.count('ASAP') / len(dates) < 0.3
+    for text in dates:
+        if text == 'ASAP':
+            continue
+        for fmt in set(DATE_FORMATS):
+            try:
+                day = datetime.datetime.strptime(text, fmt)
+            except ValueError:
+                continue
+            assert 1900 <= day.year <= 2100
+            if '%A' in fmt:
+                assert text.startswith(day.strftime('%A'))
+            break
+        else:
+            raise AssertionError('unknown date format: ' + text)
+
+
+def test_pool_is_generated_once_and_drawn_repeatably(tmp_path):
+    path = str(tmp_path / 'pool.npz')
+    pool = CorpusPool(path, size=50).load()
+    assert os.path.exists(path)
+    assert all(len(pool.texts(field)) == 50 for field in CorpusPool.fields)
+    mtime = os.stat(path).st_mtime_ns
+    again = CorpusPool(path, size=50)  # loaded lazily on the first draw, the file isn't written again
+    random.seed(3)
+    first = [again.draw('iban') for _ in range(5)]
+    assert os.stat(path).st_mtime_ns == mtime
+    assert np.array_equal(again.texts('sentence'), pool.texts('sentence'))
+    random.seed(3)
+    assert [pool.draw('iban') for _ in range(5)] == first
+
+    bigger = CorpusPool(path, size=80).load()  # too small fields are generated again
+    assert len(bigger.texts('date')) == 80
+    bigger.refill()
+    assert bigger.seed == 1 and not np.array_equal(bigger.texts('iban')[:50], pool.texts('iban'))
+
+
+def test_broken_pool_file_is_generated_again(tmp_path):
+    path = tmp_path / 'pool.npz'
+    path.write_bytes(b'not a pool')
+    pool = CorpusPool(str(path), size=20).load()
+    assert len(pool.texts('ticker')) == 20
+    assert np.array_equal(CorpusPool(str(path), size=20).texts('ticker'), pool.texts('ticker'))
@@ -0,0 +1,65 @@
+import itertools
+import numpy as np
+import dedupe
+from dedupe import clusters, expand, near_pairs, popcount
+
+
+def brute_force(hashes, threshold):
+    return [(i, j) for i, j in itertools.combinations(range(len(hashes)), 2)
+            if bin(int(hashes[i]) ^ int(hashes[j])).count('1') <= threshold]
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def test_popcount():
+    values = np.array([0, 1, 0xFF, 2 ** 64 - 1, 0x8000000000000001], dtype=np.uint64)
+    assert popcount(values).tolist() == [0, 1, 8, 64, 2]
+
+
+def test_near_pairs_matches_brute_force():
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 2 ** 63, 40, dtype=np.uint64).tolist()
+    near = [flip(value, rng.choice(64, k, replace=False).tolist()) for value, k in zip(base, [1, 3, 5, 8] * 10)]
+    hashes = np.array(base + near, dtype=np.uint64)
+    for threshold in (0, 4, 6):
+        assert [tuple(p) for p in near_pairs(hashes, threshold).tolist()] == brute_force(hashes, threshold)
+
+
+def test_near_pairs_small_blocks():
+    hashes = np.array([0b1010] * 7 + [0b1011] * 3, dtype=np.uint64)
+    assert len(near_pairs(hashes, 1, block=2)) == 45
+
+
+def test_near_pairs_empty():
+    assert near_pairs(np.empty(0, dtype=np.uint64), 4).shape == (0, 2)
+
+
+def test_clusters_root_is_smallest_index():
+    pairs = np.array([[3, 7], [5, 7], [1, 2], [0, 9], [8, 9]])
+    assert clusters(10, pairs).tolist() == [0, 1, 1, 3, 4, 3, 6, 3, 0, 0]
+
+
+def test_expand_links_equal_and_near_hashes():
+    inverse = np.array([0, 1, 0, 2, 1])  # unique hash of every item
+    near = np.array([[0, 2]])  # unique hashes 0 and 2 are near
+    pairs = expand(inverse, near)
+    assert clusters(5, pairs).tolist() == [0, 1, 0, 0, 1]
+
+
+def test_near_pairs_memory_is_bounded_by_block(monkeypatch):
+    shapes = []
+
+    def recording(values):
+        shapes.append(values.shape)
+        return popcount(values)
+    monkeypatch.setattr(dedupe, 'popcount', recording)
+    rng = np.random.default_rng(2)
+    base = int(rng.integers(0, 2 ** 63))
+    hashes = np.array([flip(base, rng.choice(64, 2, replace=False).tolist()) for _ in range(300)], dtype=np.uint64)
+    pairs = near_pairs(hashes, 3, block=32)  # a static camera: one big bucket
+    assert max(rows * columns for rows, columns in shapes) <= 32 * 32
+    assert [tuple(p) for p in pairs.tolist()] == brute_force(hashes, 3)
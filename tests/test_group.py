@@ -0,0 +1,65 @@
+import numpy as np
+from group import assign, stable_hash
+
+
+def frame_units(count, classes=()):
+    return {'frame_{0:04d}.jpg'.format(i): (['/data/frame_{0:04d}.jpg'.format(i)], set(classes))
+            for i in range(count)}
+
+
+def split_of(lists):
+    return {path: i for i, paths in enumerate(lists) for path in paths}
+
+
+def test_stable_hash():
+    assert stable_hash('cam1/frame.jpg') == stable_hash('cam1/frame.jpg')
+    assert stable_hash('cam1/frame.jpg') != stable_hash('cam1/frame.jpg', salt='other')
+    values = [stable_hash(str(i)) for i in range(1000)]
+    assert 0.0 <= min(values) and max(values) < 1.0
+    assert abs(np.mean(values) - 0.5) < 0.05
+
+
+def test_shares():
+    train, test = assign(frame_units(2000), [90, 10], {}, stratify=False)
+    assert len(train) + len(test) == 2000
+    assert 150 < len(test) < 250
+
+
+def test_new_frames_never_move_old_ones():
+    before = split_of(assign(frame_units(500), [80, 20], {}, stratify=False))
+    after = split_of(assign(frame_units(800), [80, 20], {}, stratify=False))
+    assert all(after[path] == split for path, split in before.items())
+
+
+def test_previous_lists_are_kept():
+    units = frame_units(100)
+    previous = {'/data/frame_{0:04d}.jpg'.format(i): 1 for i in range(50)}  # all in the test list before
+    lists = assign(units, [90, 10], previous, stratify=False)
+    assert set(previous) <= set(lists[1])
+
+
+def test_group_goes_into_one_split():
+    units = {'group:cam{0}'.format(c): (['/data/cam{0}/{1}.jpg'.format(c, i) for i in range(20)], set())
+             for c in range(30)}
+    lists = assign(units, [70, 30], {}, stratify=False)
+    splits = split_of(lists)
+    for paths, _ in units.values():
+        assert len({splits[path] for path in paths}) == 1
+
+
+def test_k_fold():
+    units = frame_units(1000)
+    lists = assign(units, [1.0] * 5, {}, stratify=False)
+    assert len(lists) == 5
+    assert sorted(path for paths in lists for path in paths) == sorted(paths[0] for paths, _ in units.values())
+    assert all(150 < len(paths) < 250 for paths in lists)
+
+
+def test_stratify_balances_rare_class():
+    units = frame_units(900, ['Value'])
+    units.update({'rare_{0}.jpg'.format(i): (['/data/rare_{0}.jpg'.format(i)], {'Value', 'Ticker'})
+                  for i in range(20)})
+    lists = assign(units, [1.0] * 4, {}, stratify=True)
+    rare = [sum(path.startswith('/data/rare') for path in paths) for paths in lists]
+    assert rare == [5, 5, 5, 5]
+    assert max(len(paths) for paths in lists) - min(len(paths) for paths in lists) <= 1
@@ -0,0 +1,97 @@
+import os
+from journal import LabelJournal
+from labelstore import LabelStore
+
+
+def make_labels(path):
+    store = LabelStore()
+    store.extend([[0, 0, 10, 10], [20, 20, 30, 30], [40, 40, 50, 50]], ['Ticker', 'Value', 'Date'])
+    store.save(str(path))
+    return LabelStore.load(str(path))
+
+
+def test_replay_after_crash(tmp_path):
+    text = tmp_path / 'page.txt'
+    labels = make_labels(text)
+    journal = LabelJournal(str(tmp_path / 'page.journal'))
+    new = labels.add(60.5, 60.25, 70.125, 70, 'Value')
+    journal.add(labels, new)
+    labels.delete([0])
+    journal.delete([0])
+    journal.bin([1])
+    journal.close()
+    with open(journal.path, 'a') as f:
+        f.write('add 4 Value 1 2')  # record cut by the crash
+
+    restored = LabelStore.load(str(text))
+    binned = LabelJournal(journal.path).replay(restored)
+    assert binned == {1}
+    assert restored.indices().tolist() == [1, 2, 3]
+    assert restored.box(3) == (60.5, 60.25, 70.125, 70.0)
+    assert restored.type(3) == 'Value'
+
+
+def test_replay_is_repeatable(tmp_path):
+    text = tmp_path / 'page.txt'
+    labels = make_labels(text)
+    journal = LabelJournal(str(tmp_path / 'page.journal'))
+    journal.add(labels, labels.add(1, 2, 3, 4, 'Date'))
+    journal.bin([3])
+    journal.close()
+    for _ in range(2):  # the replayed journal is rewritten and replayed again after the next crash
+        restored = LabelStore.load(str(text))
+        assert LabelJournal(journal.path).replay(restored) == {3}
+        assert len(restored) == 4
+
+
+def test_compact_then_crash(tmp_path):
+    text = tmp_path / 'page.txt'
+    labels = make_labels(text)
+    journal = LabelJournal(str(tmp_path / 'page.journal'))
+    labels.delete([0])
+    journal.delete([0])
+    journal.compact(labels, str(text), binned={2})
+    assert [line.split()[0] for line in open(text)] == ['Value', 'Date']
+    # the session continues with the old indices after the compaction
+    new = labels.add(5, 5, 6, 6, 'Ticker')
+    journal.add(labels, new)
+    labels.delete([1])
+    journal.delete([1])
+    journal.close()
+
+    restored = LabelStore.load(str(text))
+    binned = LabelJournal(journal.path).replay(restored)
+    assert binned == {1}  # label 2 of the session is the row 1 of the compacted file
+    assert [restored.type(i) for i in restored.indices()] == ['Date', 'Ticker']
+    assert restored.box(int(restored.indices()[-1])) == (5.0, 5.0, 6.0, 6.0)
+
+
+def test_compact_without_changes_removes_journal(tmp_path):
+    text = tmp_path / 'page.txt'
+    labels = make_labels(text)
+    journal = LabelJournal(str(tmp_path / 'page.journal'))
+    journal.add(labels, labels.add(1, 1, 2, 2, 'Date'))
+    journal.close()
+    assert os.path.exists(journal.path)
+    LabelJournal(journal.path).compact(LabelStore(), str(text))
+    assert not os.path.exists(journal.path)
+    assert text.read_text() == ''
+
+
+def test_compact_keeps_journal_only_when_needed(tmp_path):
+    text = tmp_path / 'page.txt'
+    labels = make_labels(text)
+    journal = LabelJournal(str(tmp_path / 'page.journal'))
+    journal.add(labels, labels.add(1, 1, 2, 2, 'Date'))
+    journal.compact(labels, str(text))
+    assert not os.path.exists(journal.path)  # rows of the text file are the session indices
+    journal.bin([3])
+    journal.compact(labels, str(text), binned={3})
+    assert open(journal.path).read() == 'bin 3\n'
+    labels.delete([0])
+    journal.compact(labels, str(text), binned={3})
+    assert open(journal.path).read() == 'base 1 2 3\nbin 3\n'
+
+    restored = LabelStore.load(str(text))
+    assert LabelJournal(journal.path).replay(restored) == {2}
+    assert [restored.type(i) for i in restored.indices()] == ['Value', 'Date', 'Date']
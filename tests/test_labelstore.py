@@ -0,0 +1,61 @@
+import numpy as np
+from labelstore import LabelStore
+
+
+def test_extend_registers_classes():
+    store = LabelStore(['Ticker'])
+    indices = store.extend([[0, 0, 10, 10], [5, 5, 20, 20]], ['Value', 'Ticker'])
+    assert indices.tolist() == [0, 1]
+    assert store.classes == ['Ticker', 'Value']
+    assert [store.type(i) for i in indices] == ['Value', 'Ticker']
+
+
+def test_delete_leaves_tombstone():
+    store = LabelStore()
+    first = store.add(0, 0, 10, 10, 'Date')
+    second = store.add(20, 20, 30, 30, 'Date')
+    store.delete(first)
+    assert len(store) == 1
+    assert store.count == 2  # the row stays till the store is compacted
+    assert store.indices().tolist() == [second]
+    assert store.box(second) == (20.0, 20.0, 30.0, 30.0)  # indices don't move
+    store.compact()
+    assert store.count == 1
+    assert store.boxes().tolist() == [[20.0, 20.0, 30.0, 30.0]]
+
+
+def test_grows_past_capacity():
+    store = LabelStore(capacity=2)
+    store.extend(np.arange(40, dtype=np.float32).reshape(10, 4), ['Value'] * 10)
+    store.add(1, 2, 3, 4, 'Ticker')
+    assert len(store) == 11
+    assert store.box(10) == (1.0, 2.0, 3.0, 4.0)
+
+
+def test_copy_is_independent():
+    store = LabelStore()
+    store.add(0, 0, 10, 10, 'Date')
+    copy = store.copy()
+    copy.delete(0)
+    copy.add(1, 1, 2, 2, 'Date')
+    assert len(store) == 1 and store.count == 1
+
+
+def test_save_load_round_trip(tmp_path):
+    store = LabelStore()
+    store.extend([[12345.67, 0.5, 19999.99, 3.25], [7, 8, 9, 10]], ['Ticker', 'Value'])
+    store.add(1, 1, 2, 2, 'Date')
+    store.delete(1)
+    path = str(tmp_path / 'labels.txt')
+    store.save(path)
+    loaded = LabelStore.load(path)
+    assert [loaded.type(i) for i in loaded.indices()] == ['Ticker', 'Date']
+    np.testing.assert_array_equal(loaded.boxes(), store.boxes())  # float32 coordinates are exact
+    assert open(path).read() == 'Ticker 12345.67 0.5 19999.99 3.25\nDate 1 1 2 2\n'
+
+
+def test_load_empty_file(tmp_path):
+    path = tmp_path / 'labels.txt'
+    path.write_text('')
+    store = LabelStore.load(str(path), ['Date'])
+    assert len(store) == 0 and store.classes == ['Date']
@@ -0,0 +1,126 @@
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from PIL import Image
+from pic import Counter, FileCamera, Scheduler, Writer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_camera(directory, count=2):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        Image.new('RGB', (32, 24), (40 * i, 0, 0)).save(os.path.join(directory, '{0}.png'.format(i)))
+    return FileCamera(directory)
+
+
+def test_file_camera_loops_over_the_images(tmp_path):
+    camera = fake_camera(str(tmp_path / 'fake'))
+    frames = [camera.read() for _ in range(3)]
+    assert frames[0].shape == (24, 32, 3)
+    assert frames[0][0, 0].tolist() == [0, 0, 0] and frames[1][0, 0].tolist() == [0, 0, 40]  # BGR
+    assert np.array_equal(frames[2], frames[0])
+
+
+def test_counter_survives_restart(tmp_path):
+    counter = Counter(str(tmp_path))
+    assert [counter.next() for _ in range(3)] == [1, 2, 3]
+    counter.close()
+    assert (tmp_path / '.counter').read_text().strip() == '3'.zfill(Counter.width)
+    counter = Counter(str(tmp_path))
+    assert counter.next() == 4
+    counter.close()
+
+
+def test_counter_scans_old_folder(tmp_path):
+    for name in ('7.jpg', '12.jpg', 'notes.jpg'):
+        (tmp_path / name).write_bytes(b'')
+    counter = Counter(str(tmp_path))
+    assert counter.next() == 13
+    counter.close()
+
+
+def test_scheduler_stops_after_count(tmp_path):
+    scheduler = Scheduler(str(tmp_path / 'pic'), writers=2)
+    scheduler.add('cam', fake_camera(str(tmp_path / 'fake')), interval=0.01)
+    scheduler.start(count=3)
+    assert scheduler.stop.wait(5.0)  # set by the last camera, not by a timeout
+    scheduler.close()
+    output = tmp_path / 'pic' / 'cam'
+    assert sorted(os.listdir(output)) == ['.counter', '1.jpg', '2.jpg', '3.jpg']
+    with Image.open(output / '3.jpg') as image:
+        assert image.size == (32, 24)
+    assert (output / '.counter').read_text().strip() == '3'.zfill(Counter.width)
+    metrics = scheduler.metrics()
+    assert metrics['cam']['shots'] == 3 and metrics['writer']['written'] == 3
+
+
+def test_daemon_exits_when_count_is_taken(tmp_path):
+    fake_camera(str(tmp_path / 'fake'))
+    start = time.monotonic()
+    subprocess.run([sys.executable, os.path.join(ROOT, 'pic.py'), '--fake', str(tmp_path / 'fake'),
+                    '--output', str(tmp_path / 'pic'), '--interval', '0.01', '--count', '3', '--report', '60',
+                    '--metrics', str(tmp_path / 'metrics.json')], check=True, capture_output=True, timeout=55)
+    assert time.monotonic() - start < 20  # the 60 s report period is not waited out
+    assert sorted(os.listdir(tmp_path / 'pic')) == ['.counter', '1.jpg', '2.jpg', '3.jpg']
+    assert (tmp_path / 'metrics.json').exists()
+
+
+class BrokenCamera:
+    """ Camera which fails every read, like an unplugged device """
+    def __init__(self):
+        self.closed = False
+
+    def read(self):
+        raise OSError('device is gone')
+
+    def close(self):
+        self.closed = True
+
+
+class SlowCamera:
+    """ Camera whose read takes longer than its interval """
+    def __init__(self, frame, delay):
+        self.frame, self.delay = frame, delay
+
+    def read(self):
+        time.sleep(self.delay)
+        return self.frame
+
+    def close(self):
+        pass
+
+
+def test_broken_and_slow_cameras_dont_stop_the_others(tmp_path):
+    scheduler = Scheduler(str(tmp_path / 'pic'), writers=2)
+    broken = BrokenCamera()
+    scheduler.add('good', fake_camera(str(tmp_path / 'fake')), interval=0.01)
+    scheduler.add('broken', broken, interval=0.01)
+    scheduler.add('slow', SlowCamera(np.zeros((24, 32, 3), dtype=np.uint8), 0.05), interval=0.01)
+    start = time.monotonic()
+    scheduler.start(count=5)
+    assert scheduler.stop.wait(5.0)
+    scheduler.close()
+    assert time.monotonic() - start < 3.0
+    assert sorted(os.listdir(tmp_path / 'pic' / 'good')) == ['.counter'] + ['{0}.jpg'.format(i) for i in range(1, 6)]
+    assert [name for name in os.listdir(tmp_path / 'pic' / 'broken') if name.endswith('.jpg')] == []
+    assert len(os.listdir(tmp_path / 'pic' / 'slow')) == 6
+    assert broken.closed
+    metrics = scheduler.metrics()
+    assert metrics['good']['failed'] == 0 and metrics['broken']['failed'] == 5
+    assert metrics['slow']['missed'] >= 4  # the skipped ticks are counted, not bunched up
+    assert metrics['writer']['written'] == 10
+
+
+def test_write_failure_is_counted_for_its_camera(tmp_path):
+    writer = Writer(workers=1)
+    frame = np.zeros((24, 32, 3), dtype=np.uint8)
+    assert writer.put(str(tmp_path / '1.jpg'), frame, 'cam1')
+    assert writer.put(str(tmp_path / 'missing' / '1.jpg'), frame, 'cam2')  # the folder is gone
+    assert writer.put(str(tmp_path / '2.jpg'), frame, 'cam1')
+    writer.close()
+    assert (writer.written, writer.failed) == (2, 1)
+    assert writer.failures == {'cam2': 1}
+    assert sorted(os.listdir(tmp_path)) == ['1.jpg', '2.jpg']
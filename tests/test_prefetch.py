@@ -0,0 +1,69 @@
+import threading
+from prefetch import ImageCache, Prefetcher
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ImageCache(budget=30)
+    for key in 'abc':
+        cache.put(key, key.upper(), 10)
+    assert cache.get('a') == 'A'  # 'b' is the oldest now
+    cache.put('d', 'D', 10)
+    assert 'b' not in cache and len(cache) == 3 and cache.size == 30
+    cache.put('a', 'A2', 25)  # the new size of the key counts, not the old one
+    assert cache.get('a') == 'A2' and len(cache) == 1 and cache.size == 25
+    cache.put('huge', 'H', 100)  # the last value stays even over the budget
+    assert len(cache) == 1 and cache.get('huge') == 'H'
+    cache.discard('huge')
+    assert len(cache) == 0 and cache.size == 0
+
+
+class Loader:
+    """ Loader which counts the calls and could be held till the test lets it go """
+    def __init__(self):
+        self.calls = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.lock = threading.Lock()
+
+    def __call__(self, key):
+        with self.lock:
+            self.calls.append(key)
+        self.gate.wait(5)
+        return key * 2
+
+
+def test_prefetched_value_is_loaded_once():
+    loader = Loader()
+    cache = ImageCache()
+    prefetcher = Prefetcher(loader, cache, len)
+    try:
+        loader.gate.clear()
+        prefetcher.prefetch(['a', 'b'])
+        result = {}
+        getter = threading.Thread(target=lambda: result.update(a=prefetcher.get('a')))
+        getter.start()  # waits for the loading in the pool, doesn't load again
+        loader.gate.set()
+        getter.join(5)
+        assert result == {'a': 'aa'}
+        assert prefetcher.get('b') == 'bb'
+        assert sorted(loader.calls) == ['a', 'b']
+        assert cache.get('a') == 'aa' and cache.size == 4
+        prefetcher.prefetch(['a'])  # cached keys are not loaded again
+        assert prefetcher.get('a') == 'aa' and len(loader.calls) == 2
+    finally:
+        prefetcher.shutdown()
+
+
+def test_next_prefetch_cancels_queued_keys():
+    loader = Loader()
+    prefetcher = Prefetcher(loader, ImageCache(), len, workers=1)
+    try:
+        loader.gate.clear()
+        prefetcher.prefetch(['a', 'b', 'c'])  # 'a' is loading, the others wait in the queue
+        prefetcher.prefetch(['a', 'd'])  # the user went the other way
+        loader.gate.set()
+        assert prefetcher.get('d') == 'dd'
+        assert prefetcher.get('b') == 'bb'  # cancelled key is loaded in the calling thread when it is asked
+        assert loader.calls == ['a', 'd', 'b']
+    finally:
+        prefetcher.shutdown()
@@ -0,0 +1,40 @@
+import numpy as np
+from PIL import Image, ImageDraw
+from labelstore import LabelStore
+from propagate import box_changes, propagate
+
+
+def test_box_changes_are_the_mean_differences_in_the_boxes():
+    rng = np.random.default_rng(0)
+    previous = rng.uniform(0, 255, (60, 80)).astype(np.float32)
+    current = rng.uniform(0, 255, (60, 80)).astype(np.float32)
+    boxes = [(0, 0, 80, 60), (10.2, 5.7, 30, 20), (50, 40, 20, 10), (5, 5, 5, 5)]  # any corner order, empty box
+    diff = np.abs((previous - previous.mean()) - (current - current.mean()))
+    expected = [diff.mean(), diff[5:20, 10:30].mean(), diff[10:40, 20:50].mean(), diff[5, 5]]
+    np.testing.assert_allclose(box_changes(previous, current, boxes), expected, rtol=1e-4)
+    # boxes are in image pixels, the frames are reduced twice
+    np.testing.assert_allclose(box_changes(previous, current, [(20, 10, 60, 40)], scale=0.5),
+                               [diff[5:20, 10:30].mean()], rtol=1e-4)
+
+
+def test_brightness_change_of_the_whole_frame_is_ignored():
+    previous = np.random.default_rng(1).uniform(0, 200, (40, 40)).astype(np.float32)
+    assert box_changes(previous, previous + 30, [(0, 0, 20, 20)]).max() < 1e-3
+    assert np.isinf(box_changes(previous, previous[:20], [(0, 0, 20, 20)])).all()  # another camera
+
+
+def test_propagate_flags_only_the_changed_boxes(tmp_path):
+    frame = Image.linear_gradient('L').resize((400, 300)).convert('RGB')
+    frame.save(tmp_path / '1.png')
+    ImageDraw.Draw(frame).rectangle((220, 120, 300, 200), fill=(255, 255, 255))  # something moved in this box
+    frame.save(tmp_path / '2.png')
+    labels = LabelStore()
+    labels.extend([[10, 10, 100, 80], [210, 110, 310, 210], [300, 200, 390, 290]], ['Ticker', 'Value', 'Date'])
+    labels.delete([2])
+    copied, changed = propagate(labels, labels.indices(), str(tmp_path / '1.png'), str(tmp_path / '2.png'),
+                                threshold=12.0, max_side=200)
+    assert [copied.type(i) for i in copied.indices()] == ['Ticker', 'Value']
+    np.testing.assert_array_equal(copied.boxes(), labels.boxes(labels.indices()))
+    assert changed.tolist() == [False, True]
+    empty, none = propagate(labels, [], str(tmp_path / '1.png'), str(tmp_path / '2.png'))
+    assert len(empty) == 0 and none.tolist() == []
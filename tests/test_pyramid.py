@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from pyramid import LazyPyramid, PyramidCache, build_pyramid, open_pyramid
+
+
+def gradient(width, height):
+    x = np.arange(width, dtype=np.uint32) * 255 // (width - 1)
+    y = np.arange(height, dtype=np.uint32)[:, None] * 255 // (height - 1)
+    return Image.fromarray(np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                                      np.full((height, width), 128)]).astype(np.uint8))
+
+
+def test_cached_levels_are_memory_mapped(tmp_path):
+    path = str(tmp_path / 'page.png')
+    gradient(1200, 900).save(path)
+    cache = PyramidCache(str(tmp_path / 'cache'))
+    assert cache.load(path) is None
+    pyramid = build_pyramid(Image.open(path).convert('RGB'))
+    cache.store(path, pyramid)
+    levels = cache.load(path)
+    assert [level.size for level in levels] == [level.size for level in pyramid]
+    for level, built in zip(levels, pyramid):
+        assert np.array_equal(np.asarray(level.convert('RGB')), np.asarray(built))
+    # the image is a view of the file: a change of the file is seen without loading it again
+    mapped = np.load(os.path.join(cache.directory, cache.key(path), '0.npy'), mmap_mode='r+')
+    mapped[0, 0, :3] = (1, 2, 3)
+    mapped.flush()
+    assert levels[0].getpixel((0, 0))[:3] == (1, 2, 3)
+    assert levels[0].readonly
+
+
+def test_grey_pyramid_keeps_its_mode(tmp_path):
+    path = str(tmp_path / 'page.png')
+    gradient(600, 600).convert('L').save(path)
+    cache = PyramidCache(str(tmp_path / 'cache'))
+    cache.store(path, build_pyramid(Image.open(path)))
+    levels = cache.load(path)
+    assert [level.mode for level in levels] == ['L', 'L']
+    assert np.array_equal(np.asarray(levels[0]), np.asarray(Image.open(path)))
+
+
+def test_modified_image_misses_the_cache(tmp_path):
+    path = str(tmp_path / 'page.png')
+    gradient(600, 600).save(path)
+    cache = PyramidCache(str(tmp_path / 'cache'))
+    cache.store(path, build_pyramid(Image.open(path)))
+    assert cache.load(path) is not None
+    gradient(700, 600).save(path)
+    os.utime(path, ns=(0, 0))  # the key depends on mtime and size
+    assert cache.load(path) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f'page_{i}.png'))
+        gradient(600, 600).save(paths[-1])
+    cache = PyramidCache(str(tmp_path / 'cache'), budget=1 << 40)
+    for i, path in enumerate(paths):
+        cache.store(path, build_pyramid(Image.open(path)))
+        os.utime(os.path.join(cache.directory, cache.key(path), 'meta.json'), (i, i))  # page_0 is the oldest
+    entry = sum(f.stat().st_size for f in os.scandir(os.path.join(cache.directory, cache.key(paths[0]))))
+    cache.load(paths[0])  # the access makes page_0 the newest
+    cache.budget = 2 * entry
+    cache.evict()
+    assert [cache.load(path) is not None for path in paths] == [True, False, True]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_lazy_levels_are_stood_in_by_the_preview():
+    image = gradient(1200, 900)
+    gate = threading.Event()
+    completed = []
+
+    def source(cancelled):
+        gate.wait(5)
+        return image
+    preview = image.resize((150, 112))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pyramid = LazyPyramid(source, image.size, preview, executor=executor, on_complete=completed.append)
+        assert pyramid.sizes == [(1200, 900), (600, 450)]
+        assert pyramid[1] is preview and not pyramid.ready(1)  # the level is requested, the worker waits
+        gate.set()
+        wait_for(lambda: pyramid.ready(1))
+        assert pyramid[1].size == (600, 450)  # reduced from the biggest level, which is kept
+        pyramid.refine()
+        wait_for(lambda: len(completed) == 1)
+        assert pyramid.complete and pyramid.version == 2
+        assert [level.size for level in completed[0]] == pyramid.sizes
+        assert np.array_equal(np.asarray(pyramid.wait(0)), np.asarray(image))
+
+
+def test_close_doesnt_wait_for_the_level_being_built():
+    started = threading.Event()
+    completed = []
+
+    def source(cancelled):  # a band by band reduction, it checks the cancelling between the bands
+        started.set()
+        while not cancelled():
+            time.sleep(0.01)
+        return None
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pyramid = LazyPyramid(source, (1200, 900), Image.new('RGB', (150, 112)), executor=executor,
+                              on_complete=completed.append)
+        pyramid.refine()
+        assert started.wait(5)
+        start = time.perf_counter()
+        pyramid.close()
+        assert time.perf_counter() - start < 0.1
+        assert pyramid.preview is None
+    assert not pyramid.ready(0) and completed == []  # the worker stopped and dropped its result
+
+
+def test_open_pyramid_shows_the_preview_first(tmp_path):
+    path = str(tmp_path / 'page.jpg')
+    gradient(2400, 1800).save(path, quality=90)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pyramid = open_pyramid(path, executor=executor)
+        assert max(pyramid.preview.size) < 2400  # JPEG preview is decoded at the reduced scale
+        assert not pyramid.ready(0)
+        assert pyramid.wait(0).size == (2400, 1800)
+    path = str(tmp_path / 'page.png')
+    gradient(1200, 900).save(path)
+    pyramid = open_pyramid(path)
+    assert pyramid.ready(0) and pyramid.preview.size == pyramid.sizes[-1]
@@ -0,0 +1,45 @@
+import numpy as np
+from PIL import Image
+from pyramid import reduce_huge
+from rawimage import RawImage
+
+
+def noise(width, height, mode='RGB', seed=0):
+    shape = (height, width) if mode == 'L' else (height, width, len(mode))
+    return Image.fromarray(np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8), mode)
+
+
+def test_layouts_of_the_raw_decoder(tmp_path):
+    # PPM is RGB top-down, BMP is BGR bottom-up with rows padded to 4 bytes, PGM is grey
+    for name, image in (('page.ppm', noise(101, 67)), ('page.bmp', noise(101, 67)), ('page.pgm', noise(101, 67, 'L'))):
+        path = str(tmp_path / name)
+        image.save(path)
+        with Image.open(path) as opened:
+            raw = RawImage.from_image(opened)
+        assert raw is not None, name
+        assert (raw.width, raw.height, raw.mode) == (101, 67, image.mode)
+        assert np.array_equal(raw.pixels, np.asarray(image)), name
+        assert np.array_equal(np.asarray(raw.crop((10, 5, 60, 40))), np.asarray(image.crop((10, 5, 60, 40)))), name
+        assert np.array_equal(raw.band(20, 30), np.asarray(image)[20:30]), name
+        raw.close()
+        assert raw.pixels is None
+
+
+def test_compressed_image_is_not_mapped(tmp_path):
+    path = str(tmp_path / 'page.png')
+    noise(64, 48).save(path)
+    with Image.open(path) as opened:
+        assert RawImage.from_image(opened) is None
+
+
+def test_reduce_huge_reads_the_map_band_by_band(tmp_path):
+    image = Image.linear_gradient('L').resize((1000, 400)).convert('RGB')  # smooth, so the bands don't show
+    path = str(tmp_path / 'page.ppm')
+    image.save(path)
+    with Image.open(path) as opened:
+        raw = RawImage.from_image(opened)
+    reduced = reduce_huge(raw, huge_size=250, band_width=64, progress=False)
+    assert reduced.size == (250, 100)
+    expected = np.asarray(image.resize((250, 100), Image.LANCZOS), dtype=np.int16)
+    assert np.abs(np.asarray(reduced, dtype=np.int16) - expected).mean() < 2
+    assert reduce_huge(raw, huge_size=250, band_width=64, progress=False, cancelled=lambda: True) is None
@@ -0,0 +1,64 @@
+import numpy as np
+from PIL import Image
+from make_template import blur_region
+from redact import box_blur, merge_regions, redact
+
+BOXES = [(20, 30, 180, 90), (200, 60, 300, 140), (10, 200, 390, 260)]
+
+
+def per_region(page, boxes):
+    """ The old redaction: every box blurred by PIL on its own """
+    image = Image.fromarray(page)
+    for box in boxes:
+        blur_region(image, box)
+    return np.asarray(image)
+
+
+def union(shape, boxes):
+    mask = np.zeros(shape[:2], dtype=bool)
+    for x, y, x1, y1 in boxes:
+        mask[y:y1, x:x1] = True
+    return mask
+
+
+def test_smooth_page_matches_per_region_blur():
+    ramp = (np.arange(400) * 255 // 399).astype(np.uint8)
+    page = np.repeat(np.broadcast_to(ramp[None, :, None], (300, 400, 1)), 3, axis=2).copy()
+    old = per_region(page.copy(), BOXES).astype(np.int16)
+    new = redact(page.copy(), BOXES).astype(np.int16)
+    assert np.abs(old - new).max() <= 1
+
+
+def test_noisy_page_is_blurred_like_per_region_blur():
+    page = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    old = per_region(page.copy(), BOXES).astype(np.int16)
+    new = redact(page.copy(), BOXES).astype(np.int16)
+    mask = union(page.shape, BOXES)
+    assert np.array_equal(new[~mask], page[~mask])  # only the boxes change
+    for x, y, x1, y1 in BOXES:
+        inner = (slice(y + 4, y1 - 4), slice(x + 4, x1 - 4))  # the borders are extended in another way
+        assert np.abs(old[inner] - new[inner]).mean() < 6
+        assert 0.7 < new[inner].std() / old[inner].std() < 1.3  # the noise is smoothed as much
+
+
+def test_overlapping_boxes_are_blurred_once():
+    page = np.random.default_rng(1).integers(0, 256, (120, 160), dtype=np.uint8)
+    boxes = [(10, 10, 80, 60), (50, 40, 150, 100)]
+    result = redact(page.copy(), boxes)
+    mask = union(page.shape, boxes)
+    blurred = box_blur(page[10:100, 10:150])  # the merged region
+    assert np.array_equal(result[10:100, 10:150][mask[10:100, 10:150]], blurred[mask[10:100, 10:150]])
+    assert np.array_equal(result[~mask], page[~mask])
+
+
+def test_merge_regions():
+    regions = merge_regions([(0, 0, 10, 10), (5, 5, 20, 20), (30, 30, 40, 40), (8, 0, 15, 4), (40, 30, 45, 35)])
+    # the boxes which only touch stay apart
+    assert sorted(bbox for bbox, _ in regions) == [(0, 0, 20, 20), (30, 30, 40, 40), (40, 30, 45, 35)]
+
+
+def test_empty_and_outside_boxes_are_skipped():
+    page = np.full((50, 50, 3), 128, dtype=np.uint8)
+    page[10:20, 10:20] = 0
+    result = redact(page.copy(), [(5, 5, 5, 30), (60, 60, 80, 80), (-10, -10, 0, 0)])
+    assert np.array_equal(result, page)
@@ -0,0 +1,32 @@
+from PIL import Image
+from session import Session
+from viewport import ImageView
+
+
+def test_switch_frees_the_previous_image(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the pyramid cache and the catalog are kept in the working folder
+    (tmp_path / 'templates').mkdir()
+    for i in range(2):
+        Image.new('RGB', (1200, 900), (100 * i, 50, 50)).save(tmp_path / 'templates' / f'page_{i}.jpg')
+    (tmp_path / 'templates' / 'page_0.txt').write_text('Ticker 10 20 110 220\n')
+    session = Session('templates', ['Ticker', 'Value'])
+    try:
+        view = ImageView()
+        first, second = session.files
+        viewport = view.open(first, session.load_file(first), session.pyramid_cache, session.refiner)
+        assert len(session.labels_created) == 1
+        for _ in range(2):  # the second pass takes the tiles from the cache
+            for tile, box in viewport.tiles([0.0, 0.0, 1200.0, 900.0], (0.0, 0.0, 640.0, 480.0)):
+                view.tile((viewport.zoom_key,) + tile, box)
+        assert len(view.tile_cache) == view.rendered > 0
+        image, pyramid = view.image, view.pyramid
+
+        view.open(second, session.load_file(second), session.pyramid_cache, session.refiner)
+        assert len(session.labels_created) == 0
+        assert len(view.tile_cache) == 0
+        assert image.fp is None and pyramid.preview is None  # buffers of the first image are freed
+        assert view.image.size == (1200, 900)
+        view.close()
+        assert view.image is view.pyramid is view.viewport is None
+    finally:
+        session.shutdown()
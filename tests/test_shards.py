@@ -0,0 +1,106 @@
+import glob
+import os
+from shards import ShardReader, ShardWriter, pack, recover
+
+
+def sample(i):
+    return {'jpg': bytes([i % 256]) * (100 + 37 * i), 'txt': 'Value {0} 0 10 10\n'.format(i).encode()}
+
+
+def test_round_trip(tmp_path):
+    with ShardWriter(str(tmp_path), max_bytes=8 << 10) as writer:
+        for i in range(50):
+            writer.add('cam/{0:03d}'.format(i), sample(i))
+    reader = ShardReader(str(tmp_path))
+    assert len(reader.shards) > 1  # the size limit splits the samples
+    assert len(reader) == 50
+    assert reader['cam/007'] == sample(7)
+    assert reader.get('cam/049', 'txt') == sample(49)['txt']
+    assert dict(reader.iterate(shuffle=False)) == {'cam/{0:03d}'.format(i): sample(i) for i in range(50)}
+    shuffled = [key for key, _ in reader.iterate(shuffle=True, buffer=8, seed=1)]
+    assert sorted(shuffled) == sorted(reader.keys()) and shuffled != sorted(shuffled)
+    reader.close()
+
+
+def test_unfinished_shard_is_invisible(tmp_path):
+    writer = ShardWriter(str(tmp_path))
+    writer.add('a', sample(1))
+    assert len(ShardReader(str(tmp_path))) == 0
+    writer.close()
+    assert len(ShardReader(str(tmp_path))) == 1
+
+
+def crash(directory, cut):
+    """ Write 10 samples and kill the writer, the last cut bytes don't reach the disk """
+    writer = ShardWriter(directory, prefix='variants')
+    for i in range(10):
+        writer.add(str(i), sample(i))
+    writer.tar.fileobj.close()  # killed before the shard was finished
+    path, = glob.glob(os.path.join(directory, '*.tar.tmp'))
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - cut)
+
+
+def test_recover_after_crash(tmp_path):
+    crash(str(tmp_path), 600)  # the label of the last sample is cut
+    reopened = ShardWriter(str(tmp_path), prefix='variants')
+    assert reopened.recovered == 9
+    reopened.add('10', sample(10))
+    reopened.close()
+    reader = ShardReader(str(tmp_path))
+    assert sorted(reader.keys(), key=int) == [str(i) for i in range(9)] + ['10']
+    assert reader['8'] == sample(8)
+    assert recover(str(tmp_path)) == 0  # nothing is left to recover
+
+
+def test_pack(tmp_path):
+    source = tmp_path / 'pic' / 'cam1'
+    source.mkdir(parents=True)
+    (source / 'a.jpg').write_bytes(b'jpeg')
+    (source / 'a.txt').write_text('Value 0 0 1 1\n')
+    (source / 'b.jpg').write_bytes(b'other')
+    (source / 'notes.md').write_text('skipped')
+    assert pack(str(tmp_path / 'pic'), str(tmp_path / 'shards')) == 2
+    reader = ShardReader(str(tmp_path / 'shards'))
+    assert reader['cam1/a'] == {'jpg': b'jpeg', 'txt': b'Value 0 0 1 1\n'}
+    assert reader['cam1/b'] == {'jpg': b'other'}
+    reader.close()
+
+
+def test_recover_keeps_complete_samples(tmp_path):
+    crash(str(tmp_path), 0)  # killed between the samples
+    assert recover(str(tmp_path)) == 10
+    reader = ShardReader(str(tmp_path))
+    assert all(reader[key] == sample(int(key)) for key in reader.keys())
+    reader.close()
+
+
+def test_recover_single_sample(tmp_path):
+    writer = ShardWriter(str(tmp_path))
+    writer.add('first', sample(1))
+    writer.tar.fileobj.close()  # killed after the first sample was flushed
+    assert recover(str(tmp_path)) == 1
+    assert ShardReader(str(tmp_path))['first'] == sample(1)
+
+
+def test_recover_single_sample_cut(tmp_path):
+    writer = ShardWriter(str(tmp_path))
+    writer.add('first', sample(1))
+    writer.tar.fileobj.close()
+    path, = glob.glob(str(tmp_path / '*.tar.tmp'))
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 600)  # the data of the label is cut
+    assert recover(str(tmp_path)) == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_recover_sample_without_member_header(tmp_path):
+    writer = ShardWriter(str(tmp_path), max_count=5)
+    for i in range(6):  # the first shard is complete, the second one has one sample
+        writer.add(str(i), sample(i))
+    writer.tar.fileobj.close()
+    path, = glob.glob(str(tmp_path / '*.tar.tmp'))
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1024)  # the label member didn't reach the disk at all
+    assert recover(str(tmp_path)) == 0  # the image alone is not a sample like the others
+    assert sorted(ShardReader(str(tmp_path)).keys()) == ['0', '1', '2', '3', '4']
@@ -0,0 +1,51 @@
+import numpy as np
+from labelstore import LabelStore
+from spatial import GridIndex, normalized
+
+
+def brute_force(store, x, y, x1, y1):
+    indices = store.indices()
+    boxes = normalized(store.boxes(indices))
+    hit = (boxes[:, 0] <= x1) & (boxes[:, 2] >= x) & (boxes[:, 1] <= y1) & (boxes[:, 3] >= y)
+    return indices[hit].tolist()
+
+
+def random_store(count=300, seed=0):
+    rng = np.random.default_rng(seed)
+    corners = rng.uniform(0, 4000, (count, 2))
+    sizes = rng.uniform(5, 600, (count, 2))
+    boxes = np.concatenate([corners, corners + sizes], axis=1)
+    flip = rng.random(count) < 0.5  # boxes drawn from the bottom right corner
+    boxes[flip] = boxes[flip][:, [2, 3, 0, 1]]
+    store = LabelStore()
+    store.extend(boxes, ['Value'] * count)
+    return store
+
+
+def test_query_matches_brute_force():
+    store = random_store()
+    index = GridIndex(store, cell=256)
+    rng = np.random.default_rng(1)
+    for x, y, w, h in rng.uniform(0, 3000, (50, 4)).tolist():
+        assert sorted(index.query(x, y, x + w, y + h).tolist()) == brute_force(store, x, y, x + w, y + h)
+
+
+def test_query_skips_deleted_and_finds_inserted():
+    store = random_store(50)
+    index = GridIndex(store)
+    store.delete(np.arange(0, 50, 2))
+    new = store.extend([[100, 100, 150, 150]], ['Date'])
+    index.insert(new)
+    found = index.query(0, 0, 5000, 5000).tolist()
+    assert sorted(found) == store.indices().tolist()
+    assert int(new[0]) in index.query(120, 120, 121, 121).tolist()
+
+
+def test_at_returns_smallest_label():
+    store = LabelStore()
+    big = store.add(0, 0, 1000, 1000, 'Value')
+    small = store.add(400, 400, 500, 500, 'Value')
+    index = GridIndex(store)
+    assert index.at(450, 450) == small
+    assert index.at(50, 50) == big
+    assert index.at(2000, 2000) is None
@@ -0,0 +1,44 @@
+import random
+from PIL import ImageFont
+from textlayout import FontPool, GlyphTable, fit_to_box
+
+
+def test_width_is_the_sum_of_the_advances():
+    table = GlyphTable(ImageFont.load_default())
+    for text in ('Account 12,345.67', 'Zürich £'):  # the non-ASCII advances are looked up on demand
+        assert table.width(text) == sum(table.font.getlength(char) for char in text)
+    assert table.width('') == 0.0
+
+
+def test_fit_takes_the_longest_prefix():
+    table = GlyphTable(ImageFont.load_default())
+    text = 'IBAN DE89 3704 0044 0532 0130 00'
+    for width in (0, 5, 37, 100, 1000):
+        prefix, prefix_width = table.fit(text, width)
+        assert prefix_width == table.width(prefix) <= width
+        assert prefix == text or table.width(text[:len(prefix) + 1]) > width
+
+
+def test_fit_to_box_needs_the_line_height():
+    table = GlyphTable(ImageFont.load_default())
+    assert fit_to_box(table, 'Value', 100, table.height - 1) == ('', (0, 0))
+    text, (width, height) = fit_to_box(table, 'Value', 100, table.height)
+    assert text == 'Value' and height == table.height and width >= table.width('Value')
+
+
+def test_pool_loads_a_font_once_and_fits_the_height():
+    pool = FontPool()
+    if not pool.available():  # no TrueType font on this machine
+        assert pool.choice(100) is pool.default()
+        return
+    font = pool.available()[0]
+    assert pool.get(font, 12) is pool.get(font, 12)
+    random.seed(0)
+    for height in (15, 20, 30):
+        assert pool.choice(height).height <= height
+
+
+def test_pool_falls_back_to_the_bitmap_font(tmp_path):
+    pool = FontPool(fonts=('missing.ttf',), directory=str(tmp_path))
+    assert pool.available() == []
+    assert pool.choice(30) is pool.default()
@@ -0,0 +1,72 @@
+import numpy as np
+from PIL import Image
+from pyramid import build_pyramid
+from rawimage import RawImage
+from viewport import Viewport
+
+
+def gradient(width, height):
+    x = np.arange(width, dtype=np.uint32) * 255 // (width - 1)
+    y = np.arange(height, dtype=np.uint32)[:, None] * 255 // (height - 1)
+    return Image.fromarray(np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                                      np.full((height, width), 128)]).astype(np.uint8))
+
+
+def test_tiles_cover_the_visible_part_of_the_image():
+    viewport = Viewport(1000, 700, build_pyramid(gradient(1000, 700)), tile_size=256)
+    box_image = (-100.0, -50.0, 900.0, 650.0)  # the image is scrolled by (100, 50)
+    tiles = viewport.tiles(box_image, (0.0, 0.0, 640.0, 480.0))
+    covered = np.zeros((700, 1000), dtype=np.int32)
+    for (column, row), (x1, y1, x2, y2) in tiles:
+        assert (x1, y1) == (column * 256, row * 256)
+        covered[int(y1):int(y2), int(x1):int(x2)] += 1
+    assert covered.max() == 1  # tiles don't overlap
+    assert covered[50:530, 100:740].all()  # the visible area is covered
+    assert sorted(tile for tile, _ in tiles) == [(c, r) for c in range(3) for r in range(3)]
+    edge = viewport.tiles(box_image, (0.0, 0.0, 2000.0, 2000.0))
+    assert max(box[2] for _, box in edge) == 1000 and max(box[3] for _, box in edge) == 700  # clipped
+    assert viewport.tiles(box_image, (1000.0, 0.0, 1640.0, 480.0)) == []
+
+
+def test_zoom_takes_the_pyramid_level():
+    image = gradient(1600, 1200)
+    viewport = Viewport(1600, 1200, build_pyramid(image), tile_size=256, delta=2.0)
+    assert viewport.render_tile(0, 0, 256, 256).tobytes() == image.crop((0, 0, 256, 256)).tobytes()
+    assert viewport.zoom(-1, 800, 600) == 0.5
+    assert (viewport.imscale, viewport.curr_img, viewport.scale) == (0.5, 1, 1.0)
+    tile = viewport.render_tile(256, 0, 512, 256)  # the level is taken 1:1
+    assert tile.tobytes() == build_pyramid(image)[1].crop((256, 0, 512, 256)).tobytes()
+    assert viewport.zoom(0, 800, 600) is None
+    while viewport.zoom(-1, 800, 600) is not None:
+        pass
+    assert round(viewport.min_side * viewport.imscale) < 30  # zoomed out till the image is tiny
+    viewport.imscale = 301.0
+    assert viewport.zoom(1, 800, 600) is None  # one pixel is bigger than the half of the view
+    assert viewport.zoom_key == 301.0
+
+
+def test_huge_image_tiles_are_read_from_the_map(tmp_path):
+    image = gradient(900, 600)
+    path = str(tmp_path / 'huge.ppm')
+    image.save(path)
+    with Image.open(path) as opened:
+        raw = RawImage.from_image(opened)
+    reduced = image.resize((300, 200), Image.LANCZOS)  # the pyramid starts at huge_size
+    viewport = Viewport(900, 600, build_pyramid(reduced, top_size=100), raw, huge_size=300, tile_size=128)
+    assert viewport.ratio == 3.0 and viewport.curr_img == 0
+    assert viewport.zoom(1, 800, 600) is not None
+    assert viewport.curr_img < 0  # closer than the reduced image
+    tile = viewport.render_tile(0, 0, 128, 128)
+    assert tile.size == (128, 128)
+    expected = image.crop((0, 0, int(np.ceil(128 / viewport.imscale)), int(np.ceil(128 / viewport.imscale))))
+    diff = np.abs(np.asarray(tile, dtype=np.int16) - np.asarray(expected.resize((128, 128)), dtype=np.int16))
+    assert diff.mean() < 2
+    assert viewport.crop((10, 20, 30, 40)).tobytes() == image.crop((10, 20, 30, 40)).tobytes()
+
+
+def test_scroll_region_keeps_the_visible_image():
+    assert Viewport.scroll_region((0.0, 0.0, 2000.0, 1500.0), (100, 100, 740, 580)) == (0, 0, 2000, 1500)
+    # the image inside the view is the region, so the scrollbars hide
+    assert Viewport.scroll_region((10.0, 20.0, 110.0, 220.0), (0, 0, 640, 480)) == (10, 20, 110, 220)
+    # the image is wider than the view, only the horizontal scrollbar shows
+    assert Viewport.scroll_region((-50.5, 20.0, 900.0, 220.0), (0, 0, 640, 480)) == (-50, 20, 900, 220)
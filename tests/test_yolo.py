@@ -0,0 +1,73 @@
+import numpy as np
+from PIL import Image
+from yolo import ClassMap, LabelCache, convert_dataset, format_labels, normalize
+
+
+def test_normalize_any_corner_order():
+    boxes, keep = normalize([[10, 20, 50, 60], [50, 60, 10, 20]], 100, 200)
+    np.testing.assert_allclose(boxes, [[0.3, 0.2, 0.4, 0.2]] * 2, rtol=1e-6)
+    assert keep.tolist() == [True, True]
+
+
+def test_normalize_clips_and_drops_empty_boxes():
+    boxes, keep = normalize([[-50, -50, 50, 50], [120, 10, 150, 20], [30, 30, 30, 40]], 100, 100)
+    np.testing.assert_allclose(boxes[0], [0.25, 0.25, 0.5, 0.5])
+    assert keep.tolist() == [True, False, False]
+
+
+def test_normalize_empty():
+    boxes, keep = normalize(np.empty((0, 4)), 100, 100)
+    assert boxes.shape == (0, 4) and keep.shape == (0,)
+
+
+def test_format_labels():
+    assert format_labels(np.array([2]), np.array([[0.5, 0.25, 0.1, 0.2]])) == '2 0.500000 0.250000 0.100000 0.200000\n'
+
+
+def test_class_map_keeps_ids(tmp_path):
+    path = str(tmp_path / 'classes.names')
+    assert ClassMap(path).ids(['Value', 'Ticker']).tolist() == [0, 1]
+    class_map = ClassMap(path)
+    assert class_map.ids(['Date', 'Ticker', 'Value']).tolist() == [2, 1, 0]
+    assert ClassMap(path).names == ['Value', 'Ticker', 'Date']
+
+
+def test_label_cache_round_trip(tmp_path):
+    path = str(tmp_path / 'labels.cache')
+    labels = [np.array([[0, 0.5, 0.5, 0.2, 0.2], [1, 0.1, 0.2, 0.05, 0.05]], dtype=np.float32),
+              np.empty((0, 5), dtype=np.float32),
+              np.array([[2, 0.9, 0.9, 0.1, 0.1]], dtype=np.float32)]
+    images = ['/data/a.jpg', '/data/ü/b.jpg', '/data/c.png']
+    LabelCache.write(path, images, [(640, 480), (800, 600), (1920, 1080)], labels, ['Value', 'Ticker', 'Date'])
+    cache = LabelCache(path)
+    assert len(cache) == 3
+    assert cache.classes == ['Value', 'Ticker', 'Date']
+    for i, rows in enumerate(labels):
+        np.testing.assert_array_equal(cache[i], rows)
+        assert cache.image(i) == images[i]
+    assert cache.index('/data/ü/b.jpg') == 1
+    assert cache.sizes.tolist() == [[640, 480], [800, 600], [1920, 1080]]
+    cache.close()
+
+
+def test_label_cache_rejects_other_files(tmp_path):
+    path = tmp_path / 'labels.cache'
+    path.write_bytes(b'not a cache' * 10)
+    try:
+        LabelCache(str(path))
+    except ValueError:
+        return
+    raise AssertionError('ValueError is not raised')
+
+
+def test_convert_mixed_relative_and_absolute_directories(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for camera in ('cam1', 'cam2'):
+        (tmp_path / 'pic' / camera).mkdir(parents=True)
+        Image.new('RGB', (200, 100)).save(tmp_path / 'pic' / camera / 'frame.jpg')
+        (tmp_path / 'pic' / camera / 'frame.txt').write_text('Value 50 40 150 60\n')
+    directories = ['pic/cam1', str(tmp_path / 'pic' / 'cam2')]
+    count = convert_dataset(directories, ClassMap(str(tmp_path / 'classes.names')), output='yolo', workers=1)
+    assert count == 2
+    for camera in ('cam1', 'cam2'):
+        assert (tmp_path / 'yolo' / camera / 'frame.txt').read_text() == format_labels([0], [[0.5, 0.5, 0.5, 0.2]])
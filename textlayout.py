@@ -0,0 +1,100 @@
+import glob
+import os
+import random
+import numpy as np
+from PIL import ImageFont
+
+
+def _advance(font, char):
+    """ Return horizontal advance of the character in pixels """
+    if hasattr(font, 'getlength'):
+        return font.getlength(char)
+    return font.getsize(char)[0]  # old Pillow and bitmap fonts
+
+
+class GlyphTable:
+    """ Cached advances of the font glyphs, so the text width is a sum over the table """
+    def __init__(self, font):
+        self.font = font
+        self.__ascii = np.array([_advance(font, chr(i)) for i in range(128)], dtype=np.float32)
+        self.__other = {}  # advances of the non-ASCII characters, filled on demand
+        try:
+            ascent, descent = font.getmetrics()
+            self.height = ascent + descent  # height of the text line
+        except AttributeError:  # bitmap font
+            bbox = font.getbbox('Ay') if hasattr(font, 'getbbox') else (0, 0) + font.getsize('Ay')
+            self.height = bbox[3]
+
+    def advances(self, text):
+        """ Return array of advances of every character of the text """
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        advances = self.__ascii[np.minimum(codes, 127)]
+        for i in np.flatnonzero(codes > 127):
+            char = text[i]
+            if char not in self.__other:
+                self.__other[char] = _advance(self.font, char)
+            advances[i] = self.__other[char]
+        return advances
+
+    def width(self, text):
+        return float(self.advances(text).sum())
+
+    def fit(self, text, width):
+        """ Return the longest prefix of the text which fits into the width and its width """
+        edges = np.cumsum(self.advances(text))  # width of every prefix, it grows monotonically
+        n = int(np.searchsorted(edges, width, side='right'))  # binary search of the longest prefix
+        return text[:n], (float(edges[n - 1]) if n else 0.0)
+
+
+class FontPool:
+    """ Pool of loaded fonts with their glyph tables. TrueType fonts are loaded once per size,
+        the default bitmap font is used when no TrueType font is found """
+    def __init__(self, fonts=('DejaVuSans.ttf', 'arial.ttf', 'LiberationSans-Regular.ttf'),
+                 sizes=(10, 12, 14, 16, 18, 20), directory='fonts'):
+        self.fonts = list(fonts) + sorted(glob.glob(os.path.join(directory, '*.ttf')))
+        self.sizes = sorted(sizes)
+        self.__tables = {}  # (font, size) -> GlyphTable
+        self.__available = None  # fonts which could be loaded
+        self.__default = None  # GlyphTable of the default bitmap font
+
+    def default(self):
+        """ Return glyph table of the default bitmap font """
+        if self.__default is None:
+            self.__default = GlyphTable(ImageFont.load_default())
+        return self.__default
+
+    def get(self, font, size):
+        """ Return glyph table of the font of the size, the font is loaded only once """
+        key = (font, size)
+        if key not in self.__tables:
+            self.__tables[key] = GlyphTable(ImageFont.truetype(font, size))
+        return self.__tables[key]
+
+    def available(self):
+        """ Return list of the TrueType fonts which could be loaded on this machine """
+        if self.__available is None:
+            self.__available = []
+            for font in self.fonts:
+                try:
+                    self.get(font, self.sizes[0])
+                except OSError:
+                    continue
+                self.__available.append(font)
+        return self.__available
+
+    def choice(self, height):
+        """ Return glyph table of the random font which line fits into the height """
+        fonts = self.available()
+        if not fonts:
+            return self.default()
+        font = random.choice(fonts)
+        sizes = [size for size in self.sizes if self.get(font, size).height <= height] or self.sizes[:1]
+        return self.get(font, random.choice(sizes))
+
+
+def fit_to_box(table, text, width, height):
+    """ Return the longest prefix of the text which fits into the box and its size """
+    if table.height > height:
+        return '', (0, 0)
+    text, text_width = table.fit(text, width)
+    return text, (int(np.ceil(text_width)), table.height)
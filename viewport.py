@@ -0,0 +1,170 @@
+import math
+import warnings
+from PIL import Image
+from prefetch import ImageCache
+from pyramid import HUGE_SIZE, LazyPyramid, open_pyramid
+from rawimage import RawImage
+
+
+class Viewport:
+    """ Zoom, scroll and tile maths of the image viewer, independent from Tk.
+        Boxes are (x1, y1, x2, y2) in canvas coordinates: box_image is the area of the zoomed image
+        and box_canvas is the visible area of the canvas """
+    def __init__(self, width, height, pyramid, raw=None, huge_size=HUGE_SIZE, tile_size=256,
+                 delta=1.3, reduction=2, resample=Image.LANCZOS):
+        self.width, self.height = width, height  # size of the original image
+        if not isinstance(pyramid, LazyPyramid):
+            pyramid = LazyPyramid.from_levels(pyramid, reduction)
+        self.pyramid = pyramid  # reduced images, the first one is the biggest
+        self.raw = raw  # memory-mapped pixels of the huge image, None for the normal image
+        self.huge = raw is not None
+        self.tile_size = tile_size  # size of the tile on the screen
+        self.delta = delta  # zoom magnitude
+        self.reduction = reduction  # reduction degree of image pyramid
+        self.resample = resample  # could be: NEAREST, BILINEAR, BICUBIC and ANTIALIAS
+        self.imscale = 1.0  # scale for the canvas image zoom
+        self.min_side = min(width, height)  # get the smaller image side
+        # Set ratio coefficient for image pyramid
+        self.ratio = max(width, height) / huge_size if self.huge else 1.0
+        self.curr_img = 0  # current image from the pyramid
+        self.scale = self.imscale * self.ratio  # image pyramid scale
+
+    @property
+    def zoom_key(self):
+        """ Key of the current zoom for the tile caches """
+        return round(self.imscale, 6)
+
+    def zoom(self, direction, view_width, view_height):
+        """ Zoom one step in (direction > 0) or out (direction < 0).
+            Return factor of the zoom or None if the zoom is not possible """
+        if direction < 0:  # scroll down, smaller
+            if round(self.min_side * self.imscale) < 30: return None  # image is less than 30 pixels
+            factor = 1.0 / self.delta
+        elif direction > 0:  # scroll up, bigger
+            i = min(view_width, view_height) >> 1
+            if i < self.imscale: return None  # 1 pixel is bigger than the visible area
+            factor = self.delta
+        else:
+            return None
+        self.imscale *= factor
+        # Take appropriate image from the pyramid
+        k = self.imscale * self.ratio  # temporary coefficient
+        self.curr_img = min((-1) * int(math.log(k, self.reduction)), len(self.pyramid) - 1)
+        self.scale = k * math.pow(self.reduction, max(0, self.curr_img))
+        return factor
+
+    @staticmethod
+    def scroll_region(box_image, box_canvas):
+        """ Return integer scroll region of the canvas """
+        box_img_int = tuple(map(int, box_image))  # convert to integer or it will not work properly
+        # Get scroll region box
+        box_scroll = [min(box_img_int[0], box_canvas[0]), min(box_img_int[1], box_canvas[1]),
+                      max(box_img_int[2], box_canvas[2]), max(box_img_int[3], box_canvas[3])]
+        # Horizontal part of the image is in the visible area
+        if  box_scroll[0] == box_canvas[0] and box_scroll[2] == box_canvas[2]:
+            box_scroll[0]  = box_img_int[0]
+            box_scroll[2]  = box_img_int[2]
+        # Vertical part of the image is in the visible area
+        if  box_scroll[1] == box_canvas[1] and box_scroll[3] == box_canvas[3]:
+            box_scroll[1]  = box_img_int[1]
+            box_scroll[3]  = box_img_int[3]
+        return tuple(map(int, box_scroll))
+
+    def tiles(self, box_image, box_canvas):
+        """ Return list of ((column, row), box) of the tiles in the visible area.
+            Tile box is (x1, y1, x2, y2) relative to the corner of the zoomed image """
+        x1 = max(box_canvas[0] - box_image[0], 0)  # get coordinates (x1,y1,x2,y2) of the visible area
+        y1 = max(box_canvas[1] - box_image[1], 0)
+        x2 = min(box_canvas[2], box_image[2]) - box_image[0]
+        y2 = min(box_canvas[3], box_image[3]) - box_image[1]
+        if int(x2 - x1) <= 0 or int(y2 - y1) <= 0:  # image is not in the visible area
+            return []
+        width, height = box_image[2] - box_image[0], box_image[3] - box_image[1]  # zoomed image size
+        t = self.tile_size
+        tiles = []
+        for row in range(int(y1 // t), int(math.ceil(y2 / t))):
+            for column in range(int(x1 // t), int(math.ceil(x2 / t))):
+                box = (column * t, row * t, min((column + 1) * t, width), min((row + 1) * t, height))
+                if int(box[2] - box[0]) > 0 and int(box[3] - box[1]) > 0:
+                    tiles.append(((column, row), box))
+        return tiles
+
+    def render_tile(self, x1, y1, x2, y2):
+        """ Render area (x1,y1,x2,y2) of the zoomed image. Coordinates are relative to the image corner """
+        size = (int(x2 - x1), int(y2 - y1))
+        if self.huge and self.curr_img < 0:  # take tile from the huge image
+            image = self.crop((int(x1 / self.imscale), int(y1 / self.imscale),
+                               min(int(math.ceil(x2 / self.imscale)), self.width),
+                               min(int(math.ceil(y2 / self.imscale)), self.height)))
+            return image.resize(size, self.resample)
+        level = max(0, self.curr_img)
+        image = self.pyramid[level]  # take tile from the current pyramid image
+        width, height = self.pyramid.size(level)
+        kx, ky = image.width / width, image.height / height  # the level is stood in by the preview till it is built
+        box = (x1 / self.scale * kx, y1 / self.scale * ky,
+               min(x2 / self.scale * kx, image.width), min(y2 / self.scale * ky, image.height))
+        return image.resize(size, self.resample if image is not self.pyramid.preview else Image.BILINEAR, box=box)
+
+    def crop(self, bbox):
+        """ Crop rectangle from the original image and return it """
+        if self.huge:  # image is huge and not totally in RAM
+            return self.raw.crop(bbox)  # only the rectangle is read from the memory map
+        else:  # image is totally in RAM
+            return self.pyramid.wait(0).crop(bbox)
+
+
+def open_view(path, pyramid=None, cache=None, executor=None, huge_size=HUGE_SIZE, reduction=2, resample=Image.LANCZOS,
+              tile_size=256, delta=1.3):
+    """ Open the image file for the viewer and return (image, raw, pyramid, viewport). Raw is the memory map
+        of the huge image or None. The pyramid is the given one, the cached one or built lazily in the executor """
+    Image.MAX_IMAGE_PIXELS = 1000000000  # suppress DecompressionBombError for the big image
+    with warnings.catch_warnings():  # suppress DecompressionBombWarning
+        warnings.simplefilter('ignore')
+        image = Image.open(path)  # open image, but don't load it
+    raw = RawImage.from_image(image) if image.width * image.height > huge_size * huge_size else None
+    pyramid = pyramid or (cache.load(path) if cache is not None else None)
+    if pyramid is None:
+        pyramid = open_pyramid(path, raw, huge_size, reduction, 512, resample, executor,
+                               None if cache is None else lambda levels: cache.store(path, levels))
+    else:
+        pyramid = LazyPyramid.from_levels(pyramid, reduction)
+    viewport = Viewport(image.width, image.height, pyramid, raw, huge_size, tile_size, delta, reduction, resample)
+    return image, raw, pyramid, viewport
+
+
+class ImageView:
+    """ Shown image: the opened file, its memory map, pyramid and viewport with the LRU cache of the rendered tiles.
+        The canvas shows it with PhotoImage tiles, the soak benchmark replays it headless with PIL tiles.
+        Opening the next image closes the previous one first, so buffers of two images are never held at once """
+    def __init__(self, tile_budget=64 << 20, make_tile=None):
+        self.tile_cache = ImageCache(tile_budget)  # (zoom, column, row) -> tile
+        # rendered PIL image -> (tile, its size in bytes), the PIL image itself by default
+        self.make_tile = make_tile or (lambda image: (image, 4 * image.width * image.height))
+        self.rendered = 0  # number of the tiles made since the start
+        self.image = self.raw = self.pyramid = self.viewport = None
+
+    def open(self, path, pyramid=None, cache=None, executor=None, **kwargs):
+        """ Close the shown image and open the next one, keyword arguments are those of open_view """
+        self.close()
+        self.image, self.raw, self.pyramid, self.viewport = open_view(path, pyramid, cache, executor, **kwargs)
+        return self.viewport
+
+    def tile(self, key, box):
+        """ Return tile of the box from the cache, render it if it isn't there """
+        tile = self.tile_cache.get(key)
+        if tile is None:
+            tile, size = self.make_tile(self.viewport.render_tile(*box))
+            self.rendered += 1
+            self.tile_cache.put(key, tile, size)
+        return tile
+
+    def close(self):
+        """ Free the tiles, stop the background refinement and close the file and the memory map """
+        self.tile_cache.clear()  # PhotoImages are deleted with the last reference
+        if self.pyramid is not None:
+            self.pyramid.close()
+        if self.image is not None:
+            self.image.close()
+        if self.raw is not None:
+            self.raw.close()
+        self.image = self.raw = self.pyramid = self.viewport = None
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from catalog import read_boxes
+from group import walk
+
+
+class ClassMap:
+    """ Class names of the YOLO labels, the line number in the names file is the class id.
+        New names are appended, so the ids of the known classes never change """
+    def __init__(self, path='classes.names'):
+        self.path = path
+        self.names = []
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.names = [line.strip() for line in f if line.strip()]
+        self.__ids = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def id(self, name):
+        """ Return id of the class name, new names are registered and saved """
+        if name not in self.__ids:
+            self.__ids[name] = len(self.names)
+            self.names.append(name)
+            self.save()
+        return self.__ids[name]
+
+    def ids(self, names):
+        """ Return int32 array of the ids of the class names """
+        return np.array([self.id(str(name)) for name in names], dtype=np.int32)
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(''.join(name + '\n' for name in self.names))
+        os.replace(tmp, self.path)
+
+
+def normalize(boxes, width, height):
+    """ Return Nx4 float32 boxes (cx, cy, w, h) in [0, 1] of the Nx4 pixel boxes (x, y, x1, y1) in any corner order,
+        and the mask of the boxes which are not empty after clipping to the image """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    size = np.array([width, height, width, height], dtype=np.float32)
+    corners = np.clip(boxes / size, 0.0, 1.0)
+    low = np.minimum(corners[:, :2], corners[:, 2:])
+    high = np.maximum(corners[:, :2], corners[:, 2:])
+    wh = high - low
+    return np.concatenate([low + wh / 2, wh], axis=1), np.all(wh > 0, axis=1)
+
+
+def format_labels(ids, boxes):
+    """ Return text of the YOLO label file 'class_id cx cy w h' """
+    return ''.join('{0} {1:.6f} {2:.6f} {3:.6f} {4:.6f}\n'.format(i, *box)
+                   for i, box in zip(np.asarray(ids).tolist(), np.asarray(boxes).tolist()))
+
+
+def write_labels(path, ids, boxes):
+    """ Write YOLO label file, the old one is replaced atomically """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(format_labels(ids, boxes))
+    os.replace(tmp, path)
+
+
+def convert(task):
+    """ Return (image, (width, height), class names, Nx4 normalized boxes) of the labelled image. Called in the workers """
+    path, label_path = task
+    with Image.open(path) as image:  # only the header is read
+        width, height = image.size
+    try:
+        classes, boxes = read_boxes(label_path, width, height)
+    except (OSError, ValueError):
+        classes, boxes = [], np.empty((0, 4), dtype=np.float32)
+    boxes, keep = normalize(boxes, width, height)
+    return path, (width, height), [name for name, k in zip(classes, keep) if k], boxes[keep]
+
+
+class LabelCache:
+    """ Labels of the whole dataset in one memory-mapped file, so a loader opens it in milliseconds
+        instead of reading the label files. Rows of image i are labels[offsets[i]:offsets[i + 1]],
+        a row is (class_id, cx, cy, w, h) in float32 """
+    magic = b'YOLOLABELCACHE1\n'
+    align = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.__map = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self.__map[:16]) != self.magic:
+            raise ValueError('{0} is not a label cache'.format(path))
+        length = int(self.__map[16:24].view('<u8')[0])
+        header = json.loads(bytes(self.__map[24:24 + length]).decode())
+        self.classes = header['classes']
+        for name, (offset, dtype, shape) in header['sections'].items():
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            setattr(self, name, self.__map[offset:offset + nbytes].view(dtype).reshape(shape))
+        self.__positions = None  # image path -> index, built on the first lookup
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        """ Return Nx5 float32 labels of the image i, a view of the file """
+        return self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    def image(self, i):
+        return bytes(self.names[self.name_offsets[i]:self.name_offsets[i + 1]]).decode()
+
+    def index(self, path):
+        """ Return index of the image path """
+        if self.__positions is None:
+            self.__positions = {self.image(i): i for i in range(len(self))}
+        return self.__positions[path]
+
+    def close(self):
+        for name in ('offsets', 'labels', 'sizes', 'names', 'name_offsets'):
+            setattr(self, name, None)
+        self.__map = None
+
+    @classmethod
+    def write(cls, path, images, sizes, labels, classes):
+        """ Write the cache of the image paths, their (width, height) and Nx5 label arrays """
+        counts = np.array([len(rows) for rows in labels], dtype=np.int64)
+        names = [image.encode() for image in images]
+        sections = {
+            'offsets': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            'labels': np.concatenate(labels).astype(np.float32) if labels else np.empty((0, 5), dtype=np.float32),
+            'sizes': np.asarray(sizes, dtype=np.int32).reshape(-1, 2),
+            'names': np.frombuffer(b''.join(names), dtype=np.uint8),
+            'name_offsets': np.concatenate([[0], np.cumsum([len(n) for n in names])]).astype(np.int64),
+        }
+        relative = {}
+        offset = 0
+        for name, array in sections.items():
+            relative[name] = offset
+            offset += -(-array.nbytes // cls.align) * cls.align
+        start = 0
+        while True:  # the sections start after the header, whose length depends on their offsets
+            layout = {name: [start + relative[name], array.dtype.str, list(array.shape)] for name, array in sections.items()}
+            header = json.dumps({'classes': list(classes), 'sections': layout}).encode()
+            if 24 + len(header) <= start:
+                break
+            start = -(-(24 + len(header)) // cls.align) * cls.align
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(cls.magic + np.uint64(len(header)).tobytes() + header)
+            for name, array in sections.items():
+                f.seek(layout[name][0])
+                f.write(array.tobytes())
+            f.truncate(max([start] + [layout[name][0] + array.nbytes for name, array in sections.items()]))
+        os.replace(tmp, path)
+
+
+def convert_dataset(directories, class_map, cache=None, output=None, workers=None, chunksize=64):
+    """ Convert the labelled images of the directories to YOLO labels in parallel.
+        Write the packed label cache and, if output is given, YOLO label files under it with the relative paths
+        of the images. Return number of the converted images """
+    tasks = [(path, label_path) for directory in directories for path, label_path in walk(directory)
+             if label_path is not None]
+    tasks.sort()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(convert, tasks, chunksize=chunksize))
+    images, sizes, labels = [], [], []
+    for path, size, classes, boxes in results:  # class ids are given in one process, so they are consistent
+        ids = class_map.ids(classes)
+        images.append(os.path.abspath(path))
+        sizes.append(size)
+        labels.append(np.concatenate([ids[:, None].astype(np.float32), boxes], axis=1))
+    if output is not None:
+        root = os.path.commonpath([os.path.abspath(directory) for directory in directories])  # may be mixed
+
+        def write(item):
+            (path, _), rows = item
+            relative = os.path.relpath(os.path.splitext(os.path.abspath(path))[0] + '.txt', root)
+            target = os.path.join(output, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            write_labels(target, rows[:, 0].astype(np.int32), rows[:, 1:])
+        with ThreadPoolExecutor(max_workers=8) as pool:  # the writes wait for the disk, not for the interpreter
+            list(pool.map(write, zip(tasks, labels)))
+    if cache is not None:
+        LabelCache.write(cache, images, sizes, labels, class_map.names)
+    return len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO labels of the dataset")
+    parser.add_argument("--classes", default="classes.names", help="class names file, the line number is the class id")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="convert the label files to YOLO labels")
+    convert_parser.add_argument("directories", nargs="+", help="folders of the images, subfolders included")
+    convert_parser.add_argument("--cache", default="labels.cache", help="packed label cache")
+    convert_parser.add_argument("--output", help="folder of the YOLO label files, none are written if it is not given")
+    convert_parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes")
+
+    info_parser = subparsers.add_parser("info", help="print summary of the label cache")
+    info_parser.add_argument("cache", nargs="?", default="labels.cache")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        start = time.perf_counter()
+        count = convert_dataset(args.directories, ClassMap(args.classes), args.cache, args.output, args.workers)
+        print(f"{count} images converted in {time.perf_counter() - start:.2f} s")
+    elif args.command == "info":
+        start = time.perf_counter()
+        cache = LabelCache(args.cache)
+        print(f"opened in {1000 * (time.perf_counter() - start):.2f} ms")
+        print(f"{len(cache)} images, {len(cache.labels)} labels, {len(cache.classes)} classes")
+        counts = np.bincount(cache.labels[:, 0].astype(np.int64), minlength=len(cache.classes))
+        for name, count in zip(cache.classes, counts.tolist()):
+            print(f"{name:<20} {count:8d}")
+
+
+if __name__ == "__main__":
+    main()